@@ -59,6 +59,8 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # Per-request memoized customer / open order as request.cart (needs request.user)
+    'store.middleware.CartMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'allauth.account.middleware.AccountMiddleware',
@@ -383,6 +385,17 @@ SERVER_EMAIL = config('SERVER_EMAIL', default=DEFAULT_FROM_EMAIL)
 # Add these to your .env file and Railway environment variables
 PAYSTACK_PUBLIC_KEY = config('PAYSTACK_PUBLIC_KEY', default='')
 PAYSTACK_SECRET_KEY = config('PAYSTACK_SECRET_KEY', default='')
+# Recorded on each order at checkout (Order.currency); the amount Paystack charges is in this currency
+STORE_CURRENCY = config('STORE_CURRENCY', default='GHS')
+# Verification calls go through one pooled session (store/payments.py). Point PAYSTACK_API_BASE
+# at a local stand-in server to test the flow without touching Paystack.
+PAYSTACK_API_BASE = config('PAYSTACK_API_BASE', default='https://api.paystack.co')
+PAYSTACK_CONNECT_TIMEOUT = config('PAYSTACK_CONNECT_TIMEOUT', default=3.05, cast=float)
+PAYSTACK_TIMEOUT = config('PAYSTACK_TIMEOUT', default=10, cast=float)
+PAYSTACK_MAX_RETRIES = config('PAYSTACK_MAX_RETRIES', default=2, cast=int)
+# Local testing only: let process_order complete a cart without a Paystack reference.
+# Ignored unless DEBUG is on; production checkout always requires a verified payment.
+ALLOW_UNPAID_CHECKOUT = DEBUG and config('ALLOW_UNPAID_CHECKOUT', default=False, cast=bool)
 
 # Celery / Redis configuration (for background tasks)
 # Provide REDIS_URL in Railway variables (e.g. redis://:<password>@<host>:<port>/0)
@@ -395,6 +408,62 @@ else:
     CELERY_BROKER_URL = config('CELERY_BROKER_URL', default='redis://localhost:6379/0')
     CELERY_RESULT_BACKEND = CELERY_BROKER_URL
 
+# Shared cache (storefront fragments etc.): Redis when REDIS_URL is set so all
+# gunicorn workers share one copy, otherwise a per-process local-memory cache.
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Whether every process (gunicorn workers, Celery) sees the same cache. The storefront
+# fragment cache and the typeahead index invalidate across processes through it, so both
+# switch themselves off on a per-process cache rather than serve stale catalog data.
+SHARED_CACHE = config('SHARED_CACHE', default=bool(REDIS_URL), cast=bool)
+
+# How long rendered storefront sections may live in the cache (seconds). Catalog
+# edits invalidate the affected entries immediately, so this is only a safety net.
+STOREFRONT_CACHE_TIMEOUT = config('STOREFRONT_CACHE_TIMEOUT', default=6 * 60 * 60, cast=int)
+# How long resolved media URLs are memoized (seconds); capped for signed S3 URLs
+MEDIA_URL_CACHE_TIMEOUT = config('MEDIA_URL_CACHE_TIMEOUT', default=60 * 60, cast=int)
+# Cached navbar cart summary (count / total / shipping); the TTL bounds drift from admin price edits
+CART_SUMMARY_TIMEOUT = config('CART_SUMMARY_TIMEOUT', default=15 * 60, cast=int)
+# Empty open carts older than this many days are removed by `manage.py purge_abandoned_carts`
+CART_ABANDON_DAYS = config('CART_ABANDON_DAYS', default=30, cast=int)
+# How long units added to a cart stay reserved for it (seconds); every cart change renews the hold
+STOCK_RESERVATION_TTL = config('STOCK_RESERVATION_TTL', default=15 * 60, cast=int)
+# How long a stored response is replayed for repeats of the same Idempotency-Key (seconds)
+IDEMPOTENCY_KEY_TTL = config('IDEMPOTENCY_KEY_TTL', default=24 * 60 * 60, cast=int)
+
+# Products shown per storefront category section before "Show more" is needed
+STOREFRONT_SECTION_SIZE = config('STOREFRONT_SECTION_SIZE', default=12, cast=int)
+# "Frequently bought together": partners kept per product, and the minimum number of shared orders
+RECOMMENDATIONS_TOP_K = config('RECOMMENDATIONS_TOP_K', default=10, cast=int)
+RECOMMENDATIONS_MIN_SUPPORT = config('RECOMMENDATIONS_MIN_SUPPORT', default=1, cast=int)
+# Rows per page on the portal order list (keyset-paginated, newest first)
+PORTAL_ORDERS_PAGE_SIZE = config('PORTAL_ORDERS_PAGE_SIZE', default=50, cast=int)
+# Rows fetched per database round trip by the streamed portal exports (store/exports.py)
+EXPORT_CHUNK_SIZE = config('EXPORT_CHUNK_SIZE', default=2000, cast=int)
+# Analytics beacons are buffered per worker and written in batches (store/page_views.py):
+# flush at this many events or after this many seconds; keep at most PAGEVIEW_BUFFER_MAX
+# while the database is unreachable. PAGEVIEW_BATCH_SIZE=0 writes every beacon immediately.
+PAGEVIEW_BATCH_SIZE = config('PAGEVIEW_BATCH_SIZE', default=200, cast=int)
+PAGEVIEW_FLUSH_INTERVAL = config('PAGEVIEW_FLUSH_INTERVAL', default=5, cast=float)
+PAGEVIEW_BUFFER_MAX = config('PAGEVIEW_BUFFER_MAX', default=10000, cast=int)
+# Upper edges (GHC) of the store front price-range facet; the last band is open-ended
+STORE_PRICE_BANDS = config(
+    'STORE_PRICE_BANDS', default='100,500,1000,5000',
+    cast=lambda v: [int(edge) for edge in v.split(',') if edge.strip()],
+)
+
 # Celery serialization settings
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
@@ -42,8 +42,11 @@ portal_urlpatterns = [
     path('categories/<int:pk>/move-down/', store_views.move_category_down, name='move_category_down'),
     
     path('orders/', store_views.orders_list, name='orders_list'),
+    path('orders/export/', store_views.export_orders, name='export_orders'),
     path('orders/<int:pk>/', store_views.order_detail, name='order_detail'),
     path('log/all/', store_views.all_activity_log_view, name='all_activity_log'),
+    path('log/all/export/', store_views.export_activity_log, name='export_activity_log'),
+    path('dashboard/analytics/page-views/export/', store_views.export_page_views, name='export_page_views'),
     path('service_requests/chat/<int:pk>/', services_views.staff_service_request_chat, name='staff_chat'),
 
     # STAFF LOGOUT PATH 
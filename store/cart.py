@@ -0,0 +1,343 @@
+# store/cart.py
+"""Per-request customer and open-order (cart) lookup.
+
+`CartMiddleware` attaches a `RequestCart` as ``request.cart``. Nothing is
+queried until an attribute is first read; after that the result is reused for
+the rest of the request. So the navbar count (cartData / the cart_count context
+processor) and the view itself resolve the customer and the cart at most once
+between them.
+
+Anonymous visitors get the signed-cookie cart from store/guest_cart.py through
+the same attributes (``order`` / ``items`` / ``item_count``), so the cart views
+don't need a separate guest branch.
+
+The navbar only needs a summary (item count, total, shipping flag), so that is
+kept in the shared cache per user. A page that doesn't otherwise touch the cart
+renders the badge without any queries. update_item and process_order rewrite
+the summary after every change; a miss rebuilds it from the database.
+"""
+import logging
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from datetime import timedelta
+
+from django.db.models import Exists, OuterRef, prefetch_related_objects
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+from . import guest_cart, reservations
+from .models import Customer, Order, OrderItem, Product
+
+logger = logging.getLogger(__name__)
+
+EMPTY_SUMMARY = {'count': 0, 'total': '0.00', 'shipping': False}
+
+
+def summary_key(user_id):
+    return f'cart:summary:{user_id}'
+
+
+def _summary_timeout():
+    return getattr(settings, 'CART_SUMMARY_TIMEOUT', 15 * 60)
+
+
+def summarize(items):
+    """Build the cached summary dict from loaded OrderItems (products already attached)."""
+    total = sum((item.get_total for item in items), Decimal('0.00'))
+    return {
+        'count': sum(item.quantity or 0 for item in items),
+        'total': f'{total:.2f}',
+        'shipping': any(item.product and not item.product.digital for item in items),
+    }
+
+
+class RequestCart:
+    """Lazily resolved customer, open order and its items for one request."""
+
+    def __init__(self, request):
+        self.request = request
+
+    @cached_property
+    def customer(self):
+        """The logged-in user's Customer (created on first use), or None for anonymous visitors."""
+        user = self.request.user
+        if not user.is_authenticated:
+            return None
+        try:
+            return user.customer
+        except Customer.DoesNotExist:
+            return Customer.objects.create(user=user, name=user.username, email=user.email)
+
+    @cached_property
+    def guest_lines(self):
+        """The anonymous visitor's cookie cart as {product_id: quantity} (always empty once logged in)."""
+        if self.request.user.is_authenticated:
+            return {}
+        return guest_cart.read(self.request)
+
+    def set_guest_lines(self, lines):
+        """Replace the cookie cart for the rest of the request; the caller writes the cookie."""
+        self.invalidate()
+        self.__dict__.pop('order', None)
+        self.__dict__['guest_lines'] = lines
+
+    @cached_property
+    def order(self):
+        """The customer's open (incomplete) order, or None if they haven't added anything yet.
+
+        For anonymous visitors this is a GuestOrder over the cookie cart. Read paths
+        never create a cart; see get_or_create_order().
+        """
+        if self.customer is None:
+            return guest_cart.GuestOrder(self.items) if self.guest_lines else None
+        return Order.objects.filter(customer=self.customer, complete=False).order_by('-id').first()
+
+    def get_or_create_order(self):
+        """The open order, creating it now. Only update_item calls this, so browsing never writes a cart."""
+        if self.order is None and self.customer is not None:
+            order, created = Order.objects.get_or_create(customer=self.customer, complete=False)
+            self.__dict__['order'] = order
+        return self.order
+
+    @cached_property
+    def items(self):
+        """OrderItems of the open order with their products, loaded in one go.
+
+        Also primes ``order.orderitem_set``, so Order.get_cart_total / get_cart_items / shipping
+        don't query again.
+        """
+        if self.customer is None:
+            # One bulk Product lookup prices the whole cookie cart
+            return guest_cart.build_items(self.guest_lines)
+        if self.order is None:
+            return []
+        prefetch_related_objects([self.order], 'orderitem_set__product')
+        return list(self.order.orderitem_set.all())
+
+    @cached_property
+    def item_count(self):
+        if self.customer is None:
+            return sum(self.guest_lines.values())
+        return sum(item.quantity or 0 for item in self.items)
+
+    @cached_property
+    def summary(self):
+        """Cached {'count', 'total', 'shipping'} for the navbar; rebuilt from the cart on a miss.
+
+        Guests get the count straight from the cookie; pricing it would need a product lookup.
+        """
+        user = self.request.user
+        if not user.is_authenticated:
+            return {'count': self.item_count, 'total': None, 'shipping': None}
+        try:
+            summary = cache.get(summary_key(user.pk))
+        except Exception:
+            # The cache is an optimisation only
+            summary = None
+        if summary is None:
+            summary = self._store_summary()
+        return summary
+
+    def _store_summary(self, empty=False):
+        if self.request.user.is_anonymous:
+            return {'count': self.item_count, 'total': None, 'shipping': None}
+        if empty:
+            summary = dict(EMPTY_SUMMARY)
+        else:
+            summary = summarize(self.items) if self.order is not None else dict(EMPTY_SUMMARY)
+        key, timeout = summary_key(self.request.user.pk), _summary_timeout()
+
+        def _set():
+            try:
+                cache.set(key, summary, timeout)
+            except Exception:
+                logger.warning("Could not cache the cart summary for user %s", self.request.user.pk, exc_info=True)
+
+        # Publish only what has committed, so a rolled-back change never reaches the navbar
+        transaction.on_commit(_set)
+        return summary
+
+    def refresh_summary(self, empty=False):
+        """Recompute and republish the summary after the cart changed (update_item / process_order).
+
+        ``empty=True`` publishes an empty summary without loading (or creating) an open order.
+        """
+        self.invalidate()
+        self.__dict__['summary'] = self._store_summary(empty)
+        return self.summary
+
+    def invalidate(self):
+        """Forget the loaded items after the cart was modified during this request."""
+        for name in ('items', 'item_count', 'summary'):
+            self.__dict__.pop(name, None)
+        if 'order' in self.__dict__ and self.order is not None:
+            getattr(self.order, '_prefetched_objects_cache', {}).pop('orderitem_set', None)
+
+    def reset(self):
+        """Forget everything, e.g. after the open order was completed or the user logged in."""
+        for name in ('customer', 'guest_lines', 'order', 'items', 'item_count', 'summary'):
+            self.__dict__.pop(name, None)
+
+
+# -------------------------------------------------------------------------------------
+# --- BATCH MUTATION (update_cart view) ---
+# -------------------------------------------------------------------------------------
+
+BATCH_ACTIONS = ('add', 'remove', 'delete', 'set', 'clear')
+MAX_BATCH_OPERATIONS = 100
+
+
+def parse_operations(payload):
+    """Validate an update_cart body into a list of ``(product_id, action, amount)`` tuples.
+
+    Raises guest_cart.CartError (code ``invalid``) pointing at the first bad operation.
+    """
+    operations = payload.get('operations') if isinstance(payload, dict) else None
+    if not isinstance(operations, list) or not operations:
+        raise guest_cart.CartError('Expected a non-empty "operations" list.', code='invalid')
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        raise guest_cart.CartError(f'At most {MAX_BATCH_OPERATIONS} operations per request.', code='invalid')
+
+    parsed = []
+    for index, operation in enumerate(operations):
+        action = operation.get('action') if isinstance(operation, dict) else None
+        if action not in BATCH_ACTIONS:
+            raise guest_cart.CartError('Unknown or missing action.', code='invalid', index=index)
+        if action == 'clear':
+            parsed.append((None, action, 0))
+            continue
+        try:
+            product_id = int(operation.get('productId'))
+            amount = int(operation.get('quantity', 1))
+        except (TypeError, ValueError):
+            raise guest_cart.CartError('productId and quantity must be whole numbers.', code='invalid', index=index)
+        if amount < 0 or (amount == 0 and action in ('add', 'remove')):
+            raise guest_cart.CartError('Quantity must be a positive number.', code='invalid', index=index)
+        parsed.append((product_id, action, amount))
+    return parsed
+
+
+def apply_operations(lines, operations, products, max_lines=None):
+    """Apply parsed operations to ``{product_id: quantity}`` in order; the first failure aborts the batch."""
+    for index, (product_id, action, amount) in enumerate(operations):
+        if action == 'clear':
+            lines.clear()
+            continue
+        product = products.get(product_id)
+        if product is None:
+            raise guest_cart.CartError('Product not found.', code='not_found', index=index)
+        try:
+            guest_cart.apply(lines, product, action, amount, max_lines)
+        except guest_cart.CartError as exc:
+            exc.index = index
+            raise
+    return lines
+
+
+@transaction.atomic
+def apply_batch(cart, operations):
+    """Apply a whole batch to ``cart`` (a RequestCart): all of it or, on CartError, none of it.
+
+    One bulk Product fetch, one locked read of the order's lines, the stock holds
+    (store/reservations.py), then bulk_create / bulk_update / a single delete.
+    Guests only get their cookie lines updated; the caller writes the cookie.
+    Returns the new ``{product_id: quantity}``.
+    """
+    products = Product.objects.in_bulk({product_id for product_id, action, _ in operations if action != 'clear'})
+    if cart.customer is None:
+        lines = apply_operations(dict(cart.guest_lines), operations, products, guest_cart.MAX_LINES)
+        cart.set_guest_lines(lines)
+        return lines
+
+    order = cart.order
+    existing = {}
+    if order is not None:
+        existing = {
+            item.product_id: item
+            for item in OrderItem.objects.select_for_update().filter(order=order, product__isnull=False)
+        }
+    lines = apply_operations(
+        {product_id: item.quantity for product_id, item in existing.items() if (item.quantity or 0) > 0},
+        operations, products,
+    )
+
+    if order is None:
+        if not lines:
+            return lines
+        order = cart.get_or_create_order()
+    try:
+        reservations.hold(order, {product_id: lines.get(product_id, 0) for product_id in set(existing) | set(lines)})
+    except reservations.InsufficientStock as exc:
+        index = next((i for i, op in enumerate(operations) if op[0] == exc.product_id), None)
+        raise guest_cart.CartError(
+            f'Cannot add more. Only {exc.available} units available in stock.', code='insufficient_stock', index=index,
+        )
+
+    to_create, to_update = [], []
+    for product_id, quantity in lines.items():
+        item = existing.get(product_id)
+        if item is None:
+            to_create.append(OrderItem(order=order, product=products[product_id], quantity=quantity))
+        elif item.quantity != quantity:
+            item.quantity = quantity
+            to_update.append(item)
+    removed = [item.pk for product_id, item in existing.items() if product_id not in lines]
+
+    if removed:
+        OrderItem.objects.filter(pk__in=removed).delete()
+    OrderItem.objects.bulk_create(to_create)
+    OrderItem.objects.bulk_update(to_update, ['quantity'])
+    cart.refresh_summary()
+    return lines
+
+
+def get_request_cart(request):
+    """Return ``request.cart``, attaching one if CartMiddleware didn't run (e.g. RequestFactory requests)."""
+    cart = getattr(request, 'cart', None)
+    if cart is None:
+        cart = request.cart = RequestCart(request)
+    return cart
+
+
+# -------------------------------------------------------------------------------------
+# --- ABANDONED CART PURGE (manage.py purge_abandoned_carts / store.tasks.purge_abandoned_carts) ---
+# -------------------------------------------------------------------------------------
+
+def abandoned_empty_carts(days=None):
+    """Open orders older than ``days`` (CART_ABANDON_DAYS) with nothing in them."""
+    days = days if days is not None else getattr(settings, 'CART_ABANDON_DAYS', 30)
+    cutoff = timezone.now() - timedelta(days=days)
+    return Order.objects.filter(complete=False, date_ordered__lt=cutoff).exclude(
+        Exists(OrderItem.objects.filter(order=OuterRef('pk'), quantity__gt=0))
+    )
+
+
+def purge_abandoned_carts(days=None, batch_size=1000):
+    """Delete abandoned empty carts in batches of ``batch_size``; returns how many were removed.
+
+    Each batch is its own short statement, so a large backlog never holds long locks.
+    The batch is locked and re-checked inside its transaction: a cart that got an
+    item (or was checked out) since it was picked is left alone, lines included.
+    """
+    deleted = 0
+    last_pk = 0
+    while True:
+        candidates = list(
+            abandoned_empty_carts(days).filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:batch_size]
+        )
+        if not candidates:
+            return deleted
+        last_pk = candidates[-1]
+        with transaction.atomic():
+            # Lock the carts, then keep only those still abandoned and empty. A line inserted after
+            # the lock waits on it (the FK check needs the order row), so none can slip in unseen
+            locked = list(Order.objects.select_for_update().filter(pk__in=candidates).values_list('pk', flat=True))
+            batch = list(abandoned_empty_carts(days).filter(pk__in=locked).values_list('pk', flat=True))
+            if batch:
+                # Zero-quantity leftovers would otherwise survive as orphans (order is SET_NULL)
+                OrderItem.objects.filter(order_id__in=batch).delete()
+                Order.objects.filter(pk__in=batch).delete()
+        deleted += len(batch)
@@ -0,0 +1,165 @@
+# store/exports.py
+"""Streaming CSV / NDJSON exports for the portal (orders, activity log, page views).
+
+Rows are produced from ``QuerySet.iterator(chunk_size=EXPORT_CHUNK_SIZE)`` and
+written straight into a ``StreamingHttpResponse``. Nothing holds the whole
+result: the database cursor, the encoder and (with ``?gzip=1``) the compressor
+each work on one chunk at a time. A million-row export therefore runs in
+constant memory, and the first bytes go out straight away instead of after the
+last row is built, so a long export doesn't trip the proxy's response timeout.
+
+Orders are exported with their lines. CSV gets one row per line with the order
+columns repeated, and NDJSON gets one object per order with a ``lines`` list.
+The lines are prefetched per chunk (``iterator`` + ``prefetch_related``), so
+each chunk is one extra query, not one per order.
+"""
+import csv
+import json
+import zlib
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import Prefetch
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from .models import OrderItem
+
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+}
+# gzip bytes are flushed to the client once this much compressed output has built up
+GZIP_FLUSH_BYTES = 64 * 1024
+
+
+def _chunk_size():
+    return getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+
+
+class _Echo:
+    """File-like object whose write() hands the line back, so csv.writer can feed a generator."""
+
+    def write(self, value):
+        return value
+
+
+def _csv_lines(header, rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def _ndjson_lines(header, rows):
+    for row in rows:
+        record = row if isinstance(row, dict) else dict(zip(header, row))
+        yield json.dumps(record, default=str, separators=(',', ':')) + '\n'
+
+
+def _gzipped(chunks):
+    """Compress ``chunks`` (bytes) into one gzip stream, yielding output as it accumulates."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    pending = []
+    pending_size = 0
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            pending.append(data)
+            pending_size += len(data)
+        if pending_size >= GZIP_FLUSH_BYTES:
+            yield b''.join(pending)
+            pending, pending_size = [], 0
+    pending.append(compressor.flush())
+    yield b''.join(pending)
+
+
+def stream(name, header, rows, fmt='csv', compress=False):
+    """StreamingHttpResponse downloading ``rows`` as ``<name>-<date>.csv`` / ``.ndjson`` (+ ``.gz``).
+
+    ``rows`` is an iterable of sequences matching ``header``, or of dicts for
+    NDJSON-only shapes. It is consumed lazily while the response is sent.
+    """
+    if fmt not in FORMATS:
+        fmt = 'csv'
+    lines = _csv_lines(header, rows) if fmt == 'csv' else _ndjson_lines(header, rows)
+    chunks = (line.encode('utf-8') for line in lines)
+    filename = f"{name}-{timezone.localdate():%Y%m%d}.{fmt}"
+    if compress:
+        chunks = _gzipped(chunks)
+        filename += '.gz'
+        response = StreamingHttpResponse(chunks, content_type='application/gzip')
+    else:
+        response = StreamingHttpResponse(chunks, content_type=FORMATS[fmt])
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    # Proxies must not buffer (or re-compress) the download
+    response['X-Accel-Buffering'] = 'no'
+    response['Cache-Control'] = 'no-store'
+    return response
+
+
+# -------------------------------------------------------------------------------------
+# --- DATASETS ---
+# -------------------------------------------------------------------------------------
+
+ORDER_FIELDS = ['order_id', 'date_ordered', 'customer', 'email', 'status', 'transaction_id', 'currency', 'order_total', 'item_count']
+LINE_FIELDS = ['product_id', 'product', 'quantity', 'unit_price', 'line_total']
+
+
+def _money(value):
+    # SQL sums come back with backend-dependent scale
+    return Decimal(value).quantize(Decimal('0.01')) if value not in (None, '') else ''
+
+
+def _unit_price(item):
+    # The checkout snapshot; open carts fall back to today's price
+    if item.unit_price is not None:
+        return item.unit_price
+    return item.product.selling_price if item.product else ''
+
+
+def order_rows(orders, fmt='csv'):
+    """Rows for ORDER_FIELDS + LINE_FIELDS (csv) or one dict per order with ``lines`` (ndjson).
+
+    ``orders`` should already carry with_totals() and select_related('customer').
+    """
+    lines = Prefetch('orderitem_set', queryset=OrderItem.objects.select_related('product').order_by('pk'))
+    for order in orders.prefetch_related(lines).iterator(chunk_size=_chunk_size()):
+        customer = order.customer
+        head = [
+            order.pk, order.date_ordered.isoformat(), customer.name if customer else '', customer.email if customer else '',
+            order.status, order.transaction_id or '', order.currency, _money(order.get_cart_total), order.get_cart_items,
+        ]
+        items = [
+            [item.product_id, item.product.name if item.product else '', item.quantity or 0, _money(_unit_price(item)), _money(item.get_total)]
+            for item in order.orderitem_set.all()
+        ]
+        if fmt == 'ndjson':
+            record = dict(zip(ORDER_FIELDS, head))
+            record['lines'] = [dict(zip(LINE_FIELDS, item)) for item in items]
+            yield record
+            continue
+        for item in items or [[''] * len(LINE_FIELDS)]:
+            yield head + item
+
+
+ACTIVITY_FIELDS = ['id', 'action_time', 'user', 'action_type', 'object_id', 'object_repr', 'description']
+
+
+def activity_rows(logs):
+    values = logs.values_list(
+        'pk', 'action_time', 'user__username', 'action_type', 'object_id', 'object_repr', 'description',
+    )
+    for pk, action_time, username, *rest in values.iterator(chunk_size=_chunk_size()):
+        yield [pk, action_time.isoformat(), username or '', *rest]
+
+
+PAGE_VIEW_FIELDS = ['id', 'timestamp', 'path', 'title', 'user', 'session_key', 'referrer', 'ip_address', 'duration']
+
+
+def page_view_rows(page_views):
+    values = page_views.values_list(
+        'pk', 'timestamp', 'path', 'title', 'user__username', 'session_key', 'referrer', 'ip_address', 'duration',
+    )
+    for pk, timestamp, *rest in values.iterator(chunk_size=_chunk_size()):
+        yield [pk, timestamp.isoformat(), *rest]
@@ -0,0 +1,234 @@
+# store/facets.py
+"""Catalog facets for store_view: category, price band, discount-only and in-stock.
+
+Counts are precomputed. `ProductFacetValue` records which facet values each
+product currently carries and `FacetCount` holds the per-value totals, so the
+facet panel is one small indexed read instead of GROUP BYs over Product and
+the categories M2M table. `sync_product()` diffs a product's stored values
+against its current state and adjusts the counters with F() updates; it is
+called from the receivers in store.signals. `manage.py rebuild_facets`
+recomputes everything from scratch.
+
+Category, price and discount counts cover in-stock products only (what the
+store front shows by default); the stock facet counts both states.
+"""
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import Category, FacetCount, Product, ProductFacetValue, discount_active_q
+
+FACET_CATEGORY = 'category'
+FACET_PRICE = 'price'
+FACET_DISCOUNT = 'discount'
+FACET_STOCK = 'stock'
+
+IN_STOCK = 'in'
+OUT_OF_STOCK = 'out'
+ON_DISCOUNT = 'yes'
+
+
+# -------------------------------------------------------------------------------------
+# --- PRICE BANDS ---
+# -------------------------------------------------------------------------------------
+
+def _band_edges():
+    return [Decimal(str(edge)) for edge in getattr(settings, 'STORE_PRICE_BANDS', [100, 500, 1000, 5000])]
+
+
+def price_bands():
+    """Ordered list of (key, low, high) tuples; high is None for the open-ended top band."""
+    edges = [Decimal('0')] + _band_edges()
+    bands = []
+    for low, high in zip(edges, edges[1:] + [None]):
+        key = f'{low:f}-{high:f}' if high is not None else f'{low:f}+'
+        bands.append((key, low, high))
+    return bands
+
+
+def price_band(amount):
+    for key, low, high in price_bands():
+        if amount >= low and (high is None or amount < high):
+            return key
+    return None
+
+
+def band_label(key):
+    for band_key, low, high in price_bands():
+        if band_key == key:
+            return f'GHC{low:,.0f}+' if high is None else f'GHC{low:,.0f} - GHC{high:,.0f}'
+    return key
+
+
+# -------------------------------------------------------------------------------------
+# --- FACET VALUES PER PRODUCT ---
+# -------------------------------------------------------------------------------------
+
+def product_facet_values(product, category_ids=None):
+    """The set of (facet, value) pairs `product` should currently be counted under."""
+    if product.stock_quantity <= 0:
+        return {(FACET_STOCK, OUT_OF_STOCK)}
+
+    if category_ids is None:
+        category_ids = Category.objects.filter(products=product.pk).values_list('id', flat=True)
+    values = {(FACET_STOCK, IN_STOCK), (FACET_PRICE, price_band(product.selling_price))}
+    values.update((FACET_CATEGORY, str(category_id)) for category_id in category_ids)
+    # Price band and discount follow the same rule as effective_price (see discount_active_q)
+    if product.selling_price < product.price:
+        values.add((FACET_DISCOUNT, ON_DISCOUNT))
+    return values
+
+
+def _adjust_counts(pairs, delta):
+    for facet, value in pairs:
+        updated = FacetCount.objects.filter(facet=facet, value=value).update(count=F('count') + delta)
+        if updated:
+            continue
+        try:
+            with transaction.atomic():
+                FacetCount.objects.create(facet=facet, value=value, count=max(delta, 0))
+        except IntegrityError:
+            # Another writer created the row first
+            FacetCount.objects.filter(facet=facet, value=value).update(count=F('count') + delta)
+
+
+def _current_values(product_id):
+    return set(ProductFacetValue.objects.filter(product_id=product_id).values_list('facet', 'value'))
+
+
+@transaction.atomic
+def sync_product(product_id, wanted=None):
+    """Bring one product's facet rows and the counters in line with its current state.
+
+    `wanted` overrides the computed values (an empty set removes the product, e.g. on delete).
+    The product row is locked so concurrent saves of it take turns, and the counters move
+    by the rows actually deleted and inserted, never by the computed difference alone.
+    """
+    product = Product.objects.select_for_update().filter(pk=product_id).first()
+    if wanted is None:
+        wanted = product_facet_values(product) if product is not None else set()
+
+    current = _current_values(product_id)
+    removed = current - wanted
+    added = wanted - current
+    if not removed and not added:
+        return
+
+    deleted = []
+    for facet, value in removed:
+        count, _ = ProductFacetValue.objects.filter(product_id=product_id, facet=facet, value=value).delete()
+        if count:
+            deleted.append((facet, value))
+    inserted = []
+    for facet, value in added:
+        try:
+            with transaction.atomic():
+                ProductFacetValue.objects.create(product_id=product_id, facet=facet, value=value)
+        except IntegrityError:
+            # Already there (e.g. written by a rebuild); it is counted already
+            continue
+        inserted.append((facet, value))
+    _adjust_counts(deleted, -1)
+    _adjust_counts(inserted, 1)
+
+
+@transaction.atomic
+def drop_category(category_id):
+    """A category was deleted: its membership rows and counter go with it."""
+    ProductFacetValue.objects.filter(facet=FACET_CATEGORY, value=str(category_id)).delete()
+    FacetCount.objects.filter(facet=FACET_CATEGORY, value=str(category_id)).delete()
+
+
+@transaction.atomic
+def rebuild():
+    """Recompute every product's facet rows and all counters. Returns the number of products."""
+    memberships = {}
+    for product_id, category_id in Product.categories.through.objects.values_list('product_id', 'category_id'):
+        memberships.setdefault(product_id, []).append(category_id)
+
+    ProductFacetValue.objects.all().delete()
+    FacetCount.objects.all().delete()
+
+    rows = []
+    totals = {}
+    count = 0
+    for product in Product.objects.all().iterator(chunk_size=500):
+        count += 1
+        for facet, value in product_facet_values(product, memberships.get(product.pk, [])):
+            rows.append(ProductFacetValue(product_id=product.pk, facet=facet, value=value))
+            totals[(facet, value)] = totals.get((facet, value), 0) + 1
+        if len(rows) >= 1000:
+            ProductFacetValue.objects.bulk_create(rows)
+            rows = []
+    ProductFacetValue.objects.bulk_create(rows)
+    FacetCount.objects.bulk_create(
+        [FacetCount(facet=facet, value=value, count=total) for (facet, value), total in totals.items()]
+    )
+    return count
+
+
+# -------------------------------------------------------------------------------------
+# --- READ PATH (store_view) ---
+# -------------------------------------------------------------------------------------
+
+def parse_filters(params):
+    """Extract the facet selection from request.GET. Unknown or malformed values are ignored."""
+    filters = {}
+    category = params.get('category', '')
+    if category.isdigit():
+        filters[FACET_CATEGORY] = category
+    price = params.get('price', '')
+    if any(price == key for key, _, _ in price_bands()):
+        filters[FACET_PRICE] = price
+    if params.get('discount') == '1':
+        filters[FACET_DISCOUNT] = ON_DISCOUNT
+    if params.get('stock') == 'all':
+        filters[FACET_STOCK] = 'all'
+    return filters
+
+
+def filter_products(filters):
+    """One queryset implementing the facet selection (unordered; see storefront_cache.product_page)."""
+    products = Product.objects.all()
+    if filters.get(FACET_STOCK) != 'all':
+        products = products.filter(stock_quantity__gt=0)
+    if FACET_CATEGORY in filters:
+        products = products.filter(categories=filters[FACET_CATEGORY])
+    if FACET_DISCOUNT in filters:
+        products = products.filter(discount_active_q())
+    if FACET_PRICE in filters:
+        for key, low, high in price_bands():
+            if key == filters[FACET_PRICE]:
+                products = products.filter(effective_price__gte=low)
+                if high is not None:
+                    products = products.filter(effective_price__lt=high)
+    return products
+
+
+def facet_panel():
+    """Facet options with their precomputed counts, ready for the template.
+
+    Category, price and discount counts are of in-stock products only, also when
+    ``stock=all`` is selected; the template labels them so.
+    """
+    counts = {(row.facet, row.value): row.count for row in FacetCount.objects.filter(count__gt=0)}
+
+    categories = [
+        {'value': str(category.pk), 'label': category.name, 'count': counts[(FACET_CATEGORY, str(category.pk))]}
+        for category in Category.objects.order_by('display_order', 'name')
+        if (FACET_CATEGORY, str(category.pk)) in counts
+    ]
+    prices = [
+        {'value': key, 'label': band_label(key), 'count': counts[(FACET_PRICE, key)]}
+        for key, _, _ in price_bands()
+        if (FACET_PRICE, key) in counts
+    ]
+    return {
+        'categories': categories,
+        'prices': prices,
+        'discount_count': counts.get((FACET_DISCOUNT, ON_DISCOUNT), 0),
+        'in_stock_count': counts.get((FACET_STOCK, IN_STOCK), 0),
+        'out_of_stock_count': counts.get((FACET_STOCK, OUT_OF_STOCK), 0),
+    }
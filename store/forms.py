@@ -87,7 +87,7 @@ class ProductEditForm(forms.ModelForm):
     """
     class Meta:
         model = Product
-        fields = ['name', 'price', 'discount_price', 'stock_quantity', 'digital', 'categories'] 
+        fields = ['name', 'price', 'discount_price', 'stock_quantity', 'digital', 'categories', 'display_order'] 
         labels = {
             'name': 'Product Name',
             'price': 'Price (GHC)',
@@ -95,6 +95,7 @@ class ProductEditForm(forms.ModelForm):
             'stock_quantity': 'Stock Quantity Remaining',
             'digital': 'Is this a digital product?',
             'categories': 'Categories',
+            'display_order': 'Display Order',
         }
         widgets = {
             'description': forms.Textarea(attrs={'rows': 4}),
@@ -0,0 +1,181 @@
+# store/guest_cart.py
+"""Cookie-backed cart for anonymous visitors.
+
+The cart is a signed cookie holding ``{"<product id>": quantity, ...}``, so
+adding to it writes nothing to the database. It is priced with a single bulk
+Product lookup only when the cart or checkout page is rendered
+(`RequestCart.items`). On login, `merge_into_customer` folds it into the
+customer's open Order in one transaction; CartMiddleware then drops the cookie.
+
+`GuestItem` / `GuestOrder` expose the same attributes the cart templates use on
+OrderItem / Order (``product``, ``quantity``, ``get_total``, ``get_cart_total``,
+``get_cart_items``, ``shipping``).
+"""
+import json
+import logging
+from decimal import Decimal
+
+from django.core import signing
+from django.db import transaction
+
+from .models import Order, OrderItem, Product
+
+logger = logging.getLogger(__name__)
+
+COOKIE_NAME = 'cart'
+COOKIE_SALT = 'store.guest_cart'
+COOKIE_MAX_AGE = 30 * 24 * 60 * 60
+# Keeps the cookie well under the 4KB browser limit
+MAX_LINES = 50
+
+
+# -------------------------------------------------------------------------------------
+# --- COOKIE I/O ---
+# -------------------------------------------------------------------------------------
+
+def read(request):
+    """Return the guest cart as ``{product_id: quantity}``; a missing or tampered cookie is an empty cart."""
+    try:
+        raw = request.get_signed_cookie(COOKIE_NAME, default=None, salt=COOKIE_SALT, max_age=COOKIE_MAX_AGE)
+        data = json.loads(raw) if raw else {}
+        return {int(pk): int(qty) for pk, qty in data.items() if int(qty) > 0}
+    except (signing.BadSignature, ValueError, TypeError, AttributeError):
+        return {}
+
+
+def write(response, lines):
+    if not lines:
+        clear(response)
+        return
+    value = json.dumps({str(pk): qty for pk, qty in lines.items()}, separators=(',', ':'))
+    response.set_signed_cookie(
+        COOKIE_NAME, value, salt=COOKIE_SALT, max_age=COOKIE_MAX_AGE, httponly=True, samesite='Lax',
+    )
+
+
+def clear(response):
+    response.delete_cookie(COOKIE_NAME, samesite='Lax')
+
+
+# -------------------------------------------------------------------------------------
+# --- MUTATION (update_item for anonymous visitors, update_cart for everyone) ---
+# -------------------------------------------------------------------------------------
+
+class CartError(Exception):
+    """A cart change that can't be applied; ``code`` mirrors update_item's error values.
+
+    ``index`` is the position of the failing operation in a batch (update_cart).
+    """
+
+    def __init__(self, message, code=None, index=None):
+        super().__init__(message)
+        self.message = message
+        self.code = code
+        self.index = index
+
+
+def apply(lines, product, action, amount=1, max_lines=MAX_LINES):
+    """Apply one cart action to ``lines`` in place (stock is checked, nothing is written).
+
+    ``add`` / ``remove`` move the quantity by ``amount``; ``set`` makes it exactly ``amount``.
+    """
+    quantity = lines.get(product.pk, 0)
+    if action == 'add':
+        quantity += amount
+    elif action == 'remove':
+        quantity -= amount
+    elif action == 'set':
+        quantity = amount
+    elif action == 'delete':
+        quantity = 0
+
+    if quantity > lines.get(product.pk, 0):
+        if quantity > product.stock_quantity:
+            raise CartError(
+                f'Cannot add more. Only {product.stock_quantity} units available in stock.',
+                code='insufficient_stock',
+            )
+        if product.pk not in lines and max_lines is not None and len(lines) >= max_lines:
+            raise CartError(f'A cart can hold at most {max_lines} different products.', code='cart_full')
+
+    if quantity > 0:
+        lines[product.pk] = quantity
+    else:
+        lines.pop(product.pk, None)
+    return lines
+
+
+# -------------------------------------------------------------------------------------
+# --- RENDERING ---
+# -------------------------------------------------------------------------------------
+
+class GuestItem:
+    def __init__(self, product, quantity):
+        self.product = product
+        self.product_id = product.pk
+        self.quantity = quantity
+
+    @property
+    def get_total(self):
+        return self.product.selling_price * self.quantity
+
+
+class GuestOrder:
+    def __init__(self, items):
+        self.items = items
+
+    @property
+    def get_cart_total(self):
+        return sum((item.get_total for item in self.items), Decimal('0.00'))
+
+    @property
+    def get_cart_items(self):
+        return sum(item.quantity for item in self.items)
+
+    @property
+    def shipping(self):
+        return any(not item.product.digital for item in self.items)
+
+
+def build_items(lines):
+    """Price the cookie lines with one bulk Product lookup; products deleted since are dropped."""
+    if not lines:
+        return []
+    products = Product.objects.in_bulk(list(lines))
+    return [GuestItem(products[pk], qty) for pk, qty in lines.items() if pk in products]
+
+
+# -------------------------------------------------------------------------------------
+# --- MERGE ON LOGIN ---
+# -------------------------------------------------------------------------------------
+
+@transaction.atomic
+def merge_into_customer(customer, lines):
+    """Add the guest lines to the customer's open order (created if needed), capped at available stock."""
+    if not lines:
+        return None
+    products = Product.objects.in_bulk(list(lines))
+    if not products:
+        return None
+
+    order, created = Order.objects.get_or_create(customer=customer, complete=False)
+    existing = {
+        item.product_id: item
+        for item in OrderItem.objects.select_for_update().filter(order=order, product_id__in=list(products))
+    }
+
+    to_create, to_update = [], []
+    for pk, product in products.items():
+        item = existing.get(pk)
+        current = item.quantity if item else 0
+        quantity = min(current + lines[pk], max(product.stock_quantity, current))
+        if item is None:
+            if quantity > 0:
+                to_create.append(OrderItem(order=order, product=product, quantity=quantity))
+        elif quantity != current:
+            item.quantity = quantity
+            to_update.append(item)
+
+    OrderItem.objects.bulk_create(to_create)
+    OrderItem.objects.bulk_update(to_update, ['quantity'])
+    return order
@@ -0,0 +1,166 @@
+# store/idempotency.py
+"""Idempotency keys for the cart and checkout endpoints.
+
+A client that may retry a POST (flaky mobile networks) sends an
+``Idempotency-Key`` header, which is a fresh random string per logical action,
+reused on every retry of it. The first request runs the view. Its response
+(status, body and cookies, so a guest cart cookie is replayed too) is kept for
+IDEMPOTENCY_KEY_TTL seconds. Repeats get the stored response back without
+running the view again and carry an ``Idempotent-Replayed: true`` header.
+
+- Keys are scoped to the user (or, for guests, the CSRF cookie) and the path.
+- Reusing a key with a different body is rejected with 422.
+- A repeat that arrives while the first is still running gets 409.
+- 5xx and 202 (still processing) responses are not stored, so a retry runs
+  the view again.
+
+Keys live in the IdempotencyKey table rather than the cache: without
+REDIS_URL the cache is per process, and a retry that lands on another worker
+must still see the first request. Inserting the unique row is the lock, the
+same way PaymentConfirmation claims a payment reference. Expired rows are
+deleted by `manage.py purge_idempotency_keys` (or the Celery task of the same
+name). Requests without the header behave exactly as before.
+"""
+import functools
+import hashlib
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+
+from .models import IdempotencyKey
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'HTTP_IDEMPOTENCY_KEY'
+MAX_KEY_LENGTH = 255
+# How long a key stays locked while its first request runs (seconds); a
+# worker that died mid-request frees the key for a retry after this
+LOCK_TIMEOUT = 60
+
+
+def _ttl():
+    return getattr(settings, 'IDEMPOTENCY_KEY_TTL', 24 * 60 * 60)
+
+
+def _scope(request):
+    if request.user.is_authenticated:
+        return f'u{request.user.pk}'
+    token = request.COOKIES.get(settings.CSRF_COOKIE_NAME) or request.META.get('REMOTE_ADDR', '')
+    return 'g' + hashlib.sha256(token.encode()).hexdigest()[:32]
+
+
+def key_digest(request, key):
+    return hashlib.sha256(f'{_scope(request)}|{request.path}|{key}'.encode()).hexdigest()
+
+
+def _storable(response):
+    return response.status_code < 500 and response.status_code != 202 and not response.streaming
+
+
+def _serialize(response):
+    return {
+        'content': response.content.decode(response.charset),
+        'content_type': response.get('Content-Type'),
+        'cookies': {name: [morsel.value, dict(morsel)] for name, morsel in response.cookies.items()},
+    }
+
+
+def _replay(record):
+    stored = record.response
+    response = HttpResponse(stored['content'], status=record.status_code, content_type=stored['content_type'])
+    for name, (value, attributes) in stored['cookies'].items():
+        response.cookies[name] = value
+        response.cookies[name].update({attr: val for attr, val in attributes.items() if val})
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _claim(digest, fingerprint):
+    """Return ``(record, claimed)``; only the caller with ``claimed=True`` may run the view."""
+    try:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(key=digest, fingerprint=fingerprint), True
+    except IntegrityError:
+        pass
+
+    # An expired key, or one whose first request never finished, can be taken over
+    now = timezone.now()
+    reclaimable = Q(created_at__lt=now - timedelta(seconds=_ttl())) | Q(
+        status_code__isnull=True, created_at__lt=now - timedelta(seconds=LOCK_TIMEOUT),
+    )
+    claimed = IdempotencyKey.objects.filter(reclaimable, key=digest).update(
+        fingerprint=fingerprint, status_code=None, response=None, created_at=now,
+    )
+    return IdempotencyKey.objects.filter(key=digest).first(), bool(claimed)
+
+
+def _release(digest):
+    try:
+        IdempotencyKey.objects.filter(key=digest, status_code__isnull=True).delete()
+    except Exception:
+        logger.warning("Could not release idempotency key %s", digest, exc_info=True)
+
+
+def purge_expired(batch_size=1000, now=None):
+    """Delete keys older than IDEMPOTENCY_KEY_TTL, ``batch_size`` rows per statement; returns how many."""
+    cutoff = (now or timezone.now()) - timedelta(seconds=_ttl())
+    deleted = 0
+    while True:
+        batch = list(
+            IdempotencyKey.objects.filter(created_at__lt=cutoff).order_by('pk').values_list('pk', flat=True)[:batch_size]
+        )
+        if not batch:
+            return deleted
+        IdempotencyKey.objects.filter(pk__in=batch, created_at__lt=cutoff).delete()
+        deleted += len(batch)
+
+
+def idempotent(view):
+    """Make a POST view replay its first response for repeats of the same ``Idempotency-Key``."""
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = request.META.get(HEADER, '').strip()
+        if request.method != 'POST' or not key:
+            return view(request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return JsonResponse({'message': 'Idempotency-Key is too long.'}, safe=False, status=400)
+
+        digest = key_digest(request, key)
+        fingerprint = hashlib.sha256(request.body).hexdigest()
+        record, claimed = _claim(digest, fingerprint)
+
+        if not claimed:
+            if record is None or record.status_code is None:
+                return JsonResponse(
+                    {'message': 'A request with this Idempotency-Key is still being processed.'}, safe=False, status=409,
+                )
+            if record.fingerprint != fingerprint:
+                return JsonResponse(
+                    {'message': 'This Idempotency-Key was already used for a different request.'}, safe=False, status=422,
+                )
+            return _replay(record)
+
+        try:
+            response = view(request, *args, **kwargs)
+        except Exception:
+            _release(digest)
+            raise
+        if not _storable(response):
+            _release(digest)
+            return response
+        try:
+            IdempotencyKey.objects.filter(key=digest).update(
+                status_code=response.status_code, response=_serialize(response),
+            )
+        except Exception:
+            logger.warning("Could not store the response for idempotency key on %s", request.path, exc_info=True)
+            _release(digest)
+        return response
+
+    return wrapper
@@ -0,0 +1,103 @@
+# store/image_derivatives.py
+"""Responsive derivatives (thumbnail / card / detail sizes, WebP + JPEG) for ProductImage uploads.
+
+Generated in the Celery worker (`store.tasks.generate_image_derivatives`) after a
+ProductImage is saved. Files are read and written through the image field's
+storage, so local FileSystemStorage, Cloudinary and S3 all work the same way.
+
+The result is recorded on `ProductImage.derivatives` as::
+
+    {'card': {'width': 480, 'webp': 'product_photos/derivatives/x_480.webp', 'jpeg': '...jpg'}, ...}
+
+and copied to `Product.cover_derivatives` for the cover image; the
+`responsive_img` template tag turns it into a srcset.
+"""
+import logging
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Target widths (px). Images are never upscaled past their original width.
+SIZES = {
+    'thumb': 160,
+    'card': 480,
+    'detail': 1200,
+}
+
+FORMATS = {
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+DERIVATIVE_DIR = 'product_photos/derivatives'
+
+
+def _flatten(img):
+    """Return an RGB copy, compositing any transparency onto white."""
+    if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+        img = img.convert('RGBA')
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel('A'))
+        return background
+    return img.convert('RGB')
+
+
+def _encode(img, fmt):
+    pil_format, _, options = FORMATS[fmt]
+    buffer = BytesIO()
+    img.save(buffer, pil_format, **options)
+    return buffer.getvalue()
+
+
+def generate_derivatives(product_image):
+    """Build every size/format for `product_image` and save the files to its storage.
+
+    Returns the derivatives dict (see module docstring). Does not touch the database.
+    """
+    field = product_image.image
+    storage = field.storage
+    stem = os.path.splitext(os.path.basename(field.name))[0]
+
+    field.open('rb')
+    try:
+        with Image.open(field) as source:
+            source = _flatten(ImageOps.exif_transpose(source))
+    finally:
+        field.close()
+
+    derivatives = {}
+    for size_name, width in SIZES.items():
+        target_width = min(width, source.width)
+        target_height = max(1, round(source.height * target_width / source.width))
+        resized = source if target_width == source.width else source.resize(
+            (target_width, target_height), Image.LANCZOS
+        )
+
+        entry = {'width': target_width}
+        for fmt, (_, extension, _) in FORMATS.items():
+            name = f'{DERIVATIVE_DIR}/{stem}_{width}.{extension}'
+            entry[fmt] = storage.save(name, ContentFile(_encode(resized, fmt)))
+        derivatives[size_name] = entry
+    return derivatives
+
+
+def delete_derivatives(storage, derivatives):
+    """Best-effort removal of previously generated derivative files."""
+    for entry in (derivatives or {}).values():
+        for fmt in FORMATS:
+            name = entry.get(fmt)
+            if not name:
+                continue
+            try:
+                storage.delete(name)
+            except Exception:
+                logger.warning("Could not delete image derivative %s", name, exc_info=True)
+
+
+def derivative_name(derivatives, size, fmt='jpeg'):
+    """Stored file name of one derivative, or None if it hasn't been generated."""
+    return ((derivatives or {}).get(size) or {}).get(fmt)
@@ -0,0 +1,54 @@
+"""
+Management command to fill in the checkout snapshot (Order.total / item_count,
+OrderItem.unit_price) on completed orders placed before it was recorded.
+Lines get the product's current price, the best figure left for old orders.
+Run: python manage.py backfill_order_totals [--batch-size 500]
+"""
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from store.models import Order, OrderItem, Product, line_total_expression
+
+
+class Command(BaseCommand):
+    help = 'Backfill order totals, item counts and line unit prices on completed orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of orders written per UPDATE batch (default: 500)',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        price = Product.objects.filter(pk=OuterRef('product_id')).values('effective_price')[:1]
+        lines = OrderItem.objects.filter(order=OuterRef('pk')).order_by().values('order')
+        line_total = lines.annotate(total=Sum(line_total_expression())).values('total')
+        line_count = lines.annotate(count=Sum('quantity')).values('count')
+
+        pending = Order.objects.filter(complete=True, total__isnull=True).order_by('pk').values_list('pk', flat=True)
+        updated = 0
+        last_pk = 0
+        while True:
+            batch = list(pending.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+            with transaction.atomic():
+                OrderItem.objects.filter(order_id__in=batch, unit_price__isnull=True, product__isnull=False).update(
+                    unit_price=Subquery(price)
+                )
+                Order.objects.filter(pk__in=batch).update(
+                    total=Coalesce(Subquery(line_total), Value(Decimal('0.00'))),
+                    item_count=Coalesce(Subquery(line_count), Value(0)),
+                )
+            updated += len(batch)
+            last_pk = batch[-1]
+
+        self.stdout.write(self.style.SUCCESS(f'Backfilled totals for {updated} orders.'))
@@ -0,0 +1,53 @@
+"""
+Management command to (re)compute Product.cover_image and Product.image_count
+from the ProductImage rows, e.g. after a bulk import that bypassed signals.
+Run: python manage.py backfill_product_images [--batch-size 500]
+"""
+from django.core.management.base import BaseCommand
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from store.models import Product, ProductImage
+
+
+class Command(BaseCommand):
+    help = 'Backfill the denormalized cover image and image count on every Product'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of products written per UPDATE batch (default: 500)',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        images = ProductImage.objects.filter(product=OuterRef('pk'))
+        first_image = images.order_by('position', 'id').values('image')[:1]
+        image_count = images.order_by().values('product').annotate(n=Count('id')).values('n')
+
+        products = Product.objects.annotate(
+            first_image=Subquery(first_image),
+            n_images=Coalesce(Subquery(image_count), Value(0)),
+        ).only('id', 'cover_image', 'image_count')
+
+        batch = []
+        updated = 0
+        for product in products.iterator(chunk_size=batch_size):
+            cover = product.first_image or None
+            if (product.cover_image.name or None) == cover and product.image_count == product.n_images:
+                continue
+            product.cover_image = cover
+            product.image_count = product.n_images
+            batch.append(product)
+            if len(batch) >= batch_size:
+                Product.objects.bulk_update(batch, ['cover_image', 'image_count'])
+                updated += len(batch)
+                batch = []
+        if batch:
+            Product.objects.bulk_update(batch, ['cover_image', 'image_count'])
+            updated += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(f'Updated image summary for {updated} products.'))
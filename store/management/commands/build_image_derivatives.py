@@ -0,0 +1,35 @@
+"""
+Management command to build responsive derivatives for existing product images.
+Run: python manage.py build_image_derivatives [--sync] [--force]
+"""
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from store.models import ProductImage
+from store.tasks import generate_image_derivatives
+
+
+class Command(BaseCommand):
+    help = 'Queue (or run inline with --sync) derivative generation for product images that lack them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sync', action='store_true', help='Process images in this process instead of Celery')
+        parser.add_argument('--force', action='store_true', help='Rebuild derivatives even if they are up to date')
+
+    def handle(self, *args, **options):
+        images = ProductImage.objects.all()
+        if options['force']:
+            images.update(derivatives_source='')
+        else:
+            images = images.exclude(derivatives_source=F('image'))
+
+        total = 0
+        for image_id in images.values_list('id', flat=True).iterator():
+            if options['sync']:
+                generate_image_derivatives(image_id)
+            else:
+                generate_image_derivatives.delay(image_id)
+            total += 1
+
+        verb = 'Processed' if options['sync'] else 'Queued'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {total} product images.'))
@@ -0,0 +1,15 @@
+"""
+Management command to rebuild the "frequently bought together" recommendations from completed orders.
+Run: python manage.py build_recommendations
+"""
+from django.core.management.base import BaseCommand
+
+from store import recommendations
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the top-K co-purchased products for every product from completed OrderItems'
+
+    def handle(self, *args, **options):
+        count = recommendations.build()
+        self.stdout.write(self.style.SUCCESS(f'Stored {count} product recommendations.'))
@@ -0,0 +1,24 @@
+"""
+Management command to delete abandoned, empty open carts in batches.
+Run: python manage.py purge_abandoned_carts [--days 30] [--batch-size 1000] [--dry-run]
+"""
+from django.core.management.base import BaseCommand
+
+from store import cart
+
+
+class Command(BaseCommand):
+    help = 'Delete empty open carts (incomplete orders) older than --days (default: CART_ABANDON_DAYS)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None, help='Minimum cart age in days')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Carts deleted per statement')
+        parser.add_argument('--dry-run', action='store_true', help='Only report how many carts would be deleted')
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            count = cart.abandoned_empty_carts(options['days']).count()
+            self.stdout.write(f'{count} abandoned empty carts would be deleted.')
+            return
+        deleted = cart.purge_abandoned_carts(days=options['days'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} abandoned empty carts.'))
@@ -0,0 +1,18 @@
+"""
+Management command to delete expired Idempotency-Key records in batches.
+Run: python manage.py purge_idempotency_keys [--batch-size 1000]
+"""
+from django.core.management.base import BaseCommand
+
+from store import idempotency
+
+
+class Command(BaseCommand):
+    help = 'Delete stored Idempotency-Key responses older than IDEMPOTENCY_KEY_TTL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Keys deleted per statement')
+
+    def handle(self, *args, **options):
+        deleted = idempotency.purge_expired(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Purged {deleted} expired idempotency keys.'))
@@ -0,0 +1,33 @@
+"""
+Management command to recompute the DailySales rollup from the completed orders,
+for every day or only a date range (inclusive, store local dates).
+Run: python manage.py rebuild_daily_sales [--start 2025-01-01] [--end 2025-01-31]
+"""
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store import rollups
+
+
+def _parse_date(value):
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f'Invalid date {value!r}; expected YYYY-MM-DD.')
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily sales rollup (per product and overall) for a date range'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=_parse_date, default=None, help='First day to rebuild (default: earliest)')
+        parser.add_argument('--end', type=_parse_date, default=None, help='Last day to rebuild (default: latest)')
+
+    def handle(self, *args, **options):
+        start, end = options['start'], options['end']
+        if start and end and start > end:
+            raise CommandError('--start must not be after --end.')
+        rows = rollups.rebuild(start, end)
+        span = f"{start or 'the beginning'} to {end or 'today'}"
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {rows} daily sales rows from {span}.'))
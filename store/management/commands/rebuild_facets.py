@@ -0,0 +1,15 @@
+"""
+Management command to recompute the store front facet rows and counts from scratch.
+Run: python manage.py rebuild_facets
+"""
+from django.core.management.base import BaseCommand
+
+from store import facets
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the precomputed catalog facet table (category, price band, discount, stock)'
+
+    def handle(self, *args, **options):
+        count = facets.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt facets for {count} products.'))
@@ -0,0 +1,20 @@
+"""
+Management command to rebuild the product full-text search index from scratch.
+Run: python manage.py rebuild_search_index
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from store import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the product full-text search index (FTS5 on SQLite, tsvector on PostgreSQL)'
+
+    def handle(self, *args, **options):
+        backend = search.get_backend()
+        with transaction.atomic():
+            count = backend.rebuild()
+        self.stdout.write(
+            self.style.SUCCESS(f'Indexed {count} products using {backend.__class__.__name__}.')
+        )
@@ -0,0 +1,18 @@
+"""
+Management command to delete expired stock reservations in batches.
+Run: python manage.py release_expired_reservations [--batch-size 1000]
+"""
+from django.core.management.base import BaseCommand
+
+from store import reservations
+
+
+class Command(BaseCommand):
+    help = 'Delete stock reservations whose TTL (STOCK_RESERVATION_TTL) has passed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Reservations deleted per statement')
+
+    def handle(self, *args, **options):
+        deleted = reservations.release_expired(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Released {deleted} expired stock reservations.'))
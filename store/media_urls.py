@@ -0,0 +1,145 @@
+# store/media_urls.py
+"""Memoized media URL resolution for the `cloud_url` template filter.
+
+Building a URL is a Cloudinary signature computation or a storage round-trip
+(S3 `url()`), and a product grid asks for dozens per render. Resolved URLs are
+kept in two tiers:
+
+1. a per-process LRU (no I/O at all on a hit), and
+2. the shared Django cache, so a fresh gunicorn worker doesn't start cold.
+
+Entries are keyed by storage backend + file name. A replaced upload always gets
+a new name, so it resolves to a new key and the stale entry simply ages out.
+Entries also expire after MEDIA_URL_CACHE_TIMEOUT, which is capped below the
+S3 signature lifetime when signed URLs are in use.
+"""
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+
+try:
+    from cloudinary.utils import cloudinary_url
+except ImportError:  # Cloudinary is optional outside production
+    cloudinary_url = None
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'media_url'
+LOCAL_CACHE_SIZE = 4096
+
+
+class _LRUCache:
+    """Small thread-safe LRU with per-entry expiry."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + timeout)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+_local = _LRUCache(LOCAL_CACHE_SIZE)
+
+
+def cap_for_signed_urls(timeout):
+    """Cap a cache ``timeout`` for anything holding resolved media URLs (also store.storefront_cache)."""
+    if getattr(settings, 'USE_S3', False) and getattr(settings, 'AWS_QUERYSTRING_AUTH', True):
+        # Signed S3 URLs expire; never serve one past half its lifetime
+        timeout = min(timeout, getattr(settings, 'AWS_QUERYSTRING_EXPIRE', 3600) // 2)
+    return timeout
+
+
+def _timeout():
+    return cap_for_signed_urls(getattr(settings, 'MEDIA_URL_CACHE_TIMEOUT', 60 * 60))
+
+
+def _backend_label(storage):
+    return f'{storage.__class__.__module__}.{storage.__class__.__name__}'
+
+
+def _cache_key(backend, name):
+    digest = hashlib.md5(f'{backend}:{name}'.encode('utf-8')).hexdigest()
+    return f'{KEY_PREFIX}:{digest}'
+
+
+def _build_url(image_field, storage, name):
+    if getattr(settings, 'USE_CLOUDINARY', False) and cloudinary_url is not None:
+        try:
+            url, options = cloudinary_url(name, secure=True)
+            return url
+        except Exception:
+            # Fall back to the storage URL if the Cloudinary client isn't configured
+            logger.debug("cloudinary_url failed for %s", name, exc_info=True)
+    if isinstance(image_field, str):
+        return storage.url(name)
+    return image_field.url
+
+
+def resolve(image_field, name):
+    """Return the public URL for `image_field` (an ImageFieldFile or a plain stored name)."""
+    storage = getattr(image_field, 'storage', None) or default_storage
+    backend = 'cloudinary' if getattr(settings, 'USE_CLOUDINARY', False) else _backend_label(storage)
+    key = _cache_key(backend, name)
+
+    url = _local.get(key)
+    if url is not None:
+        return url
+
+    timeout = _timeout()
+    try:
+        url = cache.get(key)
+    except Exception:
+        # The shared tier is an optimisation only
+        url = None
+    if url is None:
+        url = _build_url(image_field, storage, name)
+        try:
+            cache.set(key, url, timeout)
+        except Exception:
+            pass
+    _local.set(key, url, timeout)
+    return url
+
+
+def forget(name, storage=None):
+    """Drop a cached URL explicitly (e.g. after deleting the file)."""
+    storage = storage or default_storage
+    for backend in ('cloudinary', _backend_label(storage)):
+        key = _cache_key(backend, name)
+        _local.delete(key)
+        try:
+            cache.delete(key)
+        except Exception:
+            pass
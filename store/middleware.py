@@ -0,0 +1,23 @@
+# store/middleware.py
+from . import guest_cart
+from .cart import RequestCart
+
+
+class CartMiddleware:
+    """Attach a lazily evaluated `RequestCart` as ``request.cart`` (see store/cart.py).
+
+    Also drops the guest cart cookie once it has been merged into the customer's
+    order at login (see the user_logged_in receiver in store/signals.py).
+
+    Must come after AuthenticationMiddleware, since the cart depends on ``request.user``.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.cart = RequestCart(request)
+        response = self.get_response(request)
+        if getattr(request, 'guest_cart_merged', False):
+            guest_cart.clear(response)
+        return response
@@ -0,0 +1,71 @@
+"""Create the full-text search index used by store/search.py.
+
+The index lives outside the ORM (an FTS5 virtual table on SQLite, a tsvector
+side table with a GIN index on PostgreSQL), so it is created with raw SQL
+chosen by the connection vendor and then filled from the existing catalog.
+"""
+
+from django.db import migrations
+
+
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS store_product_fts "
+    "USING fts5(name, categories, tokenize='porter unicode61')",
+]
+SQLITE_REVERSE = ["DROP TABLE IF EXISTS store_product_fts"]
+
+POSTGRES_FORWARD = [
+    "CREATE TABLE IF NOT EXISTS store_product_search ("
+    " product_id bigint PRIMARY KEY REFERENCES store_product (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED,"
+    " document tsvector NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS store_product_search_document_gin ON store_product_search USING GIN (document)",
+]
+POSTGRES_REVERSE = ["DROP TABLE IF EXISTS store_product_search"]
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        statements = SQLITE_FORWARD
+        populate = (
+            "INSERT INTO store_product_fts (rowid, name, categories) "
+            "SELECT p.id, COALESCE(p.name, ''), COALESCE(("
+            " SELECT group_concat(c.name, ' ') FROM store_category c"
+            " JOIN store_product_categories pc ON pc.category_id = c.id WHERE pc.product_id = p.id), '') "
+            "FROM store_product p"
+        )
+    elif vendor == 'postgresql':
+        statements = POSTGRES_FORWARD
+        populate = (
+            "INSERT INTO store_product_search (product_id, document) "
+            "SELECT p.id, setweight(to_tsvector('english', COALESCE(p.name, '')), 'A') || "
+            "setweight(to_tsvector('english', COALESCE(("
+            " SELECT string_agg(c.name, ' ') FROM store_category c"
+            " JOIN store_product_categories pc ON pc.category_id = c.id WHERE pc.product_id = p.id), '')), 'B') "
+            "FROM store_product p ON CONFLICT (product_id) DO NOTHING"
+        )
+    else:
+        # Other databases use the name__icontains fallback backend
+        return
+
+    for statement in statements:
+        schema_editor.execute(statement)
+    schema_editor.execute(populate)
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    statements = {'sqlite': SQLITE_REVERSE, 'postgresql': POSTGRES_REVERSE}.get(vendor, [])
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0010_add_pageview'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.8 on 2026-10-17 22:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0011_product_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='display_order',
+            field=models.IntegerField(default=0, help_text='Lower numbers appear first on the storefront'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['display_order', 'id'], name='store_product_display_idx'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.8 on 2026-10-17 22:54
+
+from django.db import migrations, models
+
+
+def backfill_image_summary(apps, schema_editor):
+    # Same computation as `manage.py backfill_product_images`, using historical models
+    Product = apps.get_model('store', 'Product')
+    ProductImage = apps.get_model('store', 'ProductImage')
+    for product in Product.objects.all().iterator(chunk_size=500):
+        images = ProductImage.objects.filter(product=product).order_by('position', 'id')
+        first = images.first()
+        Product.objects.filter(pk=product.pk).update(
+            cover_image=first.image.name if first else None,
+            image_count=images.count(),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0012_product_display_order'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='productimage',
+            options={'ordering': ['position', 'id']},
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='cover_image',
+            field=models.ImageField(blank=True, editable=False, null=True, upload_to='product_photos/'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='image_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='position',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_image_summary, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.8 on 2026-10-17 22:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0013_product_cover_image'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='cover_derivatives',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='derivatives',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='derivatives_source',
+            field=models.CharField(blank=True, default='', editable=False, max_length=255),
+        ),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 5.2.8 on 2026-10-17 23:01
+
+import django.db.models.deletion
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def populate_facets(apps, schema_editor):
+    # Same computation as `manage.py rebuild_facets`, using historical models
+    Product = apps.get_model('store', 'Product')
+    ProductFacetValue = apps.get_model('store', 'ProductFacetValue')
+    FacetCount = apps.get_model('store', 'FacetCount')
+
+    edges = [Decimal('0')] + [Decimal(str(edge)) for edge in getattr(settings, 'STORE_PRICE_BANDS', [100, 500, 1000, 5000])]
+    bands = list(zip(edges, edges[1:] + [None]))
+
+    memberships = {}
+    for product_id, category_id in Product.categories.through.objects.values_list('product_id', 'category_id'):
+        memberships.setdefault(product_id, []).append(category_id)
+
+    rows, totals = [], {}
+    for product in Product.objects.all().iterator(chunk_size=500):
+        if product.stock_quantity <= 0:
+            values = {('stock', 'out')}
+        else:
+            discounted = bool(product.discount_price and product.discount_price < product.price)
+            selling_price = product.discount_price if discounted else product.price
+            values = {('stock', 'in')}
+            for low, high in bands:
+                if selling_price >= low and (high is None or selling_price < high):
+                    values.add(('price', f'{low:f}-{high:f}' if high is not None else f'{low:f}+'))
+            values.update(('category', str(category_id)) for category_id in memberships.get(product.pk, []))
+            if discounted:
+                values.add(('discount', 'yes'))
+        for facet, value in values:
+            rows.append(ProductFacetValue(product_id=product.pk, facet=facet, value=value))
+            totals[(facet, value)] = totals.get((facet, value), 0) + 1
+
+    ProductFacetValue.objects.bulk_create(rows, batch_size=1000)
+    FacetCount.objects.bulk_create(
+        [FacetCount(facet=facet, value=value, count=total) for (facet, value), total in totals.items()]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0014_image_derivatives'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FacetCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('facet', models.CharField(max_length=20)),
+                ('value', models.CharField(max_length=50)),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('facet', 'value'), name='store_facetcount_unique')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductFacetValue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('facet', models.CharField(max_length=20)),
+                ('value', models.CharField(max_length=50)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='facet_values', to='store.product')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('product', 'facet', 'value'), name='store_facetvalue_unique')],
+            },
+        ),
+        migrations.RunPython(populate_facets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.8 on 2026-10-17 23:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0017_product_effective_price'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField()),
+                ('expires_at', models.DateTimeField()),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_reservations', to='store.order')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='store.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', 'expires_at'], name='store_reservation_active_idx'), models.Index(fields=['expires_at'], name='store_reservation_expiry_idx')],
+                'constraints': [models.UniqueConstraint(fields=('order', 'product'), name='store_reservation_unique')],
+            },
+        ),
+    ]
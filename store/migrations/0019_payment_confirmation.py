@@ -0,0 +1,28 @@
+# Generated by Django 5.2.8 on 2026-10-17 23:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0018_stock_reservations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentConfirmation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('reference', models.CharField(max_length=100, unique=True)),
+                ('status', models.CharField(choices=[('PROCESSING', 'Processing'), ('CONFIRMED', 'Confirmed'), ('FAILED', 'Failed')], default='PROCESSING', max_length=20)),
+                ('source', models.CharField(max_length=20)),
+                ('amount', models.BigIntegerField(blank=True, null=True)),
+                ('error', models.CharField(blank=True, default='', max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('order', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='payments', to='store.order')),
+            ],
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.8 on 2026-10-17 23:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0019_payment_confirmation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='currency',
+            field=models.CharField(default='GHS', editable=False, max_length=3),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='item_count',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=12, null=True),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='unit_price',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=7, null=True),
+        ),
+    ]
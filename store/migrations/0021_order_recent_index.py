@@ -0,0 +1,17 @@
+# Generated by Django 5.2.8 on 2026-10-17 23:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0020_order_snapshots'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['complete', '-date_ordered', '-id'], name='store_order_recent_idx'),
+        ),
+    ]
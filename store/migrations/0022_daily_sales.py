@@ -0,0 +1,31 @@
+# Generated by Django 5.2.8 on 2026-10-17 23:30
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0021_order_recent_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to='store.product')),
+            ],
+            options={
+                'verbose_name_plural': 'Daily sales',
+                'indexes': [models.Index(fields=['product', 'date'], name='store_dailysales_product_idx')],
+                'constraints': [models.UniqueConstraint(fields=('date', 'product'), name='store_dailysales_product_unique'), models.UniqueConstraint(condition=models.Q(('product__isnull', True)), fields=('date',), name='store_dailysales_overall_unique')],
+            },
+        ),
+    ]
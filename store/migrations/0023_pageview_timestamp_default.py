@@ -0,0 +1,19 @@
+# Generated by Django 5.2.8 on 2026-10-17 23:33
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0022_daily_sales'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='pageview',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.8 on 2026-10-17 23:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    """A discount_price of 0 means "no discount" (as in Product.selling_price).
+
+    Generated columns can't be altered in place, so the column and its index are recreated.
+    """
+
+    dependencies = [
+        ('store', '0023_pageview_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='product',
+            name='store_product_price_idx',
+        ),
+        migrations.RemoveField(
+            model_name='product',
+            name='effective_price',
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='effective_price',
+            field=models.GeneratedField(db_persist=True, expression=models.Case(models.When(models.Q(('discount_price__gt', 0), ('discount_price__isnull', False), ('discount_price__lt', models.F('price'))), then=models.F('discount_price')), default=models.F('price')), output_field=models.DecimalField(decimal_places=2, max_digits=7)),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['effective_price', 'id'], name='store_product_price_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-17 23:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0024_effective_price_zero_discount'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='paymentconfirmation',
+            name='status',
+            field=models.CharField(choices=[('PROCESSING', 'Processing'), ('CONFIRMED', 'Confirmed'), ('FAILED', 'Failed'), ('NEEDS_REFUND', 'Needs refund')], default='PROCESSING', max_length=20),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.2.8 on 2026-10-17 23:30
+
+from decimal import Decimal
+
+from django.db import migrations
+from django.utils import timezone
+
+
+def populate_daily_sales(apps, schema_editor):
+    # Same computation as `manage.py rebuild_daily_sales`, using historical models, so the
+    # portal dashboards show the existing order history as soon as this is deployed
+    Order = apps.get_model('store', 'Order')
+    OrderItem = apps.get_model('store', 'OrderItem')
+    DailySales = apps.get_model('store', 'DailySales')
+
+    DailySales.objects.all().delete()
+    orders = {
+        pk: (timezone.localdate(date_ordered), total, item_count)
+        for pk, date_ordered, total, item_count in Order.objects.filter(complete=True).values_list(
+            'pk', 'date_ordered', 'total', 'item_count',
+        ).iterator(chunk_size=2000)
+    }
+
+    lines = {}
+    for item in OrderItem.objects.filter(order__complete=True).select_related('product').iterator(chunk_size=2000):
+        price = item.unit_price if item.unit_price is not None else (item.product.effective_price if item.product else None)
+        lines.setdefault(item.order_id, []).append((item.product_id, item.quantity or 0, (item.quantity or 0) * (price or 0)))
+
+    product_rows, overall_rows = {}, {}
+    for pk, (day, total, item_count) in orders.items():
+        items = lines.get(pk, [])
+        overall = overall_rows.setdefault(day, [0, Decimal('0.00'), 0])
+        overall[0] += item_count if item_count is not None else sum(quantity for _, quantity, _ in items)
+        overall[1] += total if total is not None else sum((line for _, _, line in items), Decimal('0.00'))
+        overall[2] += 1
+        for product_id in {product_id for product_id, quantity, _ in items if product_id and quantity > 0}:
+            row = product_rows.setdefault((day, product_id), [0, Decimal('0.00'), 0])
+            row[2] += 1
+        for product_id, quantity, line in items:
+            if product_id and quantity > 0:
+                row = product_rows[(day, product_id)]
+                row[0] += quantity
+                row[1] += line
+
+    rows = [
+        DailySales(date=day, product_id=product_id, units=units, revenue=revenue, orders=count)
+        for (day, product_id), (units, revenue, count) in product_rows.items()
+    ]
+    rows += [
+        DailySales(date=day, units=units, revenue=revenue, orders=count)
+        for day, (units, revenue, count) in overall_rows.items()
+    ]
+    DailySales.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0026_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_daily_sales, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,10 @@
 # store/models.py (FINAL UPDATED)
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
+from datetime import datetime, timedelta, timezone as dt_timezone
 from decimal import Decimal 
+from django.db.models.functions import Coalesce
 
 # NEW MODEL: ActivityLog
 class ActivityLog(models.Model):
@@ -34,7 +37,8 @@ class PageView(models.Model):
     session_key = models.CharField(max_length=128, null=True, blank=True)
     referrer = models.CharField(max_length=1024, null=True, blank=True)
     ip_address = models.CharField(max_length=45, null=True, blank=True)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # When the beacon arrived; set by the caller because rows are written later in batches (store/page_views.py)
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
     duration = models.FloatField(null=True, blank=True, help_text="Time on page in seconds")
 
     class Meta:
@@ -69,6 +73,19 @@ class Category(models.Model):
     def __str__(self):
         return self.name
 
+def discount_active_q(prefix=''):
+    """Q for "the discount applies": set, non-zero (0 means none) and below the regular price.
+
+    The one SQL rule behind Product.effective_price and the discount facet filter;
+    Product.selling_price applies the same rule in Python.
+    """
+    return models.Q(**{
+        f'{prefix}discount_price__isnull': False,
+        f'{prefix}discount_price__gt': 0,
+        f'{prefix}discount_price__lt': models.F(f'{prefix}price'),
+    })
+
+
 # 2. Product Model: The items you sell
 class Product(models.Model):
     name = models.CharField(max_length=200, null=True)
@@ -90,19 +107,65 @@ class Product(models.Model):
     # Many-to-Many relationship with Category
     categories = models.ManyToManyField(Category, blank=True, related_name='products')
 
+    # Position inside each storefront section; (display_order, id) is also the
+    # keyset cursor used to page through a section's products.
+    display_order = models.IntegerField(default=0, help_text="Lower numbers appear first on the storefront")
+
+    # Denormalized from ProductImage so listing pages can render card images
+    # without a query per product. Maintained by refresh_image_summary() (called
+    # from the ProductImage signals); rebuild with `manage.py backfill_product_images`.
+    cover_image = models.ImageField(upload_to='product_photos/', null=True, blank=True, editable=False)
+    cover_derivatives = models.JSONField(default=dict, blank=True, editable=False)
+    image_count = models.PositiveIntegerField(default=0, editable=False)
+
+    # What the customer actually pays (same rule as `selling_price`), computed and stored by the
+    # database so the catalog can be sorted and range-filtered by price in SQL. Like any generated
+    # column it is not refreshed on save(); use `selling_price` on in-memory instances.
+    effective_price = models.GeneratedField(
+        expression=models.Case(
+            models.When(discount_active_q(), then=models.F('discount_price')),
+            default=models.F('price'),
+        ),
+        output_field=models.DecimalField(max_digits=7, decimal_places=2),
+        db_persist=True,
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['display_order', 'id'], name='store_product_display_idx'),
+            models.Index(fields=['effective_price', 'id'], name='store_product_price_idx'),
+        ]
+
     def __str__(self):
         return self.name
     
     # Helper to get the primary image (the one used on the dashboard)
+    # NOTE: costs a query; listing templates should use `cover_image` instead
     @property
     def primary_image(self):
         # Assumes ProductImage has related_name='images'
         return self.images.first() 
+
+    def refresh_image_summary(self):
+        """Recompute cover_image / cover_derivatives / image_count from the product's ProductImage rows.
+
+        Uses a queryset update so the Product save signals (cache, search index) don't re-fire.
+        """
+        first = self.images.first()
+        self.cover_image = first.image.name if first else None
+        self.cover_derivatives = first.derivatives if first else {}
+        self.image_count = self.images.count()
+        Product.objects.filter(pk=self.pk).update(
+            cover_image=self.cover_image,
+            cover_derivatives=self.cover_derivatives,
+            image_count=self.image_count,
+        )
     
     # Helper property to determine the current selling price
     @property
     def selling_price(self):
-        # If discount_price is set AND is lower than the regular price, use it
+        # If discount_price is set (0 means no discount) AND is lower than the regular price,
+        # use it; keep in step with discount_active_q()
         if self.discount_price and self.discount_price < self.price:
             return self.discount_price
         return self.price
@@ -118,10 +181,175 @@ class ProductImage(models.Model):
     # The actual file field
     image = models.ImageField(upload_to='product_photos/', null=False, blank=False)
     date_uploaded = models.DateTimeField(auto_now_add=True)
+    # Gallery position; the first image (lowest position, then oldest) is the product's cover
+    position = models.IntegerField(default=0)
+    # Resized WebP/JPEG copies built by the Celery worker (see store/image_derivatives.py)
+    # and the image name they were built from, so unchanged images aren't reprocessed.
+    derivatives = models.JSONField(default=dict, blank=True, editable=False)
+    derivatives_source = models.CharField(max_length=255, blank=True, default='', editable=False)
+
+    class Meta:
+        ordering = ['position', 'id']
 
     def __str__(self):
         return f"Image for {self.product.name}"
 
+
+# Precomputed catalog facets (maintained by store/facets.py from the Product signals)
+class ProductFacetValue(models.Model):
+    """One facet value a product is currently counted under, e.g. ('price', '100-500')."""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='facet_values')
+    facet = models.CharField(max_length=20)
+    value = models.CharField(max_length=50)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'facet', 'value'], name='store_facetvalue_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id}: {self.facet}={self.value}"
+
+
+class FacetCount(models.Model):
+    """Number of products counted under one facet value; read by the store front filter panel."""
+    facet = models.CharField(max_length=20)
+    value = models.CharField(max_length=50)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['facet', 'value'], name='store_facetcount_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.facet}={self.value} ({self.count})"
+
+# "Frequently bought together", rebuilt offline by store/recommendations.py
+class ProductRecommendation(models.Model):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='recommendations')
+    related = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    # Orders containing both products, and the cosine-normalized score used as a tie-break
+    support = models.PositiveIntegerField(default=0)
+    score = models.FloatField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'rank'], name='store_recommendation_rank_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} -> {self.related_id} (#{self.rank})"
+
+def line_total_expression(prefix=''):
+    """SQL for quantity x unit price of an OrderItem (``prefix`` e.g. 'orderitem__').
+
+    The price paid (``unit_price``) once the order was checked out, otherwise the
+    product's current discount-aware price.
+    """
+    return models.ExpressionWrapper(
+        models.F(f'{prefix}quantity') * Coalesce(
+            models.F(f'{prefix}unit_price'), models.F(f'{prefix}product__effective_price'),
+        ),
+        output_field=models.DecimalField(max_digits=12, decimal_places=2),
+    )
+
+
+class OrderQuerySet(models.QuerySet):
+    def with_totals(self):
+        """Annotate cart_total, cart_items and needs_shipping computed in SQL.
+
+        Correlated subqueries rather than joins, so the annotations don't fan out
+        (or get multiplied) when combined with other filters on order items.
+        Order.get_cart_total / get_cart_items / shipping return these when present.
+        """
+        items = OrderItem.objects.filter(order=models.OuterRef('pk')).order_by().values('order')
+        return self.annotate(
+            # Checked-out orders carry their snapshot; only carts (and unbackfilled rows) are summed
+            cart_total=Coalesce(
+                models.F('total'),
+                models.Subquery(items.annotate(total=models.Sum(line_total_expression())).values('total')),
+                models.Value(Decimal('0.00')),
+                output_field=models.DecimalField(max_digits=12, decimal_places=2),
+            ),
+            cart_items=Coalesce(
+                models.F('item_count'),
+                models.Subquery(items.annotate(count=models.Sum('quantity')).values('count')),
+                models.Value(0),
+            ),
+            needs_shipping=models.Exists(
+                OrderItem.objects.filter(order=models.OuterRef('pk'), product__isnull=False)
+                .exclude(product__digital=True)
+            ),
+        )
+
+    def totals(self):
+        """Revenue, item count and average order value across this queryset, in one query.
+
+        Reads the checkout snapshot (``total`` / ``item_count``); orders without one
+        fall back to summing their lines.
+        """
+        return self.summary(statuses=False)
+
+    def summary(self, statuses=True):
+        """totals() plus the order count per status (``count`` and e.g. ``shipped``), in one query.
+
+        Conditional aggregation (COUNT ... FILTER) instead of one count() per status.
+        """
+        aggregates = {
+            'revenue': models.Sum('cart_total'),
+            'items': models.Sum('cart_items'),
+            'average': models.Avg('cart_total'),
+        }
+        if statuses:
+            aggregates['count'] = models.Count('pk')
+            for status, _ in Order.STATUS_CHOICES:
+                aggregates[status.lower()] = models.Count('pk', filter=models.Q(status=status))
+        result = self.order_by().with_totals().aggregate(**aggregates)
+        result.update(
+            revenue=result['revenue'] or Decimal('0.00'),
+            items=result['items'] or 0,
+            average=Decimal(result['average'] or 0).quantize(Decimal('0.01')),
+        )
+        return result
+
+    def newest_first_page(self, after=None, limit=50):
+        """Keyset page ordered by (-date_ordered, -id): ``(orders, next_cursor)``, cursor None on the last page.
+
+        ``after`` is a cursor from a previous page (see encode_order_cursor); seeking
+        instead of OFFSET keeps deep pages as cheap as the first.
+        """
+        orders = self.order_by('-date_ordered', '-id')
+        position = decode_order_cursor(after) if after else None
+        if position is not None:
+            date_ordered, pk = position
+            orders = orders.filter(
+                models.Q(date_ordered__lt=date_ordered) | models.Q(date_ordered=date_ordered, id__lt=pk)
+            )
+        page = list(orders[:limit + 1])
+        if len(page) > limit:
+            return page[:limit], encode_order_cursor(page[limit - 1])
+        return page, None
+
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def encode_order_cursor(order):
+    """``<microseconds since epoch>_<id>``: exact, and safe in a query string."""
+    return f'{(order.date_ordered - _EPOCH) // timedelta(microseconds=1)}_{order.pk}'
+
+
+def decode_order_cursor(cursor):
+    """Parse an encode_order_cursor() value into ``(date_ordered, id)``; None when malformed."""
+    try:
+        micros, pk = cursor.split('_')
+        return _EPOCH + timedelta(microseconds=int(micros)), int(pk)
+    except (AttributeError, ValueError, OverflowError):
+        return None
+
+
 # 3. Order Model: The shopping cart or completed transaction 
 class Order(models.Model):
     customer = models.ForeignKey(Customer, on_delete=models.SET_NULL, null=True, blank=True)
@@ -146,22 +374,44 @@ class Order(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
     expected_delivery = models.DateTimeField(null=True, blank=True)
 
+    # Snapshot written once at checkout (store/payments.finalize_order), so reporting
+    # reads what was actually charged. Empty while the order is still a cart.
+    total = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True, editable=False)
+    item_count = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    currency = models.CharField(max_length=3, default='GHS', editable=False)
+
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Portal order list: completed orders, newest first, paged by (date_ordered, id)
+            models.Index(fields=['complete', '-date_ordered', '-id'], name='store_order_recent_idx'),
+        ]
+
     def __str__(self):
         return str(self.id)
     
+    # These use the OrderQuerySet.with_totals() annotations when present; otherwise
+    # they iterate the (ideally prefetched) order items.
     @property
     def shipping(self):
         # Determines if shipping is required (if any item is NOT digital)
+        if hasattr(self, 'needs_shipping'):
+            return self.needs_shipping
         shipping = False
         orderitems = self.orderitem_set.all()
         for item in orderitems:
-            if not item.product.digital:
+            if item.product and not item.product.digital:
                 shipping = True
         return shipping
     
     @property
     def get_cart_total(self):
         # Sums the total cost across all OrderItems in this Order
+        if hasattr(self, 'cart_total'):
+            return self.cart_total
+        if self.total is not None:
+            return self.total
         orderitems = self.orderitem_set.all()
         total = sum([item.get_total for item in orderitems])
         return total
@@ -169,6 +419,10 @@ class Order(models.Model):
     @property
     def get_cart_items(self):
         # Sums the total quantity of all items in this Order
+        if hasattr(self, 'cart_items'):
+            return self.cart_items
+        if self.item_count is not None:
+            return self.item_count
         orderitems = self.orderitem_set.all()
         total = sum([item.quantity for item in orderitems])
         return total
@@ -180,14 +434,116 @@ class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True)
     quantity = models.IntegerField(default=0, null=True, blank=True)
     date_added = models.DateTimeField(auto_now_add=True)
+    # Price per unit actually paid; set at checkout, empty while the line sits in a cart
+    unit_price = models.DecimalField(max_digits=7, decimal_places=2, null=True, blank=True, editable=False)
 
     @property
     def get_total(self):
+        if self.unit_price is not None:
+            return self.unit_price * self.quantity
         # Check if product exists before accessing its attribute
         if self.product:
             return self.product.selling_price * self.quantity
         return Decimal('0.00') 
 
+# Stock held for an open order while the customer shops and pays (see store/reservations.py).
+# Rows past expires_at no longer count against availability; the sweep just deletes them.
+class StockReservation(models.Model):
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='stock_reservations')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['order', 'product'], name='store_reservation_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['product', 'expires_at'], name='store_reservation_active_idx'),
+            models.Index(fields=['expires_at'], name='store_reservation_expiry_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_id} for order {self.order_id}"
+
+# One row per Paystack payment reference, so a webhook delivered twice, or racing the
+# customer's own checkout request, finalizes the order once (see store/payments.py).
+class PaymentConfirmation(models.Model):
+    STATUS_PROCESSING = 'PROCESSING'
+    STATUS_CONFIRMED = 'CONFIRMED'
+    STATUS_FAILED = 'FAILED'
+    # Paystack took the money but the order could not be filled (stock ran out): staff must refund
+    STATUS_NEEDS_REFUND = 'NEEDS_REFUND'
+
+    STATUS_CHOICES = [
+        (STATUS_PROCESSING, 'Processing'),
+        (STATUS_CONFIRMED, 'Confirmed'),
+        (STATUS_FAILED, 'Failed'),
+        (STATUS_NEEDS_REFUND, 'Needs refund'),
+    ]
+
+    SOURCE_CHECKOUT = 'checkout'
+    SOURCE_WEBHOOK = 'webhook'
+
+    reference = models.CharField(max_length=100, unique=True)
+    order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True, related_name='payments')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PROCESSING)
+    # Which path claimed the reference last: the customer's process_order call or the webhook
+    source = models.CharField(max_length=20)
+    # As reported by Paystack, in the currency's minor unit (pesewas)
+    amount = models.BigIntegerField(null=True, blank=True)
+    error = models.CharField(max_length=255, blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.reference} ({self.status})"
+
+# One row per Idempotency-Key (store/idempotency.py). The unique key is the lock shared by
+# every worker; once the first request finishes its response is kept here for replays.
+class IdempotencyKey(models.Model):
+    # sha256 of the caller's scope, the path and the client's key
+    key = models.CharField(max_length=64, unique=True)
+    # sha256 of the request body, so a reused key with a different body can be refused
+    fingerprint = models.CharField(max_length=64)
+    # Both NULL while the first request is still running
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at'], name='store_idempotency_age_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.key[:12]} ({self.status_code or 'running'})"
+
+# Sales rolled up per day (store/rollups.py): one row per product sold that day plus one
+# overall row (product NULL). Written at checkout; `manage.py rebuild_daily_sales` recomputes.
+class DailySales(models.Model):
+    date = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, null=True, blank=True, related_name='daily_sales')
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    # Completed orders that day (containing the product, for product rows)
+    orders = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'product'], name='store_dailysales_product_unique'),
+            models.UniqueConstraint(
+                fields=['date'], condition=models.Q(product__isnull=True), name='store_dailysales_overall_unique',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['product', 'date'], name='store_dailysales_product_idx'),
+        ]
+        verbose_name_plural = 'Daily sales'
+
+    def __str__(self):
+        return f"{self.date} {self.product_id or 'all'}: {self.units} units, {self.revenue}"
+
 # 5. ShippingAddress Model: Stores delivery information
 class ShippingAddress(models.Model):
     customer = models.ForeignKey(Customer, on_delete=models.SET_NULL, null=True)
@@ -0,0 +1,160 @@
+# store/page_views.py
+"""Buffered page view ingestion for the analytics beacon (record_page_view).
+
+A beacon used to cost a synchronous INSERT, which made analytics the busiest
+write path in the app and put it in competition with checkout for the
+database. Now `record()` only appends the unsaved PageView to an in-memory
+buffer in the web worker and returns. That takes microseconds and makes no
+database call.
+
+A background thread writes the buffer with one ``bulk_create`` once it holds
+PAGEVIEW_BATCH_SIZE events, or every PAGEVIEW_FLUSH_INTERVAL seconds,
+whichever comes first. What is left is flushed when the worker process exits
+(``atexit``). Hundreds of beacons thus become a single statement. Rows keep the
+time the beacon arrived, not the time of the flush.
+
+The buffer lives in each worker process, which is why a Celery task can't
+flush it. Loss is bounded:
+- A worker killed without a clean shutdown loses at most the events since
+  its last flush: one batch, or one interval's worth.
+- When a batch fails, its rows are written one by one. Rows the database
+  rejects (bad data) are dropped and counted in ``rejected``, so one poison
+  event can't block every later flush.
+- While the database is unreachable, the unwritten rows are kept and retried,
+  but never more than PAGEVIEW_BUFFER_MAX events per process. Beyond that the
+  oldest are dropped and counted in ``dropped``.
+
+PAGEVIEW_BATCH_SIZE = 0 turns buffering off, so every beacon is written at
+once as before. That is handy in tests and one-off scripts.
+"""
+import atexit
+import logging
+import os
+import threading
+from collections import deque
+
+from django.conf import settings
+from django.db import DataError, IntegrityError, close_old_connections, transaction
+
+from .models import PageView
+
+logger = logging.getLogger(__name__)
+
+
+def _batch_size():
+    return getattr(settings, 'PAGEVIEW_BATCH_SIZE', 200)
+
+
+def _flush_interval():
+    return getattr(settings, 'PAGEVIEW_FLUSH_INTERVAL', 5)
+
+
+def _max_buffered():
+    return getattr(settings, 'PAGEVIEW_BUFFER_MAX', 10000)
+
+
+class PageViewBuffer:
+    """Per-process queue of unsaved PageViews plus the thread that writes them."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._events = deque(maxlen=_max_buffered())
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+        self.dropped = 0
+        self.rejected = 0
+
+    def __len__(self):
+        return len(self._events)
+
+    def add(self, page_view):
+        with self._lock:
+            self._ensure_flusher()
+            if len(self._events) == self._events.maxlen:
+                self.dropped += 1
+            self._events.append(page_view)
+            full = len(self._events) >= _batch_size()
+        if full:
+            self._wake.set()
+
+    def flush(self):
+        """Write everything buffered so far; returns the number of rows written."""
+        with self._lock:
+            events = list(self._events)
+            self._events.clear()
+        if not events:
+            return 0
+        try:
+            # All or nothing, so the row-by-row retry below can't write a row twice
+            with transaction.atomic():
+                PageView.objects.bulk_create(events, batch_size=max(_batch_size(), 1))
+        except Exception:
+            logger.warning("Could not write %s buffered page views as a batch; retrying them one by one", len(events), exc_info=True)
+            return self._flush_rows(events)
+        return len(events)
+
+    def _flush_rows(self, events):
+        written = 0
+        for position, event in enumerate(events):
+            try:
+                with transaction.atomic():
+                    event.save(force_insert=True)
+            except (DataError, IntegrityError, TypeError, ValueError):
+                # This row can never be written; drop it so it doesn't block the rest
+                with self._lock:
+                    self.rejected += 1
+                logger.exception("Dropping page view for %r that the database rejected", event.path)
+            except Exception:
+                logger.exception("Could not write %s buffered page views; keeping them for the next flush", len(events) - position)
+                self._requeue(events[position:])
+                break
+            else:
+                written += 1
+        return written
+
+    def _requeue(self, events):
+        with self._lock:
+            # Failed rows go back in front of newer ones; past maxlen the oldest fall off
+            kept = deque(events + list(self._events), maxlen=self._events.maxlen)
+            self.dropped += len(events) + len(self._events) - len(kept)
+            self._events = kept
+
+    def _ensure_flusher(self):
+        # Called with the lock held. A forked worker inherits neither the thread nor the parent's events.
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        if self._pid != os.getpid():
+            self._events.clear()
+            self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name='pageview-flusher', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(_flush_interval())
+            self._wake.clear()
+            close_old_connections()
+            try:
+                self.flush()
+            finally:
+                close_old_connections()
+
+
+buffer = PageViewBuffer()
+
+
+def record(page_view):
+    """Queue an unsaved PageView for the next batch (or save it now when buffering is off)."""
+    if _batch_size() <= 0:
+        page_view.save()
+        return
+    buffer.add(page_view)
+
+
+def flush():
+    return buffer.flush()
+
+
+# A clean worker shutdown writes whatever is still queued
+atexit.register(flush)
@@ -0,0 +1,297 @@
+# store/payments.py
+"""Paystack payment confirmation.
+
+A payment can be reported twice: by the customer's browser (process_order,
+after the inline checkout closes) and by Paystack's ``charge.success`` webhook,
+which may itself be delivered more than once. Each path first claims the
+payment reference in `PaymentConfirmation` (the reference is unique). Only the
+claimant verifies the payment and finalizes the order; everyone else gets back
+the recorded outcome. A failed attempt, or a claim left behind by a crashed
+worker, can be claimed again.
+
+Verification calls (`verify_transaction`) share one pooled ``requests.Session``
+with connect/read timeouts and retries, so a slow upstream costs a bounded
+wait instead of a whole worker. PAYSTACK_API_BASE can point it at a local
+stand-in server. Webhook payloads are signed (HMAC-SHA512 of the raw body with
+the secret key) and carry the transaction object, so they need no extra call.
+"""
+import hashlib
+import hmac
+import json
+import logging
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from urllib.parse import quote
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from . import reservations, rollups
+from .cart import summary_key
+from .models import ActivityLog, Order, OrderItem, PaymentConfirmation, ShippingAddress
+
+logger = logging.getLogger(__name__)
+
+# A PROCESSING claim older than this is assumed abandoned (worker died mid-way)
+CLAIM_TIMEOUT = timedelta(minutes=5)
+
+
+class PaymentError(Exception):
+    """The payment can't be accepted for the order; ``code`` is a short machine-readable reason."""
+
+    def __init__(self, message, code='payment_failed'):
+        super().__init__(message)
+        self.message = message
+        self.code = code
+
+
+# -------------------------------------------------------------------------------------
+# --- PAYSTACK API ---
+# -------------------------------------------------------------------------------------
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """The process-wide Paystack session: keep-alive connections, retries on connect errors and 5xx."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                retry = Retry(
+                    total=getattr(settings, 'PAYSTACK_MAX_RETRIES', 2),
+                    backoff_factor=0.3,
+                    status_forcelist=(429, 500, 502, 503, 504),
+                    allowed_methods=frozenset({'GET'}),
+                    raise_on_status=False,
+                )
+                adapter = HTTPAdapter(pool_connections=2, pool_maxsize=10, max_retries=retry)
+                session = requests.Session()
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+    return _session
+
+
+def _timeout():
+    return (getattr(settings, 'PAYSTACK_CONNECT_TIMEOUT', 3.05), getattr(settings, 'PAYSTACK_TIMEOUT', 10))
+
+
+def verify_transaction(reference):
+    """Paystack's transaction object for ``reference`` (GET /transaction/verify/<reference>)."""
+    base = getattr(settings, 'PAYSTACK_API_BASE', 'https://api.paystack.co').rstrip('/')
+    try:
+        response = get_session().get(
+            f'{base}/transaction/verify/{quote(reference, safe="")}',
+            headers={'Authorization': f'Bearer {settings.PAYSTACK_SECRET_KEY}'},
+            timeout=_timeout(),
+        )
+        payload = response.json()
+    except (requests.RequestException, ValueError) as exc:
+        raise PaymentError(f'Could not reach Paystack: {exc}', code='upstream_error')
+    if not payload.get('status') or not isinstance(payload.get('data'), dict):
+        raise PaymentError(payload.get('message') or 'Payment verification failed')
+    return payload['data']
+
+
+def valid_signature(body, signature):
+    """Does ``signature`` (X-Paystack-Signature) match the raw webhook ``body``?"""
+    secret = settings.PAYSTACK_SECRET_KEY
+    if not secret or not signature:
+        return False
+    expected = hmac.new(secret.encode(), body, hashlib.sha512).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+
+# -------------------------------------------------------------------------------------
+# --- ORDER FINALIZATION ---
+# -------------------------------------------------------------------------------------
+
+def finalize_order(order, transaction_id, user=None, items=None, shipping_address=None):
+    """Mark ``order`` paid: snapshot its prices and totals, deduct stock, log the sales and save
+    the address, all in one transaction.
+
+    ``items`` are the order's OrderItems with products (loaded here if not given).
+    The sale is added to the DailySales rollup in the same transaction.
+    A fixed number of statements whatever the cart size. Raises PaymentError if
+    the order was already completed, and InsufficientStock if stock ran out.
+    """
+    if items is None:
+        items = list(OrderItem.objects.filter(order=order).select_related('product'))
+    quantities = {item.product_id: item.quantity for item in items if item.product_id and item.quantity > 0}
+    if user is None and order.customer_id:
+        user = order.customer.user
+
+    # Snapshot what is being charged, so reports never depend on today's prices
+    priced = [item for item in items if item.product_id]
+    for item in priced:
+        item.unit_price = item.product.selling_price
+    total = sum((item.unit_price * (item.quantity or 0) for item in priced), Decimal('0.00'))
+    item_count = sum(item.quantity or 0 for item in items)
+    currency = getattr(settings, 'STORE_CURRENCY', 'GHS')
+
+    with transaction.atomic():
+        # Conditional update: of two racing finalizations only one sees complete=False
+        completed = Order.objects.filter(pk=order.pk, complete=False).update(
+            complete=True, transaction_id=transaction_id, expected_delivery=None,
+            total=total, item_count=item_count, currency=currency,
+        )
+        if not completed:
+            raise PaymentError(f'Order {order.pk} has already been paid.', code='already_paid')
+        OrderItem.objects.bulk_update(priced, ['unit_price'])
+        new_stock = reservations.commit(order, quantities)
+
+        ActivityLog.objects.bulk_create([
+            ActivityLog(
+                user=user,
+                action_type='SALE',
+                description=f"Order {order.id} sold {item.quantity} units of '{item.product.name}'. Stock reduced to {new_stock.get(item.product_id, item.product.stock_quantity)}.",
+                object_id=item.product.pk,
+                object_repr=item.product.name
+            )
+            for item in items if item.product_id and item.quantity > 0
+        ])
+        rollups.record_order(order, priced, total, item_count)
+
+        if shipping_address is not None:
+            shipping_address.save()
+
+    order.complete = True
+    order.transaction_id = transaction_id
+    order.total, order.item_count, order.currency = total, item_count, currency
+    # Clear any existing expected_delivery - admin will set it later if needed
+    order.expected_delivery = None
+    if user is not None:
+        # The buyer's navbar summary still describes the cart that just became an order
+        key = summary_key(user.pk)
+        transaction.on_commit(lambda: cache.delete(key))
+    return order
+
+
+# -------------------------------------------------------------------------------------
+# --- IDEMPOTENT CONFIRMATION ---
+# -------------------------------------------------------------------------------------
+
+def _claim(reference, order, source):
+    """Return ``(confirmation, claimed)``; only the caller with ``claimed=True`` may process the payment."""
+    try:
+        with transaction.atomic():
+            return PaymentConfirmation.objects.create(reference=reference, order=order, source=source), True
+    except IntegrityError:
+        pass
+
+    confirmation = PaymentConfirmation.objects.get(reference=reference)
+    retryable = Q(status=PaymentConfirmation.STATUS_FAILED) | Q(
+        status=PaymentConfirmation.STATUS_PROCESSING, updated_at__lt=timezone.now() - CLAIM_TIMEOUT,
+    )
+    claimed = PaymentConfirmation.objects.filter(retryable, pk=confirmation.pk).update(
+        status=PaymentConfirmation.STATUS_PROCESSING, source=source, error='', updated_at=timezone.now(),
+    )
+    if claimed:
+        confirmation.refresh_from_db()
+    return confirmation, bool(claimed)
+
+
+def _check(order, data):
+    if data.get('status') != 'success':
+        raise PaymentError('Payment verification failed')
+    expected = int(round(order.get_cart_total * 100))
+    if data.get('amount') != expected:
+        raise PaymentError(f"Paid {data.get('amount')} but order {order.pk} costs {expected}", code='amount_mismatch')
+
+
+def _needs_refund(confirmation, order, data, exc):
+    amount = data.get('amount') if data else None
+    logger.error(
+        "Payment %s for order %s was taken (%s minor units) but product %s is out of stock; the customer needs a refund",
+        confirmation.reference, order.pk, amount, exc.product_id,
+    )
+    confirmation.status = PaymentConfirmation.STATUS_NEEDS_REFUND
+    confirmation.amount = amount
+    confirmation.error = str(exc)[:255]
+    confirmation.save(update_fields=['status', 'amount', 'error', 'updated_at'])
+    ActivityLog.objects.create(
+        action_type='PAYMENT_NEEDS_REFUND',
+        description=f"Payment {confirmation.reference} for order {order.pk} was taken but product {exc.product_id} ran out of stock. Refund the customer.",
+        object_id=order.pk,
+        object_repr=f'Order {order.pk}',
+    )
+
+
+def confirm_payment(reference, order, source, data=None, user=None, items=None, shipping_address=None):
+    """Accept Paystack payment ``reference`` for ``order`` exactly once; returns the PaymentConfirmation.
+
+    ``data`` is the transaction object when already known (signed webhook);
+    otherwise it is fetched with verify_transaction(). If another request holds
+    the claim, its confirmation comes back still PROCESSING. Raises PaymentError
+    when the payment can't be accepted; the failure is recorded so a later
+    attempt may retry. A verified payment whose stock has run out raises
+    InsufficientStock and is recorded as NEEDS_REFUND (logged, and in the
+    activity log for staff); it is never retried.
+    """
+    confirmation, claimed = _claim(reference, order, source)
+    if confirmation.order_id != order.pk:
+        raise PaymentError('This payment reference belongs to another order.', code='reference_mismatch')
+    if not claimed:
+        if confirmation.status == PaymentConfirmation.STATUS_CONFIRMED and shipping_address is not None:
+            # The webhook finalized the order first; the address only arrives with the checkout request
+            if not ShippingAddress.objects.filter(order=order).exists():
+                shipping_address.save()
+        return confirmation
+
+    try:
+        if data is None:
+            data = verify_transaction(reference)
+        _check(order, data)
+        with transaction.atomic():
+            finalize_order(order, reference, user=user, items=items, shipping_address=shipping_address)
+            confirmation.status = PaymentConfirmation.STATUS_CONFIRMED
+            confirmation.amount = data.get('amount')
+            confirmation.save(update_fields=['status', 'amount', 'updated_at'])
+    except reservations.InsufficientStock as exc:
+        # The charge went through but the order can't be filled: never retried, left for staff to refund
+        _needs_refund(confirmation, order, data, exc)
+        raise
+    except Exception as exc:
+        confirmation.status = PaymentConfirmation.STATUS_FAILED
+        confirmation.error = str(exc)[:255]
+        confirmation.save(update_fields=['status', 'error', 'updated_at'])
+        raise
+    return confirmation
+
+
+# -------------------------------------------------------------------------------------
+# --- WEBHOOK ---
+# -------------------------------------------------------------------------------------
+
+def handle_event(event):
+    """Process one verified webhook event. Only ``charge.success`` matters; the rest are ignored."""
+    if event.get('event') != 'charge.success':
+        return None
+    data = event.get('data') or {}
+    reference = data.get('reference')
+    metadata = data.get('metadata') or {}
+    if isinstance(metadata, str):
+        try:
+            metadata = json.loads(metadata)
+        except ValueError:
+            metadata = {}
+    order = Order.objects.filter(pk=metadata.get('order_id')).first() if str(metadata.get('order_id', '')).isdigit() else None
+    if not reference or order is None:
+        logger.warning("Paystack charge.success %s does not name a known order", reference)
+        return None
+
+    try:
+        return confirm_payment(reference, order, PaymentConfirmation.SOURCE_WEBHOOK, data=data)
+    except (PaymentError, reservations.InsufficientStock) as exc:
+        # Recorded on the confirmation row; answering 200 stops Paystack from redelivering
+        logger.error("Paystack payment %s for order %s was not accepted: %s", reference, order.pk, exc)
+        return None
@@ -0,0 +1,143 @@
+# store/recommendations.py
+"""Offline "frequently bought together" recommendations.
+
+`build()` streams (order, product) pairs from completed OrderItem rows, ordered
+by order, so only one basket is held in memory at a time. It accumulates a
+sparse product x product co-occurrence matrix: a dict of Counters holding only
+the pairs that were actually bought together. It then keeps the top
+RECOMMENDATIONS_TOP_K partners per product in `ProductRecommendation`.
+
+Run it from `manage.py build_recommendations` or the
+`store.tasks.build_recommendations` Celery task (e.g. nightly from beat).
+Page views only read the precomputed rows: one indexed lookup per product
+page or cart.
+"""
+import heapq
+import logging
+import math
+from collections import Counter, defaultdict
+from itertools import combinations
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import OrderItem, ProductRecommendation
+
+logger = logging.getLogger(__name__)
+
+# Very large baskets (bulk/wholesale orders) say little about affinity and cost O(n^2) pairs
+MAX_BASKET_SIZE = 50
+
+
+def _top_k():
+    return getattr(settings, 'RECOMMENDATIONS_TOP_K', 10)
+
+
+def _min_support():
+    return getattr(settings, 'RECOMMENDATIONS_MIN_SUPPORT', 1)
+
+
+def _baskets():
+    """Yield the set of distinct product ids in each completed order."""
+    rows = (
+        OrderItem.objects.filter(order__complete=True, product__isnull=False)
+        .order_by('order_id')
+        .values_list('order_id', 'product_id')
+        .iterator(chunk_size=5000)
+    )
+    current_order, basket = None, set()
+    for order_id, product_id in rows:
+        if order_id != current_order:
+            if basket:
+                yield basket
+            current_order, basket = order_id, set()
+        basket.add(product_id)
+    if basket:
+        yield basket
+
+
+def co_occurrence():
+    """Return ``(pairs, orders_per_product)``; ``pairs[a][b]`` is the number of orders containing both."""
+    pairs = defaultdict(Counter)
+    orders_per_product = Counter()
+    for basket in _baskets():
+        orders_per_product.update(basket)
+        if len(basket) < 2 or len(basket) > MAX_BASKET_SIZE:
+            continue
+        for a, b in combinations(sorted(basket), 2):
+            pairs[a][b] += 1
+            pairs[b][a] += 1
+    return pairs, orders_per_product
+
+
+def top_related(pairs, orders_per_product, top_k=None, min_support=None):
+    """Pick the top-K partners per product.
+
+    Ranked by co-occurrence count. Ties are broken by cosine similarity, so a
+    partner bought mostly *with* this product beats one that is simply popular.
+    """
+    top_k = top_k or _top_k()
+    min_support = min_support or _min_support()
+    related = {}
+    for product_id, partners in pairs.items():
+        candidates = (
+            (count, count / math.sqrt(orders_per_product[product_id] * orders_per_product[other]), -other)
+            for other, count in partners.items() if count >= min_support
+        )
+        # Negated ids make remaining ties resolve to the older product, deterministically
+        best = [(count, score, -other) for count, score, other in heapq.nlargest(top_k, candidates)]
+        if best:
+            related[product_id] = best
+    return related
+
+
+@transaction.atomic
+def build():
+    """Recompute the whole recommendation table. Returns the number of rows written."""
+    pairs, orders_per_product = co_occurrence()
+    related = top_related(pairs, orders_per_product)
+
+    ProductRecommendation.objects.all().delete()
+    rows = [
+        ProductRecommendation(product_id=product_id, related_id=other, rank=rank, score=score, support=count)
+        for product_id, best in related.items()
+        for rank, (count, score, other) in enumerate(best)
+    ]
+    ProductRecommendation.objects.bulk_create(rows, batch_size=1000)
+    logger.info("Built %s recommendations for %s products", len(rows), len(related))
+    return len(rows)
+
+
+# -------------------------------------------------------------------------------------
+# --- READ PATH ---
+# -------------------------------------------------------------------------------------
+
+def for_product(product_id, limit=4):
+    """In-stock products frequently bought with `product_id`, best first."""
+    rows = (
+        ProductRecommendation.objects.filter(product_id=product_id, related__stock_quantity__gt=0)
+        .select_related('related')
+        .order_by('rank')[:limit]
+    )
+    return [row.related for row in rows]
+
+
+def for_cart(product_ids, limit=4):
+    """In-stock products frequently bought with anything in the cart, excluding the cart itself."""
+    product_ids = list(product_ids)
+    if not product_ids:
+        return []
+    rows = (
+        ProductRecommendation.objects.filter(product_id__in=product_ids, related__stock_quantity__gt=0)
+        .exclude(related_id__in=product_ids)
+        .select_related('related')
+        .order_by('-support', '-score')[:limit * len(product_ids)]
+    )
+    products, seen = [], set()
+    for row in rows:
+        if row.related_id not in seen:
+            seen.add(row.related_id)
+            products.append(row.related)
+        if len(products) >= limit:
+            break
+    return products
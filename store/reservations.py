@@ -0,0 +1,172 @@
+# store/reservations.py
+"""Stock held for open orders (carts) for a limited time.
+
+Adding to a cart reserves the units for STOCK_RESERVATION_TTL seconds, and
+every later change to the cart extends the hold. What a customer can still
+reserve is ``stock_quantity`` minus the unexpired reservations of *other*
+orders. Two buyers racing for the last unit are serialized by locking the
+product row (``select_for_update``) for the few statements it takes to check
+and record the hold. Checkout (`commit`) re-checks under the same lock and
+deducts with an ``F()`` update, so concurrent orders can neither oversell nor
+lose each other's decrements.
+
+Expired rows simply stop counting. `release_expired` (``manage.py
+release_expired_reservations`` / the Celery task of the same name) deletes
+them in batches so the table stays small. Carts that have no hold yet, such as
+a guest cart merged on login or a cart from before reservations existed, get
+one the next time they change or at checkout.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+from django.utils import timezone
+
+from . import facets, storefront_cache, typeahead
+from .models import Product, StockReservation
+
+
+class InsufficientStock(Exception):
+    """``product_id`` can't be held in the requested quantity; ``available`` is the most this order can have."""
+
+    def __init__(self, product_id, available):
+        super().__init__(f'Only {available} units of product {product_id} are available.')
+        self.product_id = product_id
+        self.available = available
+
+
+def _ttl():
+    return timedelta(seconds=getattr(settings, 'STOCK_RESERVATION_TTL', 15 * 60))
+
+
+def _lock_products(product_ids):
+    """Lock the product rows in id order (a fixed order avoids deadlocks) and return {id: stock_quantity}."""
+    return dict(
+        Product.objects.select_for_update().filter(pk__in=product_ids).order_by('pk').values_list('pk', 'stock_quantity')
+    )
+
+
+def _held_by_others(order, product_ids, now):
+    rows = (
+        StockReservation.objects.filter(product_id__in=product_ids, expires_at__gt=now)
+        .exclude(order=order)
+        .values('product_id')
+        .annotate(total=Sum('quantity'))
+    )
+    return {row['product_id']: row['total'] for row in rows}
+
+
+@transaction.atomic
+def hold(order, quantities):
+    """Make ``order``'s reservations match ``quantities`` ({product_id: units}; 0 releases).
+
+    Only increases are checked against availability. Every hold of the order is
+    extended to a fresh TTL. Raises InsufficientStock (and changes nothing) if
+    any increase can't be met.
+    """
+    now = timezone.now()
+    expires_at = now + _ttl()
+    current = {
+        reservation.product_id: reservation
+        for reservation in StockReservation.objects.select_for_update().filter(
+            order=order, product_id__in=list(quantities)
+        )
+    }
+    growing = [
+        pk for pk, quantity in quantities.items()
+        if quantity > 0 and (pk not in current or current[pk].expires_at <= now or quantity > current[pk].quantity)
+    ]
+    if growing:
+        stock = _lock_products(growing)
+        held = _held_by_others(order, growing, now)
+        for pk in growing:
+            room = max(stock.get(pk, 0) - held.get(pk, 0), 0)
+            if quantities[pk] > room:
+                raise InsufficientStock(pk, room)
+
+    to_create, to_update, to_delete = [], [], []
+    for pk, quantity in quantities.items():
+        reservation = current.get(pk)
+        if quantity <= 0:
+            if reservation is not None:
+                to_delete.append(reservation.pk)
+        elif reservation is None:
+            to_create.append(StockReservation(order=order, product_id=pk, quantity=quantity, expires_at=expires_at))
+        elif reservation.quantity != quantity:
+            reservation.quantity = quantity
+            to_update.append(reservation)
+
+    if to_delete:
+        StockReservation.objects.filter(pk__in=to_delete).delete()
+    StockReservation.objects.bulk_create(to_create)
+    StockReservation.objects.bulk_update(to_update, ['quantity'])
+    StockReservation.objects.filter(order=order).update(expires_at=expires_at)
+
+
+def release(order):
+    """Drop every hold of ``order`` (cart cleared)."""
+    StockReservation.objects.filter(order=order).delete()
+
+
+@transaction.atomic
+def commit(order, quantities):
+    """Checkout: deduct ``quantities`` from stock and drop the order's holds.
+
+    Re-checks availability under the product row locks, so an expired hold
+    that someone else has since taken raises InsufficientStock instead of
+    overselling. A fixed number of statements however many lines the cart
+    has. Returns {product_id: new stock_quantity}.
+    """
+    quantities = {pk: quantity for pk, quantity in quantities.items() if quantity > 0}
+    if not quantities:
+        release(order)
+        return {}
+    stock = _lock_products(list(quantities))
+    held = _held_by_others(order, list(quantities), timezone.now())
+    for pk, quantity in quantities.items():
+        room = max(stock.get(pk, 0) - held.get(pk, 0), 0)
+        if quantity > room:
+            raise InsufficientStock(pk, room)
+
+    # One conditional UPDATE for the whole cart; the stock guard also covers backends without row locks
+    deduct = Case(*[When(pk=pk, then=Value(quantity)) for pk, quantity in quantities.items()], output_field=IntegerField())
+    updated = Product.objects.filter(pk__in=list(quantities), stock_quantity__gte=deduct).update(
+        stock_quantity=F('stock_quantity') - deduct
+    )
+    if updated != len(quantities):
+        short = Product.objects.filter(pk__in=list(quantities), stock_quantity__lt=deduct).values_list('pk', 'stock_quantity').first()
+        pk, left = short if short else (next(iter(quantities)), 0)
+        raise InsufficientStock(pk, max(left, 0))
+    release(order)
+    new_stock = {pk: stock[pk] - quantity for pk, quantity in quantities.items()}
+
+    # Queryset updates skip the Product save signals; only selling out changes a card, a facet
+    # or the (in-stock only) typeahead index
+    sold_out = [pk for pk, quantity in new_stock.items() if quantity <= 0]
+    for pk in sold_out:
+        facets.sync_product(pk)
+    if sold_out:
+        typeahead.bump_catalog_version()
+
+    def _invalidate():
+        for pk in sold_out:
+            storefront_cache.invalidate_product(pk)
+
+    if sold_out:
+        transaction.on_commit(_invalidate)
+    return new_stock
+
+
+def release_expired(batch_size=1000, now=None):
+    """Delete reservations that have expired, ``batch_size`` rows per statement; returns how many."""
+    now = now or timezone.now()
+    deleted = 0
+    while True:
+        batch = list(
+            StockReservation.objects.filter(expires_at__lte=now).order_by('pk').values_list('pk', flat=True)[:batch_size]
+        )
+        if not batch:
+            return deleted
+        StockReservation.objects.filter(pk__in=batch, expires_at__lte=now).delete()
+        deleted += len(batch)
@@ -0,0 +1,165 @@
+# store/rollups.py
+"""Daily sales rollup read by the portal dashboards.
+
+`DailySales` holds one row per (day, product) with the units, revenue and
+number of orders, plus one overall row per day (``product`` NULL). Days are
+the store's local calendar days of ``Order.date_ordered``, the same date the
+order list filters on. The dashboards sum a few hundred of these rows instead
+of scanning every OrderItem ever sold.
+
+Checkout (payments.finalize_order) adds each order with `record_order`
+inside its transaction, so the rollup commits or rolls back with the order.
+Recording takes two statements however many lines the order has: an insert
+that ignores rows already present, then one conditional ``F()`` UPDATE that
+increments them all. Concurrent checkouts on the same day therefore can't
+lose each other's increments.
+
+`rebuild` (``manage.py rebuild_daily_sales``) recomputes any date range from
+the orders. Saving or deleting a completed Order (portal and admin edits)
+rebuilds its day through `refresh_days`, called from store.signals; bulk
+updates bypass the signals, so run the command after e.g.
+``backfill_order_totals``.
+"""
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, Count, DecimalField, F, IntegerField, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from .models import DailySales, Order, OrderItem, line_total_expression
+
+
+def _day(order):
+    return timezone.localdate(order.date_ordered) if order.date_ordered else timezone.localdate()
+
+
+def _bounds(field, start=None, end=None):
+    """Filter kwargs restricting datetime ``field`` to local days ``start``..``end`` (inclusive)."""
+    bounds = {}
+    if start is not None:
+        bounds[f'{field}__gte'] = timezone.make_aware(datetime.combine(start, time.min))
+    if end is not None:
+        bounds[f'{field}__lt'] = timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min))
+    return bounds
+
+
+def _days(start=None, end=None):
+    bounds = {}
+    if start is not None:
+        bounds['date__gte'] = start
+    if end is not None:
+        bounds['date__lte'] = end
+    return bounds
+
+
+# -------------------------------------------------------------------------------------
+# --- WRITES ---
+# -------------------------------------------------------------------------------------
+
+@transaction.atomic
+def record_order(order, items, total, item_count):
+    """Add a just-completed ``order`` to its day's rows.
+
+    ``items`` are its loaded OrderItems and ``total`` / ``item_count`` the
+    checkout snapshot; lines are valued at their ``unit_price``.
+    """
+    day = _day(order)
+    deltas = {}
+    for item in items:
+        if not item.product_id or not item.quantity:
+            continue
+        units, revenue = deltas.get(item.product_id, (0, Decimal('0.00')))
+        deltas[item.product_id] = (units + item.quantity, revenue + item.get_total)
+
+    DailySales.objects.bulk_create(
+        [DailySales(date=day, product_id=product_id) for product_id in [None, *deltas]],
+        ignore_conflicts=True,
+    )
+
+    def by_row(values, overall, output_field):
+        whens = [When(product_id=product_id, then=Value(value)) for product_id, value in values.items()]
+        return Case(When(product__isnull=True, then=Value(overall)), *whens, output_field=output_field)
+
+    money = DecimalField(max_digits=14, decimal_places=2)
+    DailySales.objects.filter(Q(product__isnull=True) | Q(product_id__in=list(deltas)), date=day).update(
+        units=F('units') + by_row({pk: units for pk, (units, _) in deltas.items()}, item_count or 0, IntegerField()),
+        revenue=F('revenue') + by_row({pk: revenue for pk, (_, revenue) in deltas.items()}, total or Decimal('0.00'), money),
+        orders=F('orders') + 1,
+    )
+
+
+@transaction.atomic
+def rebuild(start=None, end=None, batch_size=1000):
+    """Recompute the rows for days ``start``..``end`` (dates, inclusive; None = open-ended).
+
+    Returns the number of rows written.
+    """
+    DailySales.objects.filter(**_days(start, end)).delete()
+
+    day = TruncDate('order__date_ordered', tzinfo=timezone.get_current_timezone())
+    product_rows = (
+        OrderItem.objects.filter(order__complete=True, product__isnull=False, quantity__gt=0, **_bounds('order__date_ordered', start, end))
+        .annotate(day=day)
+        .order_by()
+        .values('day', 'product_id')
+        .annotate(units=Sum('quantity'), revenue=Sum(line_total_expression()), orders=Count('order', distinct=True))
+    )
+    overall_rows = (
+        Order.objects.filter(complete=True, **_bounds('date_ordered', start, end))
+        .with_totals()
+        .annotate(day=TruncDate('date_ordered', tzinfo=timezone.get_current_timezone()))
+        .order_by()
+        .values('day')
+        .annotate(units=Sum('cart_items'), revenue=Sum('cart_total'), orders=Count('pk'))
+    )
+
+    rows = [
+        DailySales(date=row['day'], product_id=row['product_id'], units=row['units'] or 0,
+                   revenue=row['revenue'] or Decimal('0.00'), orders=row['orders'])
+        for row in product_rows.iterator()
+    ]
+    rows += [
+        DailySales(date=row['day'], units=row['units'] or 0, revenue=row['revenue'] or Decimal('0.00'), orders=row['orders'])
+        for row in overall_rows.iterator()
+    ]
+    DailySales.objects.bulk_create(rows, batch_size=batch_size)
+    return len(rows)
+
+
+def refresh_days(*moments):
+    """Rebuild the local days containing the datetimes ``moments`` (None entries are skipped)."""
+    for day in sorted({timezone.localdate(moment) for moment in moments if moment}):
+        rebuild(day, day)
+
+
+# -------------------------------------------------------------------------------------
+# --- READS ---
+# -------------------------------------------------------------------------------------
+
+def summary(start=None, end=None):
+    """Completed orders, units and revenue over days ``start``..``end``, plus the average order value."""
+    result = DailySales.objects.filter(product__isnull=True, **_days(start, end)).aggregate(
+        orders=Sum('orders'), units=Sum('units'), revenue=Sum('revenue'),
+    )
+    orders = result['orders'] or 0
+    revenue = result['revenue'] or Decimal('0.00')
+    return {
+        'orders': orders,
+        'units': result['units'] or 0,
+        'revenue': revenue,
+        'average': (revenue / orders if orders else Decimal('0')).quantize(Decimal('0.01')),
+    }
+
+
+def units_sold(start=None, end=None):
+    """Expression for Product.annotate(): units sold over days ``start``..``end`` (0 if none)."""
+    units = (
+        DailySales.objects.filter(product=OuterRef('pk'), **_days(start, end))
+        .order_by()
+        .values('product')
+        .annotate(total=Sum('units'))
+        .values('total')
+    )
+    return Coalesce(Subquery(units), Value(0))
@@ -0,0 +1,271 @@
+# store/search.py
+"""Full-text product search with a pluggable backend.
+
+- SQLite (local dev): an FTS5 virtual table ``store_product_fts`` (porter stemming, bm25 ranking).
+- PostgreSQL (DATABASE_URL): a side table ``store_product_search`` holding a weighted
+  ``tsvector`` with a GIN index, ranked with ``ts_rank``.
+- Anything else falls back to ``name__icontains``.
+
+Both index tables are created by migration 0011 and kept up to date incrementally by the
+receivers in ``store.signals``. Set ``STORE_SEARCH_BACKEND`` to a dotted class path to
+force a particular backend.
+"""
+import logging
+import re
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.utils.module_loading import import_string
+
+from .models import Category, Product
+
+logger = logging.getLogger(__name__)
+
+# Searches are capped so a pasted paragraph can't build an enormous MATCH expression
+MAX_QUERY_TERMS = 8
+
+# Optional result orderings on the stored Product.effective_price column (ORDER BY fragments
+# for the raw-SQL backends; `p` is the joined store_product row)
+PRICE_SORTS = {
+    'price_asc': 'p.effective_price, p.id',
+    'price_desc': 'p.effective_price DESC, p.id DESC',
+}
+
+
+def tokenize(query):
+    """Split a raw search box value into lowercase word tokens."""
+    return re.findall(r'\w+', (query or '').lower())[:MAX_QUERY_TERMS]
+
+
+def product_document(product):
+    """Return the (name, categories) text indexed for a product."""
+    category_names = Category.objects.filter(products=product.pk).values_list('name', flat=True)
+    return product.name or '', ' '.join(category_names)
+
+
+class SearchResults:
+    """Lazily evaluated, ranked result set.
+
+    Supports ``count()`` and slicing so it can be handed straight to
+    ``django.core.paginator.Paginator``; each page is one LIMIT/OFFSET query.
+    ``sort`` is one of PRICE_SORTS, or empty for relevance order.
+    """
+
+    def __init__(self, backend, terms, sort=''):
+        self.backend = backend
+        self.terms = terms
+        self.sort = sort if sort in PRICE_SORTS else ''
+        self._count = None
+
+    def count(self):
+        if self._count is None:
+            self._count = self.backend.count(self.terms) if self.terms else 0
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start = index.start or 0
+        stop = index.stop if index.stop is not None else self.count()
+        if not self.terms or stop <= start:
+            return []
+        ids = self.backend.ranked_ids(self.terms, limit=stop - start, offset=start, sort=self.sort)
+        products = Product.objects.in_bulk(ids)
+        return [products[pk] for pk in ids if pk in products]
+
+
+class BaseSearchBackend:
+    """Interface shared by all search backends."""
+
+    def search(self, query, sort=''):
+        return SearchResults(self, tokenize(query), sort)
+
+    def count(self, terms):
+        raise NotImplementedError
+
+    def ranked_ids(self, terms, limit, offset, sort=''):
+        raise NotImplementedError
+
+    def index_product(self, product):
+        """Insert or refresh one product's index entry (no-op for backends without an index)."""
+
+    def remove_product(self, product_id):
+        """Drop one product's index entry."""
+
+    def clear(self):
+        """Drop every index entry."""
+
+    @transaction.atomic
+    def rebuild(self):
+        """Re-index the whole catalog. Returns the number of products indexed.
+
+        The index is emptied first, so entries left behind by a missed delete signal
+        don't survive; searches keep seeing the old index until the rebuild commits.
+        """
+        self.clear()
+        count = 0
+        for product in Product.objects.all().iterator(chunk_size=500):
+            self.index_product(product)
+            count += 1
+        return count
+
+
+class BasicSearchBackend(BaseSearchBackend):
+    """Fallback for databases without a full-text engine: unranked substring match on name."""
+
+    def _queryset(self, terms):
+        queryset = Product.objects.filter(stock_quantity__gt=0)
+        for term in terms:
+            queryset = queryset.filter(name__icontains=term)
+        return queryset
+
+    def count(self, terms):
+        return self._queryset(terms).count()
+
+    def ranked_ids(self, terms, limit, offset, sort=''):
+        ordering = {'price_asc': ('effective_price', 'id'), 'price_desc': ('-effective_price', '-id')}.get(sort, ('name', 'id'))
+        return list(self._queryset(terms).order_by(*ordering).values_list('id', flat=True)[offset:offset + limit])
+
+
+class SQLiteFTSBackend(BaseSearchBackend):
+    """SQLite FTS5 index; rowid is the product id."""
+
+    table = 'store_product_fts'
+    # bm25 column weights: name matches count far more than category matches
+    rank = f'bm25({table}, 10.0, 2.0)'
+
+    def _match(self, terms):
+        # Quoted prefix terms, implicitly ANDed: "gala"* "phon"*
+        return ' '.join(f'"{term}"*' for term in terms)
+
+    def count(self, terms):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT COUNT(*) FROM {self.table} JOIN store_product p ON p.id = {self.table}.rowid '
+                f'WHERE {self.table} MATCH %s AND p.stock_quantity > 0',
+                [self._match(terms)],
+            )
+            return cursor.fetchone()[0]
+
+    def ranked_ids(self, terms, limit, offset, sort=''):
+        order_by = PRICE_SORTS.get(sort) or f'{self.rank}, p.id'
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT {self.table}.rowid FROM {self.table} JOIN store_product p ON p.id = {self.table}.rowid '
+                f'WHERE {self.table} MATCH %s AND p.stock_quantity > 0 '
+                f'ORDER BY {order_by} LIMIT %s OFFSET %s',
+                [self._match(terms), limit, offset],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def index_product(self, product):
+        name, categories = product_document(product)
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE rowid = %s', [product.pk])
+            cursor.execute(
+                f'INSERT INTO {self.table} (rowid, name, categories) VALUES (%s, %s, %s)',
+                [product.pk, name, categories],
+            )
+
+    def remove_product(self, product_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE rowid = %s', [product_id])
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """PostgreSQL tsvector side table with a GIN index."""
+
+    table = 'store_product_search'
+    config = 'english'
+
+    def _tsquery(self, terms):
+        # Prefix terms, ANDed: gala:* & phon:*
+        return ' & '.join(f'{term}:*' for term in terms)
+
+    def count(self, terms):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT COUNT(*) FROM {self.table} s JOIN store_product p ON p.id = s.product_id '
+                f'WHERE s.document @@ to_tsquery(%s, %s) AND p.stock_quantity > 0',
+                [self.config, self._tsquery(terms)],
+            )
+            return cursor.fetchone()[0]
+
+    def ranked_ids(self, terms, limit, offset, sort=''):
+        order_by = PRICE_SORTS.get(sort) or 'ts_rank(s.document, q) DESC, p.id'
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT s.product_id FROM {self.table} s JOIN store_product p ON p.id = s.product_id, '
+                f'to_tsquery(%s, %s) q '
+                f'WHERE s.document @@ q AND p.stock_quantity > 0 '
+                f'ORDER BY {order_by} LIMIT %s OFFSET %s',
+                [self.config, self._tsquery(terms), limit, offset],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def index_product(self, product):
+        name, categories = product_document(product)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {self.table} (product_id, document) VALUES '
+                f"(%s, setweight(to_tsvector(%s, %s), 'A') || setweight(to_tsvector(%s, %s), 'B')) "
+                f'ON CONFLICT (product_id) DO UPDATE SET document = EXCLUDED.document',
+                [product.pk, self.config, name, self.config, categories],
+            )
+
+    def remove_product(self, product_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE product_id = %s', [product_id])
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+
+
+_backend = None
+
+
+def get_backend():
+    """Return the configured search backend (chosen once per process)."""
+    global _backend
+    if _backend is None:
+        backend_path = getattr(settings, 'STORE_SEARCH_BACKEND', None)
+        if backend_path:
+            _backend = import_string(backend_path)()
+        elif connection.vendor == 'postgresql':
+            _backend = PostgresSearchBackend()
+        elif connection.vendor == 'sqlite':
+            _backend = SQLiteFTSBackend()
+        else:
+            _backend = BasicSearchBackend()
+    return _backend
+
+
+def search_products(query, sort=''):
+    """Ranked (or price-sorted), in-stock products matching ``query`` (prefix match on every term)."""
+    return get_backend().search(query, sort)
+
+
+def index_product(product):
+    """Refresh a product's index entry. Index failures are logged, never raised to the caller."""
+    try:
+        # Savepoint so a failed index write can't poison the caller's transaction on Postgres
+        with transaction.atomic():
+            get_backend().index_product(product)
+    except DatabaseError:
+        logger.exception("Failed to index product %s for search", product.pk)
+
+
+def remove_product(product_id):
+    try:
+        with transaction.atomic():
+            get_backend().remove_product(product_id)
+    except DatabaseError:
+        logger.exception("Failed to remove product %s from the search index", product_id)
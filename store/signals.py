@@ -1,9 +1,16 @@
 # store/signals.py
 
-from django.db.models.signals import post_save
+import logging
+
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_save, pre_delete, m2m_changed
 from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_logged_in
 from django.dispatch import receiver
-from .models import Customer # Assuming your Customer model is here
+from .models import Customer, Order, Product, Category, ProductImage
+from . import facets, guest_cart, image_derivatives, media_urls, rollups, search, storefront_cache, typeahead
+
+logger = logging.getLogger(__name__)
 
 @receiver(post_save, sender=User)
 def create_customer_profile(sender, instance, created, **kwargs):
@@ -25,4 +32,276 @@ def create_customer_profile(sender, instance, created, **kwargs):
 @receiver(post_save, sender=User)
 def save_customer_profile(sender, instance, **kwargs):
     if hasattr(instance, 'customer'):
-        instance.customer.save()
\ No newline at end of file
+        instance.customer.save()
+
+
+# -------------------------------------------------------------------------------------
+# --- GUEST CART MERGE ON LOGIN (see store/guest_cart.py) ---
+# -------------------------------------------------------------------------------------
+
+@receiver(user_logged_in)
+def merge_guest_cart(sender, request, user, **kwargs):
+    from .cart import get_request_cart
+    if request is None:
+        return
+    lines = guest_cart.read(request)
+    if not lines:
+        return
+    cart = get_request_cart(request)
+    # Anything resolved before login belonged to the anonymous visitor
+    cart.reset()
+    try:
+        guest_cart.merge_into_customer(cart.customer, lines)
+    except Exception:
+        # Never block a login over the cart; the cookie is kept for the next attempt
+        logger.exception("Could not merge the guest cart for user %s", user.pk)
+        return
+    cart.refresh_summary()
+    # CartMiddleware deletes the cookie on this response
+    request.guest_cart_merged = True
+
+
+# -------------------------------------------------------------------------------------
+# --- STOREFRONT CACHE INVALIDATION (see store/storefront_cache.py) ---
+# -------------------------------------------------------------------------------------
+
+def _category_ids(product_id):
+    return list(Category.objects.filter(products=product_id).values_list('id', flat=True))
+
+
+@receiver(post_save, sender=Product)
+def invalidate_storefront_on_product_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    storefront_cache.invalidate_product(instance.pk, _category_ids(instance.pk))
+
+
+@receiver(pre_delete, sender=Product)
+def remember_product_categories(sender, instance, **kwargs):
+    # The M2M rows are gone by post_delete, so capture the sections to drop now
+    instance._storefront_category_ids = _category_ids(instance.pk)
+
+
+@receiver(post_delete, sender=Product)
+def invalidate_storefront_on_product_delete(sender, instance, **kwargs):
+    storefront_cache.invalidate_product(instance.pk, getattr(instance, '_storefront_category_ids', []))
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_storefront_on_category_change(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    storefront_cache.invalidate_category(instance.pk)
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def invalidate_storefront_on_image_change(sender, instance, raw=False, **kwargs):
+    if raw or not instance.product_id:
+        return
+    storefront_cache.invalidate_product(instance.product_id, _category_ids(instance.product_id))
+
+
+@receiver(m2m_changed, sender=Product.categories.through)
+def invalidate_storefront_on_membership_change(sender, instance, action, reverse, pk_set, **kwargs):
+    """Product <-> Category membership changed (from either side of the relation)."""
+    if action == 'pre_clear' and not reverse:
+        # clear() sends no pk_set, so remember which sections the product was in
+        instance._storefront_category_ids = _category_ids(instance.pk)
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if reverse:
+        # instance is a Category; pk_set holds product ids
+        category_ids = [instance.pk]
+    elif action == 'post_clear':
+        category_ids = getattr(instance, '_storefront_category_ids', [])
+    else:
+        category_ids = pk_set or []
+    storefront_cache.invalidate(category_ids=category_ids, uncategorized=True)
+
+
+# -------------------------------------------------------------------------------------
+# --- SEARCH INDEX MAINTENANCE (see store/search.py) ---
+# -------------------------------------------------------------------------------------
+
+def _reindex_products(product_ids):
+    for product in Product.objects.filter(pk__in=list(product_ids)):
+        search.index_product(product)
+
+
+@receiver(post_save, sender=Product)
+def index_product_on_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    search.index_product(instance)
+
+
+@receiver(post_delete, sender=Product)
+def remove_product_from_index(sender, instance, **kwargs):
+    search.remove_product(instance.pk)
+
+
+@receiver(pre_delete, sender=Category)
+def remember_category_products(sender, instance, **kwargs):
+    instance._search_product_ids = list(instance.products.values_list('id', flat=True))
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def reindex_category_products(sender, instance, created=False, raw=False, **kwargs):
+    # Category names are part of each product's document
+    if raw or created:
+        return
+    product_ids = getattr(instance, '_search_product_ids', None)
+    if product_ids is None:
+        product_ids = instance.products.values_list('id', flat=True)
+    _reindex_products(product_ids)
+
+
+@receiver(m2m_changed, sender=Product.categories.through)
+def reindex_on_membership_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        instance._search_product_ids = list(instance.products.values_list('id', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        search.index_product(instance)
+    elif action == 'post_clear':
+        _reindex_products(getattr(instance, '_search_product_ids', []))
+    else:
+        _reindex_products(pk_set or [])
+
+
+# -------------------------------------------------------------------------------------
+# --- CATALOG FACET COUNTS (see store/facets.py) ---
+# -------------------------------------------------------------------------------------
+
+@receiver(post_save, sender=Product)
+def sync_facets_on_product_save(sender, instance, raw=False, **kwargs):
+    # Price, discount and stock all feed the facet values
+    if raw:
+        return
+    facets.sync_product(instance.pk)
+
+
+@receiver(pre_delete, sender=Product)
+def remove_product_facets(sender, instance, **kwargs):
+    # The rows would cascade anyway, but the counters have to be decremented
+    facets.sync_product(instance.pk, wanted=set())
+
+
+@receiver(post_delete, sender=Category)
+def drop_category_facet(sender, instance, **kwargs):
+    facets.drop_category(instance.pk)
+
+
+@receiver(m2m_changed, sender=Product.categories.through)
+def sync_facets_on_membership_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        instance._facet_product_ids = list(instance.products.values_list('id', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        facets.sync_product(instance.pk)
+        return
+    product_ids = getattr(instance, '_facet_product_ids', []) if action == 'post_clear' else (pk_set or [])
+    for product_id in product_ids:
+        facets.sync_product(product_id)
+
+
+# -------------------------------------------------------------------------------------
+# --- TYPEAHEAD INDEX VERSION (see store/typeahead.py) ---
+# -------------------------------------------------------------------------------------
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def bump_catalog_version(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    typeahead.bump_catalog_version()
+
+
+# -------------------------------------------------------------------------------------
+# --- DAILY SALES ROLLUP (see store/rollups.py) ---
+# -------------------------------------------------------------------------------------
+
+@receiver(pre_save, sender=Order)
+def remember_order_sales_day(sender, instance, raw=False, **kwargs):
+    # An edit can move a completed order to another day or take it out of the rollup
+    if raw or instance.pk is None:
+        return
+    instance._sales_date_ordered = (
+        Order.objects.filter(pk=instance.pk, complete=True).values_list('date_ordered', flat=True).first()
+    )
+
+
+@receiver(post_save, sender=Order)
+def refresh_daily_sales_on_order_save(sender, instance, raw=False, **kwargs):
+    # Checkout completes orders with a queryset update and records them itself (rollups.record_order)
+    if raw:
+        return
+    previous = getattr(instance, '_sales_date_ordered', None)
+    if instance.complete or previous:
+        rollups.refresh_days(previous, instance.date_ordered if instance.complete else None)
+
+
+@receiver(post_delete, sender=Order)
+def refresh_daily_sales_on_order_delete(sender, instance, **kwargs):
+    if instance.complete:
+        rollups.refresh_days(instance.date_ordered)
+
+
+# -------------------------------------------------------------------------------------
+# --- DENORMALIZED COVER IMAGE / IMAGE COUNT (see Product.refresh_image_summary) ---
+# -------------------------------------------------------------------------------------
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def refresh_product_image_summary(sender, instance, raw=False, **kwargs):
+    if raw or not instance.product_id:
+        return
+    product = Product.objects.filter(pk=instance.product_id).first()
+    if product is not None:
+        product.refresh_image_summary()
+
+
+# -------------------------------------------------------------------------------------
+# --- RESPONSIVE IMAGE DERIVATIVES (see store/image_derivatives.py) ---
+# -------------------------------------------------------------------------------------
+
+def _enqueue_image_derivatives(image_id):
+    from .tasks import generate_image_derivatives
+    try:
+        # retry=False: fail fast instead of stalling the request when the broker is down
+        generate_image_derivatives.apply_async((image_id,), retry=False)
+    except Exception:
+        # No broker reachable: the original upload is still served, so just log it
+        logger.exception("Could not queue image derivatives for ProductImage %s", image_id)
+
+
+@receiver(post_save, sender=ProductImage)
+def queue_image_derivatives(sender, instance, raw=False, **kwargs):
+    if raw or not instance.image or instance.image.name == instance.derivatives_source:
+        return
+    image_id = instance.pk
+    transaction.on_commit(lambda: _enqueue_image_derivatives(image_id))
+
+
+@receiver(post_delete, sender=ProductImage)
+def delete_image_derivatives(sender, instance, **kwargs):
+    storage, derivatives = instance.image.storage, instance.derivatives
+    names = [instance.image.name] + [
+        entry.get(fmt) for entry in (derivatives or {}).values() for fmt in image_derivatives.FORMATS
+    ]
+    # Memoized URLs are keyed by name, so these entries can never be hit again
+    for name in filter(None, names):
+        media_urls.forget(name, storage)
+    if derivatives:
+        transaction.on_commit(lambda: image_derivatives.delete_derivatives(storage, derivatives))
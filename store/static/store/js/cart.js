@@ -1,6 +1,14 @@
+// A fresh key per user action; the server replays its first answer if the request is retried
+function newIdempotencyKey(){
+    if (window.crypto && window.crypto.randomUUID) {
+        return window.crypto.randomUUID();
+    }
+    return Date.now().toString(36) + '-' + Math.random().toString(36).slice(2);
+}
+
 // Function to send data to the Django update_item view using AJAX
 function updateUserOrder(productId, action){
-    console.log('User is logged in, sending data...');
+    console.log('Sending cart update...');
 
     // The endpoint path
     var url = '/store/update_item/';
@@ -11,6 +19,7 @@ function updateUserOrder(productId, action){
             'Content-Type': 'application/json',
             // CRITICAL: Assumes 'csrftoken' is globally defined in base.html
             'X-CSRFToken': csrftoken, 
+            'Idempotency-Key': newIdempotencyKey(),
         },
         // Send the data as a JSON string
         body: JSON.stringify({'productId': productId, 'action': action}) 
@@ -67,6 +76,38 @@ function updateUserOrder(productId, action){
 }
 
 
+// Send several cart changes at once to the update_cart view (one request, applied all-or-nothing).
+// operations: [{productId: 12, action: 'add'|'remove'|'set'|'delete'|'clear', quantity: 2}, ...]
+function updateCartBatch(operations){
+    return fetch('/store/update_cart/', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            'X-CSRFToken': csrftoken,
+            'Idempotency-Key': newIdempotencyKey(),
+        },
+        body: JSON.stringify({'operations': operations})
+    })
+    .then((response) => response.json().then((data) => ({ response, data })))
+    .then(({ response, data }) => {
+        var cartTotalElement = document.getElementById('cart-total');
+        if (cartTotalElement && data.cartItems !== undefined) {
+            cartTotalElement.innerText = data.cartItems;
+        }
+        if (!response.ok) {
+            alert(data.message || 'Could not update the cart.');
+            return data;
+        }
+        if (window.location.pathname.includes('/store/cart/')) {
+            window.location.reload();
+        }
+        return data;
+    })
+    .catch((error) => {
+        console.error('Fetch Error:', error);
+    });
+}
+
 document.addEventListener('DOMContentLoaded', function() {
     
     // Select all buttons with the update-cart or add-to-cart class
@@ -77,22 +118,39 @@ document.addEventListener('DOMContentLoaded', function() {
     console.log(`Found ${updateBtns.length} total cart buttons.`);
     // -----------------------------
     
-    updateBtns.forEach(function(btn) {
-        btn.addEventListener('click', function(e){ 
-            e.preventDefault(); // Stop default button/link action
-            
-            var productId = this.dataset.product;
-            var action = this.dataset.action; 
-            
-            console.log(`Button Clicked. Product ID: ${productId}, Action: ${action}`);
+    // Delegate from the document so buttons added later (e.g. storefront "Show more") also work
+    document.addEventListener('click', function(e){ 
+        var btn = e.target.closest('.update-cart, .add-to-cart');
+        if (!btn) {
+            return;
+        }
+        e.preventDefault(); // Stop default button/link action
+        
+        var productId = btn.dataset.product;
+        var action = btn.dataset.action; 
+        
+        console.log(`Button Clicked. Product ID: ${productId}, Action: ${action}`);
 
-            // Check if user variable is globally defined and not AnonymousUser
-            // Assumes 'user' is correctly set in base.html 
-            if (typeof user !== 'undefined' && user !== 'AnonymousUser'){
-                updateUserOrder(productId, action);
-            } else {
-                // Replaced alert() with console warn message
-                console.warn("Authentication required: Please log in to update the cart.");
+        // Guests are handled server-side too (signed cart cookie), so always post the update
+        updateUserOrder(productId, action);
+    });
+
+    // "Buy again" on the orders page: add every line of a past order in one request
+    document.addEventListener('click', function(e){
+        var btn = e.target.closest('.reorder-cart');
+        if (!btn || !btn.dataset.items) {
+            return;
+        }
+        e.preventDefault();
+        var operations = btn.dataset.items.split(',').filter(Boolean).map(function(pair){
+            var parts = pair.split(':');
+            return {'productId': parts[0], 'action': 'add', 'quantity': parseInt(parts[1], 10)};
+        });
+        btn.disabled = true;
+        updateCartBatch(operations).then(function(data){
+            btn.disabled = false;
+            if (data && data.cart) {
+                window.location.href = '/store/cart/';
             }
         });
     });
@@ -0,0 +1,237 @@
+# store/storefront_cache.py
+"""Read-through cache for the rendered store front.
+
+The catalog only changes a few times a day, so the category sections shown by
+`store_view` (and the product cards inside them) are rendered once and kept in
+the default cache. Keys are per category and per product; the receivers in
+`store.signals` drop exactly the keys affected by a catalog edit.
+
+Invalidation has to reach every gunicorn worker and the Celery worker, so
+fragments are only cached when the cache is shared (SHARED_CACHE, on with
+REDIS_URL). On a per-process cache every request renders afresh. Cards embed
+resolved image URLs, so entries never outlive a signed S3 URL either (see
+media_urls.cap_for_signed_urls).
+"""
+import logging
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q
+from django.template.loader import render_to_string
+
+from . import media_urls
+from .models import Category, Product
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'storefront'
+INDEX_KEY = f'{KEY_PREFIX}:index'
+# Pseudo category id for the "Other Products" section
+UNCATEGORIZED = 'uncategorized'
+
+
+def _timeout():
+    return media_urls.cap_for_signed_urls(getattr(settings, 'STOREFRONT_CACHE_TIMEOUT', 6 * 60 * 60))
+
+
+def enabled():
+    return getattr(settings, 'SHARED_CACHE', False)
+
+
+def section_key(category_id):
+    return f'{KEY_PREFIX}:section:{category_id}'
+
+
+def card_key(product_id):
+    return f'{KEY_PREFIX}:card:{product_id}'
+
+
+# -------------------------------------------------------------------------------------
+# --- READ PATH ---
+# -------------------------------------------------------------------------------------
+
+def _build_index():
+    """Ordered section ids: categories with in-stock products, then the uncategorized section."""
+    section_ids = list(
+        Category.objects.annotate(
+            product_count=Count('products', filter=Q(products__stock_quantity__gt=0))
+        ).filter(product_count__gt=0).order_by('display_order', 'name').values_list('id', flat=True)
+    )
+    if Product.objects.filter(categories__isnull=True, stock_quantity__gt=0).exists():
+        section_ids.append(UNCATEGORIZED)
+    return section_ids
+
+
+def render_product_cards(products):
+    """Return the card HTML for each product, rendering (and caching) only the misses."""
+    by_key = {card_key(product.pk): product for product in products}
+    cached = cache.get_many(list(by_key)) if enabled() else {}
+
+    cards = []
+    missing = {}
+    for key, product in by_key.items():
+        html = cached.get(key)
+        if html is None:
+            html = render_to_string('store/partials/product_card.html', {'product': product})
+            missing[key] = html
+        cards.append(html)
+
+    if missing and enabled():
+        cache.set_many(missing, _timeout())
+    return cards
+
+
+def _section_size():
+    return getattr(settings, 'STOREFRONT_SECTION_SIZE', 12)
+
+
+def section_products(section_id):
+    """In-stock products of one section, unordered. Returns None for an unknown section."""
+    if section_id == UNCATEGORIZED:
+        return Product.objects.filter(categories__isnull=True, stock_quantity__gt=0)
+    try:
+        return Product.objects.filter(categories=int(section_id), stock_quantity__gt=0)
+    except (TypeError, ValueError):
+        return None
+
+
+# Keyset orderings for product listings: (sort field, tie-break field). A leading '-' means descending.
+SORTS = {
+    '': ('display_order', 'id'),
+    'price_asc': ('effective_price', 'id'),
+    'price_desc': ('-effective_price', '-id'),
+}
+
+
+def encode_cursor(product, sort=''):
+    field = SORTS.get(sort, SORTS[''])[0].lstrip('-')
+    return f'{getattr(product, field)}_{product.pk}'
+
+
+# Cursor parts beyond these can't come from a real row; PostgreSQL would reject them as out of range
+MAX_CURSOR_ID = 2 ** 63 - 1
+MAX_CURSOR_VALUE = Decimal('1e18')
+
+
+def decode_cursor(cursor):
+    """Parse a ``<sort value>_<id>`` cursor; returns None when malformed or out of range."""
+    try:
+        value, pk = cursor.rsplit('_', 1)
+        value, pk = Decimal(value), int(pk)
+    except (AttributeError, ValueError, InvalidOperation):
+        return None
+    if not value.is_finite() or abs(value) >= MAX_CURSOR_VALUE or not 0 < pk <= MAX_CURSOR_ID:
+        return None
+    return value, pk
+
+
+def product_page(products, after=None, limit=None, sort=''):
+    """Keyset (seek) page of ``products`` in one of the SORTS orderings (storefront order by default).
+
+    Returns ``(products, next_cursor)``; ``next_cursor`` is None on the last page.
+    Seeking past the cursor keeps every page an index range scan, however deep.
+    """
+    limit = limit or _section_size()
+    field, tie_break = SORTS.get(sort, SORTS[''])
+    products = products.order_by(field, tie_break)
+    if after is not None:
+        value, pk = after
+        name = field.lstrip('-')
+        op = 'lt' if field.startswith('-') else 'gt'
+        products = products.filter(
+            Q(**{f'{name}__{op}': value}) | Q(**{name: value, f'id__{op}': pk})
+        )
+    page = list(products[:limit + 1])
+    if len(page) > limit:
+        page = page[:limit]
+        return page, encode_cursor(page[-1], sort)
+    return page, None
+
+
+def _render_section(section_id):
+    if section_id == UNCATEGORIZED:
+        category = None
+    else:
+        category = Category.objects.filter(pk=section_id).first()
+        if category is None:
+            return ''
+
+    products, next_cursor = product_page(section_products(section_id))
+    cards = render_product_cards(products)
+    if not cards:
+        return ''
+    return render_to_string('store/partials/category_section.html', {
+        'category': category,
+        'section_id': section_id,
+        'cards': cards,
+        'next_cursor': next_cursor,
+    })
+
+
+def get_storefront_sections():
+    """Return the rendered HTML of every non-empty storefront section, in display order."""
+    if not enabled():
+        return [html for html in map(_render_section, _build_index()) if html]
+
+    section_ids = cache.get(INDEX_KEY)
+    if section_ids is None:
+        section_ids = _build_index()
+        cache.set(INDEX_KEY, section_ids, _timeout())
+
+    keys = [section_key(section_id) for section_id in section_ids]
+    cached = cache.get_many(keys)
+
+    sections = []
+    missing = {}
+    for section_id, key in zip(section_ids, keys):
+        html = cached.get(key)
+        if html is None:
+            html = _render_section(section_id)
+            missing[key] = html
+        if html:
+            sections.append(html)
+
+    if missing:
+        cache.set_many(missing, _timeout())
+    return sections
+
+
+# -------------------------------------------------------------------------------------
+# --- INVALIDATION (called from store.signals) ---
+# -------------------------------------------------------------------------------------
+
+def invalidate(product_ids=(), category_ids=(), uncategorized=False):
+    """Drop the given cards and sections plus the section index once the transaction commits.
+
+    Deleting on commit (instead of immediately) stops a concurrent request from
+    re-caching the pre-edit rows between the delete and the commit.
+    """
+    keys = [card_key(pk) for pk in product_ids]
+    keys += [section_key(pk) for pk in category_ids]
+    if uncategorized:
+        keys.append(section_key(UNCATEGORIZED))
+    keys.append(INDEX_KEY)
+
+    def _delete():
+        try:
+            cache.delete_many(keys)
+        except Exception:
+            # A cache outage must never break a catalog edit; entries expire on their own
+            logger.exception("Failed to invalidate storefront cache keys %s", keys)
+
+    transaction.on_commit(_delete)
+
+
+def invalidate_product(product_id, category_ids=None):
+    """A product's card changed: drop it and every section that shows it."""
+    if category_ids is None:
+        category_ids = Category.objects.filter(products=product_id).values_list('id', flat=True)
+    category_ids = list(category_ids)
+    invalidate(product_ids=[product_id], category_ids=category_ids, uncategorized=not category_ids)
+
+
+def invalidate_category(category_id):
+    """A category changed or was removed; its products may have become uncategorized."""
+    invalidate(category_ids=[category_id], uncategorized=True)
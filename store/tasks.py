@@ -52,3 +52,113 @@ def _reconstruct_context(context: dict) -> dict:
             reconstructed[key] = value
     
     return reconstructed
+
+
+@shared_task(bind=True, name='store.tasks.generate_image_derivatives', ignore_result=True)
+def generate_image_derivatives(self, image_id: int) -> None:
+    """Build the responsive WebP/JPEG sizes for one ProductImage (see store/image_derivatives.py).
+
+    Queued from the ProductImage post_save receiver once the upload has committed.
+    """
+    import logging
+    from store import image_derivatives, storefront_cache
+    from store.models import ProductImage
+    logger = logging.getLogger(__name__)
+
+    product_image = ProductImage.objects.select_related('product').filter(pk=image_id).first()
+    if product_image is None or not product_image.image:
+        return
+    source_name = product_image.image.name
+    if product_image.derivatives_source == source_name:
+        return
+
+    storage = product_image.image.storage
+    try:
+        derivatives = image_derivatives.generate_derivatives(product_image)
+    except Exception as exc:
+        # Same policy as send_mail_task: log, don't retry. The original image is still served.
+        logger.error(f"[CELERY WORKER] generate_image_derivatives failed for {image_id}: {exc}", exc_info=True)
+        return
+
+    # Only record the result if the image wasn't replaced while we were working
+    updated = ProductImage.objects.filter(pk=image_id, image=source_name).update(
+        derivatives=derivatives,
+        derivatives_source=source_name,
+    )
+    if not updated:
+        image_derivatives.delete_derivatives(storage, derivatives)
+        return
+
+    new_names = {name for entry in derivatives.values() for name in entry.values() if isinstance(name, str)}
+    stale = {
+        size: {fmt: name for fmt, name in entry.items() if name not in new_names}
+        for size, entry in (product_image.derivatives or {}).items()
+    }
+    image_derivatives.delete_derivatives(storage, stale)
+
+    product_image.product.refresh_image_summary()
+    storefront_cache.invalidate_product(product_image.product_id)
+    logger.info(f"[CELERY WORKER] Built {len(derivatives)} derivative sizes for ProductImage {image_id}")
+
+
+@shared_task(bind=True, name='store.tasks.build_recommendations', ignore_result=True)
+def build_recommendations(self) -> None:
+    """Rebuild the "frequently bought together" table (see store/recommendations.py).
+
+    Intended to run periodically (e.g. nightly via celery beat); page views only read its output.
+    """
+    import logging
+    from store import recommendations
+    logger = logging.getLogger(__name__)
+
+    try:
+        count = recommendations.build()
+    except Exception as exc:
+        logger.error(f"[CELERY WORKER] build_recommendations failed: {exc}", exc_info=True)
+        return
+    logger.info(f"[CELERY WORKER] Stored {count} product recommendations")
+
+
+@shared_task(bind=True, name='store.tasks.purge_abandoned_carts', ignore_result=True)
+def purge_abandoned_carts(self, days: int | None = None, batch_size: int = 1000) -> None:
+    """Delete empty open carts older than CART_ABANDON_DAYS (see store/cart.py). Intended for celery beat."""
+    import logging
+    from store import cart
+    logger = logging.getLogger(__name__)
+
+    try:
+        deleted = cart.purge_abandoned_carts(days=days, batch_size=batch_size)
+    except Exception as exc:
+        logger.error(f"[CELERY WORKER] purge_abandoned_carts failed: {exc}", exc_info=True)
+        return
+    logger.info(f"[CELERY WORKER] Purged {deleted} abandoned empty carts")
+
+
+@shared_task(bind=True, name='store.tasks.release_expired_reservations', ignore_result=True)
+def release_expired_reservations(self, batch_size: int = 1000) -> None:
+    """Delete expired stock reservations (see store/reservations.py). Intended for celery beat, every few minutes."""
+    import logging
+    from store import reservations
+    logger = logging.getLogger(__name__)
+
+    try:
+        deleted = reservations.release_expired(batch_size=batch_size)
+    except Exception as exc:
+        logger.error(f"[CELERY WORKER] release_expired_reservations failed: {exc}", exc_info=True)
+        return
+    logger.info(f"[CELERY WORKER] Released {deleted} expired stock reservations")
+
+
+@shared_task(bind=True, name='store.tasks.purge_idempotency_keys', ignore_result=True)
+def purge_idempotency_keys(self, batch_size: int = 1000) -> None:
+    """Delete stored Idempotency-Key responses past IDEMPOTENCY_KEY_TTL (see store/idempotency.py). Intended for celery beat."""
+    import logging
+    from store import idempotency
+    logger = logging.getLogger(__name__)
+
+    try:
+        deleted = idempotency.purge_expired(batch_size=batch_size)
+    except Exception as exc:
+        logger.error(f"[CELERY WORKER] purge_idempotency_keys failed: {exc}", exc_info=True)
+        return
+    logger.info(f"[CELERY WORKER] Purged {deleted} expired idempotency keys")
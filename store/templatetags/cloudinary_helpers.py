@@ -1,6 +1,8 @@
 from django import template
-from django.conf import settings
 from django.templatetags.static import static
+from django.utils.html import format_html
+
+from store import media_urls
 
 register = template.Library()
 
@@ -12,6 +14,8 @@ def cloud_url(image_field):
     - If Cloudinary is enabled, use cloudinary.utils to build a secure URL.
     - If the value is falsy, return a static placeholder path.
     - Otherwise, fall back to the field's .url attribute.
+
+    Resolved URLs are memoized per process and in the shared cache (store/media_urls.py).
     """
     if not image_field:
         return static('images/placeholder.jpg')
@@ -21,20 +25,50 @@ def cloud_url(image_field):
     if not name:
         return static('images/placeholder.jpg')
 
-    if getattr(settings, 'USE_CLOUDINARY', False):
-        try:
-            from cloudinary.utils import cloudinary_url
-            url, options = cloudinary_url(name, secure=True)
-            return url
-        except Exception:
-            # Fall back to default behaviour if cloudinary isn't available
-            try:
-                return image_field.url
-            except Exception:
-                return static('images/placeholder.jpg')
-
-    # Default: return the ImageField's URL
     try:
-        return image_field.url
+        return media_urls.resolve(image_field, name)
     except Exception:
         return static('images/placeholder.jpg')
+
+
+# -------------------------------------------------------------------------------------
+# Responsive images (derivatives built by store/image_derivatives.py)
+# -------------------------------------------------------------------------------------
+
+def _srcset(derivatives, fmt):
+    entries = sorted((derivatives or {}).values(), key=lambda entry: entry.get('width', 0))
+    return ', '.join(
+        f"{cloud_url(entry[fmt])} {entry['width']}w" for entry in entries if entry.get(fmt)
+    )
+
+
+@register.simple_tag
+def derivative_url(image_field, derivatives, size='detail'):
+    """URL of one JPEG derivative size, falling back to the original image.
+
+    Usage: {% derivative_url image.image image.derivatives 'thumb' %}
+    """
+    name = ((derivatives or {}).get(size) or {}).get('jpeg')
+    return cloud_url(name or image_field)
+
+
+@register.simple_tag
+def responsive_img(image_field, derivatives=None, sizes='100vw', alt='', css_class='', default_size='card'):
+    """Emit a <picture> with WebP and JPEG srcsets when derivatives exist, else a plain <img>.
+
+    Usage: {% responsive_img product.cover_image product.cover_derivatives sizes="280px" alt=product.name %}
+    """
+    webp = _srcset(derivatives, 'webp')
+    jpeg = _srcset(derivatives, 'jpeg')
+    src = derivative_url(image_field, derivatives, default_size)
+
+    if not (webp and jpeg):
+        return format_html('<img src="{}" alt="{}" class="{}" loading="lazy">', src, alt, css_class)
+
+    return format_html(
+        '<picture>'
+        '<source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" alt="{}" class="{}" loading="lazy">'
+        '</picture>',
+        webp, sizes, src, jpeg, sizes, alt, css_class,
+    )
@@ -1,3 +1,1305 @@
-from django.test import TestCase
+import hashlib
+import importlib
+import hmac
+import json
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from unittest import mock
 
-# Create your tests here.
+from django.apps import apps as django_apps
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import OperationalError, connection
+from django.template import Context, Template
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image as PILImage
+
+from store import cart as cart_module
+from store import (
+    facets, guest_cart, idempotency, image_derivatives, media_urls, page_views, payments, recommendations,
+    reservations, rollups, search, storefront_cache, tasks, typeahead,
+)
+from store.idempotency import key_digest
+from store.models import (
+    ActivityLog, Category, Customer, DailySales, FacetCount, IdempotencyKey, Order, OrderItem, PageView,
+    PaymentConfirmation, Product, ProductFacetValue, ProductImage, ProductRecommendation, ShippingAddress,
+    StockReservation, decode_order_cursor,
+)
+from store.typeahead import PrefixIndex
+from store.views import _date_range
+
+
+class FacetConsistencyTests(TestCase):
+    def test_zero_discount_means_no_discount_everywhere(self):
+        product = Product.objects.create(name='Lamp', price=Decimal('150.00'), discount_price=Decimal('0.00'), stock_quantity=3)
+        product.refresh_from_db()
+
+        self.assertEqual(product.effective_price, product.selling_price)
+        values = facets.product_facet_values(product, [])
+        self.assertNotIn((facets.FACET_DISCOUNT, facets.ON_DISCOUNT), values)
+        self.assertFalse(facets.filter_products({facets.FACET_DISCOUNT: facets.ON_DISCOUNT}).exists())
+
+        band = facets.price_band(product.selling_price)
+        self.assertIn((facets.FACET_PRICE, band), values)
+        self.assertTrue(facets.filter_products({facets.FACET_PRICE: band}).filter(pk=product.pk).exists())
+
+
+class TypeaheadTests(TestCase):
+    def test_lookup_ranks_name_starts_first_and_dedupes(self):
+        index = PrefixIndex([(1, 'Smart Phone'), (2, 'Phone Case'), (3, 'Phone Phone'), (4, 'Headphones')])
+        self.assertEqual([hit['id'] for hit in index.lookup('pho')], [2, 3, 1])
+        self.assertEqual([hit['id'] for hit in index.lookup('p', limit=2)], [2, 3])
+        self.assertEqual(index.lookup('zzz'), [])
+
+    def test_short_prefixes_are_precomputed(self):
+        names = [(pk, f'{word} {pk}') for pk, word in enumerate(['Phone', 'Photo', 'Pad', 'Ape'] * 10, start=1)]
+        index = PrefixIndex(names)
+        for prefix in ('p', 'ph', 'a'):
+            matches = [entry for entry in index.entries if entry[0].startswith(prefix)]
+            self.assertEqual(index.lookup(prefix), PrefixIndex._top(matches, typeahead.MAX_SUGGESTIONS))
+        # Served from the table without scanning the matches
+        with mock.patch.object(PrefixIndex, '_top', side_effect=AssertionError):
+            self.assertEqual(len(index.lookup('p')), typeahead.MAX_SUGGESTIONS)
+            self.assertEqual(len(index.lookup('P', limit=3)), 3)
+
+    @override_settings(SHARED_CACHE=False)
+    def test_per_process_cache_keeps_no_index(self):
+        typeahead._state.update(version=None, index=None)
+        Product.objects.create(name='Smart Phone', price=Decimal('100.00'), stock_quantity=2)
+        Product.objects.create(name='Phone Case', price=Decimal('10.00'), stock_quantity=2)
+        Product.objects.create(name='Phone Stand', price=Decimal('10.00'), stock_quantity=0)
+
+        with self.assertNumQueries(1):
+            self.assertEqual([hit['name'] for hit in typeahead.suggest('pho')], ['Phone Case', 'Smart Phone'])
+        self.assertIsNone(typeahead._state['index'])
+        # A product added by another process shows up on the next keystroke
+        Product.objects.create(name='Phonograph', price=Decimal('80.00'), stock_quantity=1)
+        self.assertEqual([hit['name'] for hit in typeahead.suggest('phon')], ['Phone Case', 'Phonograph', 'Smart Phone'])
+
+    @override_settings(SHARED_CACHE=True)
+    def test_shared_cache_reuses_the_index_until_the_version_moves(self):
+        cache.clear()
+        typeahead._state.update(version=None, index=None)
+        self.addCleanup(typeahead._state.update, version=None, index=None)
+        Product.objects.create(name='Smart Phone', price=Decimal('100.00'), stock_quantity=2)
+        typeahead.suggest('pho')
+
+        with self.assertNumQueries(0):
+            self.assertEqual([hit['name'] for hit in typeahead.suggest('pho')], ['Smart Phone'])
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(name='Phone Case', price=Decimal('10.00'), stock_quantity=2)
+        self.assertEqual([hit['name'] for hit in typeahead.suggest('pho')], ['Phone Case', 'Smart Phone'])
+
+
+class PurgeAbandonedCartsTests(TestCase):
+    def test_cart_that_gained_an_item_is_kept(self):
+        product = Product.objects.create(name='Mug', price=Decimal('20.00'), stock_quantity=5)
+        stale, revived = Order.objects.create(), Order.objects.create()
+        Order.objects.filter(pk__in=[stale.pk, revived.pk]).update(date_ordered=timezone.now() - timedelta(days=90))
+        OrderItem.objects.create(order=stale, product=product, quantity=0)
+
+        picked = cart_module.abandoned_empty_carts
+        calls = []
+
+        def pick_then_add(days=None):
+            calls.append(days)
+            if len(calls) > 1:
+                return picked(days)
+            # The shopper adds a line right after the batch was chosen
+            chosen = list(picked(days).values_list('pk', flat=True))
+            OrderItem.objects.create(order=revived, product=product, quantity=1)
+            return Order.objects.filter(pk__in=chosen)
+
+        with mock.patch.object(cart_module, 'abandoned_empty_carts', side_effect=pick_then_add):
+            self.assertEqual(cart_module.purge_abandoned_carts(days=30), 1)
+        self.assertFalse(Order.objects.filter(pk=stale.pk).exists())
+        self.assertTrue(OrderItem.objects.filter(order=revived, quantity=1).exists())
+
+
+SHIPPING = {'address': '1 Ring Rd', 'city': 'Accra', 'state': 'GA', 'zipcode': '00233', 'country': 'Ghana'}
+
+
+class CheckoutMixin:
+    """A logged-in customer with a cart, and helpers to pay for it."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('buyer', password='pw')
+        self.client.force_login(self.user)
+        self.product = Product.objects.create(name='Kettle', price=Decimal('25.00'), stock_quantity=5)
+        self.order = Order.objects.create(customer=self.user.customer)
+        OrderItem.objects.create(order=self.order, product=self.product, quantity=2)
+
+    def paystack(self, amount=5000, status='success', reference='REF-1'):
+        """Patch verify_transaction to report a charge of ``amount`` pesewas."""
+        return mock.patch(
+            'store.payments.verify_transaction',
+            return_value={'status': status, 'amount': amount, 'reference': reference},
+        )
+
+    def checkout(self, reference='REF-1', total='50.00', **headers):
+        body = {'form': {'total': total}, 'shipping': SHIPPING}
+        if reference:
+            body['payment_reference'] = reference
+        return self.client.post(
+            reverse('store:process_order'), json.dumps(body), content_type='application/json', headers=headers,
+        )
+
+
+class ProcessOrderTests(CheckoutMixin, TestCase):
+    def test_checkout_without_payment_reference_is_rejected(self):
+        response = self.checkout(reference=None)
+
+        self.assertEqual(response.status_code, 400)
+        self.order.refresh_from_db()
+        self.product.refresh_from_db()
+        self.assertFalse(self.order.complete)
+        self.assertEqual(self.product.stock_quantity, 5)
+
+    def test_verified_payment_completes_order_once(self):
+        with self.paystack():
+            first = self.checkout()
+            retry = self.checkout()
+
+        self.assertEqual(first.status_code, 200, first.content)
+        self.assertEqual(retry.status_code, 200, retry.content)
+        self.assertEqual(retry.json()['order_id'], self.order.pk)
+        self.order.refresh_from_db()
+        self.product.refresh_from_db()
+        self.assertTrue(self.order.complete)
+        self.assertEqual(self.order.transaction_id, 'REF-1')
+        self.assertEqual(self.product.stock_quantity, 3)
+        self.assertEqual(PaymentConfirmation.objects.get().status, PaymentConfirmation.STATUS_CONFIRMED)
+        self.assertTrue(ShippingAddress.objects.filter(order=self.order).exists())
+
+    def test_underpaid_reference_is_refused_and_can_be_retried(self):
+        with self.paystack(amount=100):
+            response = self.checkout()
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['reason'], 'amount_mismatch')
+        self.assertEqual(PaymentConfirmation.objects.get().status, PaymentConfirmation.STATUS_FAILED)
+        with self.paystack():
+            self.assertEqual(self.checkout().status_code, 200)
+
+    def test_paid_but_sold_out_is_recorded_for_refund(self):
+        Product.objects.filter(pk=self.product.pk).update(stock_quantity=1)
+
+        with self.paystack():
+            response = self.checkout()
+            retry = self.checkout()
+
+        for reply in (response, retry):
+            self.assertEqual(reply.status_code, 409)
+            self.assertTrue(reply.json()['payment_taken'])
+        confirmation = PaymentConfirmation.objects.get()
+        self.assertEqual(confirmation.status, PaymentConfirmation.STATUS_NEEDS_REFUND)
+        self.assertEqual(confirmation.amount, 5000)
+        self.assertTrue(ActivityLog.objects.filter(action_type='PAYMENT_NEEDS_REFUND', object_id=self.order.pk).exists())
+        self.order.refresh_from_db()
+        self.assertFalse(self.order.complete)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock_quantity, 1)
+
+
+@override_settings(PAYSTACK_SECRET_KEY='sk_test_secret')
+class PaystackWebhookTests(CheckoutMixin, TestCase):
+    def event(self, reference='REF-1', amount=5000):
+        return json.dumps({'event': 'charge.success', 'data': {
+            'reference': reference, 'status': 'success', 'amount': amount, 'metadata': {'order_id': self.order.pk},
+        }}).encode()
+
+    def deliver(self, body, signature=None):
+        if signature is None:
+            signature = hmac.new(b'sk_test_secret', body, hashlib.sha512).hexdigest()
+        return self.client.post(
+            reverse('store:paystack_webhook'), body, content_type='application/json',
+            headers={'X-Paystack-Signature': signature},
+        )
+
+    def test_bad_signature_is_rejected(self):
+        self.assertEqual(self.deliver(self.event(), signature='0' * 128).status_code, 401)
+        self.order.refresh_from_db()
+        self.assertFalse(self.order.complete)
+        self.assertFalse(PaymentConfirmation.objects.exists())
+
+    def test_duplicate_deliveries_complete_the_order_once(self):
+        body = self.event()
+        self.assertEqual(self.deliver(body).status_code, 200)
+        self.assertEqual(self.deliver(body).status_code, 200)
+
+        self.order.refresh_from_db()
+        self.assertTrue(self.order.complete)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock_quantity, 3)
+        self.assertEqual(ActivityLog.objects.filter(action_type='SALE').count(), 1)
+        confirmation = PaymentConfirmation.objects.get()
+        self.assertEqual(confirmation.source, PaymentConfirmation.SOURCE_WEBHOOK)
+
+        # The customer's own checkout request arrives afterwards: no second finalization
+        with self.paystack() as verify:
+            response = self.checkout()
+        self.assertEqual(response.status_code, 200)
+        verify.assert_not_called()
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock_quantity, 3)
+        self.assertTrue(ShippingAddress.objects.filter(order=self.order).exists())
+
+
+class StubPaystackHandler(BaseHTTPRequestHandler):
+    """Serves the queued (status, body, delay) replies in turn; the last one repeats."""
+
+    protocol_version = 'HTTP/1.1'
+    replies = []
+    requests = []
+
+    def do_GET(self):
+        type(self).requests.append({'path': self.path, 'auth': self.headers['Authorization'], 'port': self.client_address[1]})
+        replies = type(self).replies
+        status, body, delay = replies.pop(0) if len(replies) > 1 else replies[0]
+        time.sleep(delay)
+        body = body.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+VERIFIED = json.dumps({'status': True, 'data': {'reference': 'REF-1', 'status': 'success', 'amount': 5000}})
+
+
+class VerifyTransactionTests(SimpleTestCase):
+    """verify_transaction against a local HTTP server standing in for Paystack."""
+
+    def setUp(self):
+        StubPaystackHandler.replies, StubPaystackHandler.requests = [], []
+        server = ThreadingHTTPServer(('127.0.0.1', 0), StubPaystackHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        settings_override = override_settings(
+            PAYSTACK_API_BASE=f'http://127.0.0.1:{server.server_port}', PAYSTACK_SECRET_KEY='sk_test_secret',
+            PAYSTACK_CONNECT_TIMEOUT=1, PAYSTACK_TIMEOUT=0.5, PAYSTACK_MAX_RETRIES=2,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        # A fresh pooled session, built with the settings above
+        payments._session = None
+        self.addCleanup(setattr, payments, '_session', None)
+
+    def test_retries_a_5xx_then_succeeds(self):
+        StubPaystackHandler.replies = [(502, 'Bad Gateway', 0), (200, VERIFIED, 0)]
+
+        self.assertEqual(payments.verify_transaction('REF 1')['status'], 'success')
+        calls = StubPaystackHandler.requests
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(calls[0]['path'], '/transaction/verify/REF%201')
+        self.assertEqual(calls[0]['auth'], 'Bearer sk_test_secret')
+
+    def test_session_is_pooled(self):
+        StubPaystackHandler.replies = [(200, VERIFIED, 0)]
+
+        payments.verify_transaction('REF-1')
+        payments.verify_transaction('REF-1')
+        self.assertIs(payments.get_session(), payments.get_session())
+        # Both calls went over the same kept-alive connection
+        self.assertEqual(len({call['port'] for call in StubPaystackHandler.requests}), 1)
+
+    def test_persistent_5xx_is_an_upstream_error(self):
+        StubPaystackHandler.replies = [(503, 'Service Unavailable', 0)]
+
+        with self.assertRaises(payments.PaymentError) as raised:
+            payments.verify_transaction('REF-1')
+        self.assertEqual(raised.exception.code, 'upstream_error')
+        self.assertEqual(len(StubPaystackHandler.requests), 3)  # first try + PAYSTACK_MAX_RETRIES
+
+    @override_settings(PAYSTACK_MAX_RETRIES=0)
+    def test_slow_upstream_times_out(self):
+        StubPaystackHandler.replies = [(200, VERIFIED, 2)]
+
+        started = time.monotonic()
+        with self.assertRaises(payments.PaymentError) as raised:
+            payments.verify_transaction('REF-1')
+        self.assertEqual(raised.exception.code, 'upstream_error')
+        self.assertLess(time.monotonic() - started, 1.5)
+
+
+class IdempotencyTests(CheckoutMixin, TestCase):
+    def add_to_cart(self, key, action='add'):
+        return self.client.post(
+            reverse('store:update_item'), json.dumps({'productId': self.product.pk, 'action': action}),
+            content_type='application/json', headers={'Idempotency-Key': key},
+        )
+
+    def quantity(self):
+        return OrderItem.objects.get(order=self.order, product=self.product).quantity
+
+    def test_repeat_is_replayed_without_running_the_view(self):
+        first = self.add_to_cart('click-1')
+        # A retry on another worker: nothing about the key lives in its process or cache
+        cache.clear()
+        repeat = self.add_to_cart('click-1')
+
+        self.assertEqual(first.status_code, 200, first.content)
+        self.assertEqual(repeat.status_code, first.status_code)
+        self.assertEqual(repeat.content, first.content)
+        self.assertEqual(repeat['Idempotent-Replayed'], 'true')
+        self.assertEqual(self.quantity(), 3)
+        self.assertEqual(self.add_to_cart('click-2').status_code, 200)
+        self.assertEqual(self.quantity(), 4)
+
+    def test_reused_key_with_different_body_is_refused(self):
+        self.add_to_cart('click-1')
+        response = self.add_to_cart('click-1', action='remove')
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(self.quantity(), 3)
+
+    def test_key_still_running_gets_409(self):
+        request = RequestFactory().post(reverse('store:update_item'))
+        request.user = self.user
+        IdempotencyKey.objects.create(key=key_digest(request, 'click-1'), fingerprint='x')
+        self.assertEqual(self.add_to_cart('click-1').status_code, 409)
+        self.assertEqual(self.quantity(), 2)
+
+    def test_paystack_outage_is_not_replayed(self):
+        outage = payments.PaymentError('Could not reach Paystack: timed out', code='upstream_error')
+        with mock.patch('store.payments.verify_transaction', side_effect=outage):
+            response = self.checkout(**{'Idempotency-Key': 'checkout-REF-1'})
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+        with self.paystack():
+            retry = self.checkout(**{'Idempotency-Key': 'checkout-REF-1'})
+        self.assertEqual(retry.status_code, 200, retry.content)
+        self.assertFalse(retry.has_header('Idempotent-Replayed'))
+        self.assertEqual(IdempotencyKey.objects.get().status_code, 200)
+        self.order.refresh_from_db()
+        self.assertTrue(self.order.complete)
+
+    def test_expired_keys_are_purged(self):
+        self.add_to_cart('click-1')
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(days=2))
+
+        self.assertEqual(idempotency.purge_expired(), 1)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+
+class DateRangeTests(TestCase):
+    def test_out_of_range_end_date_is_ignored(self):
+        order = Order.objects.create(complete=True)
+        orders = Order.objects.all()
+
+        self.assertEqual(list(_date_range(orders, 'date_ordered', '', '9999-12-31')), [order])
+        self.assertEqual(list(_date_range(orders, 'date_ordered', '', 'not-a-date')), [order])
+        yesterday = (timezone.now() - timedelta(days=1)).date().isoformat()
+        self.assertFalse(_date_range(orders, 'date_ordered', '', yesterday).exists())
+
+
+class DailySalesTests(CheckoutMixin, TestCase):
+    def rows(self):
+        return sorted(DailySales.objects.values_list('date', 'product_id', 'units', 'revenue', 'orders'), key=str)
+
+    def place_order(self, reference, total=Decimal('50.00')):
+        with self.paystack(amount=int(total * 100), reference=reference):
+            self.assertEqual(self.checkout(reference=reference, total=str(total)).status_code, 200)
+
+    def test_checkout_increments_match_rebuild(self):
+        other = Product.objects.create(name='Toaster', price=Decimal('40.00'), discount_price=Decimal('30.00'), stock_quantity=5)
+        OrderItem.objects.create(order=self.order, product=other, quantity=1)
+        self.place_order('REF-1', total=Decimal('80.00'))
+        second = Order.objects.create(customer=self.user.customer)
+        OrderItem.objects.create(order=second, product=self.product, quantity=1)
+        self.place_order('REF-2', total=Decimal('25.00'))
+
+        incremental = self.rows()
+        self.assertEqual(rollups.summary()['orders'], 2)
+        self.assertEqual(rollups.summary()['revenue'], Decimal('105.00'))
+        rollups.rebuild()
+        self.assertEqual(self.rows(), incremental)
+
+    def test_migration_backfill_matches_rebuild(self):
+        self.place_order('REF-1')
+        rollups.rebuild()
+        expected = self.rows()
+
+        DailySales.objects.all().delete()
+        backfill = importlib.import_module('store.migrations.0027_backfill_daily_sales')
+        backfill.populate_daily_sales(django_apps, None)
+        self.assertEqual(self.rows(), expected)
+
+    def test_editing_or_deleting_a_completed_order_refreshes_its_day(self):
+        self.place_order('REF-1')
+        today = timezone.localdate()
+        order = Order.objects.get(pk=self.order.pk)
+
+        order.date_ordered = order.date_ordered - timedelta(days=3)
+        order.save()
+        self.assertEqual(rollups.summary(today, today)['orders'], 0)
+        self.assertEqual(rollups.summary(today - timedelta(days=3), today - timedelta(days=3))['orders'], 1)
+
+        order.delete()
+        self.assertFalse(DailySales.objects.exists())
+
+
+class PageViewBufferTests(TestCase):
+    def setUp(self):
+        self.buffer = page_views.PageViewBuffer()
+        # Keep the background flusher out of the way; the tests flush explicitly
+        self.buffer._ensure_flusher = lambda: None
+
+    def test_flush_writes_one_batch(self):
+        for n in range(3):
+            self.buffer.add(PageView(path=f'/store/{n}/'))
+
+        self.assertEqual(self.buffer.flush(), 3)
+        self.assertEqual(len(self.buffer), 0)
+        self.assertEqual(PageView.objects.count(), 3)
+
+    def test_poison_row_is_dropped_and_the_rest_written(self):
+        self.buffer.add(PageView(path='/store/'))
+        self.buffer.add(PageView(path='/cart/', duration='not a number'))
+        self.buffer.add(PageView(path='/checkout/'))
+
+        self.assertEqual(self.buffer.flush(), 2)
+        self.assertEqual(self.buffer.rejected, 1)
+        self.assertEqual(len(self.buffer), 0)
+        self.assertEqual(sorted(PageView.objects.values_list('path', flat=True)), ['/checkout/', '/store/'])
+
+    def test_outage_keeps_rows_for_the_next_flush(self):
+        for n in range(2):
+            self.buffer.add(PageView(path=f'/store/{n}/'))
+        outage = OperationalError('database is locked')
+        with mock.patch.object(PageView.objects, 'bulk_create', side_effect=outage), \
+                mock.patch.object(PageView, 'save', side_effect=outage):
+            self.assertEqual(self.buffer.flush(), 0)
+
+        self.assertEqual(len(self.buffer), 2)
+        self.assertEqual(self.buffer.rejected, 0)
+        self.assertEqual(self.buffer.flush(), 2)
+        self.assertEqual(PageView.objects.count(), 2)
+
+    @override_settings(PAGEVIEW_BATCH_SIZE=0)
+    def test_beacon_with_non_string_title_is_recorded(self):
+        response = self.client.post(
+            reverse('store:record_page_view'), json.dumps({'path': ['/store/'], 'title': 12345}),
+            content_type='application/json',
+        )
+
+        self.assertEqual(response.status_code, 200, response.content)
+        view = PageView.objects.get()
+        self.assertEqual(view.title, '12345')
+        self.assertEqual(view.path, "['/store/']")
+
+
+class StockReservationTests(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(name='Console', price=Decimal('400.00'), stock_quantity=1)
+        self.first, self.second = Order.objects.create(), Order.objects.create()
+
+    def test_last_unit_goes_to_whoever_holds_it_first(self):
+        reservations.hold(self.first, {self.product.pk: 1})
+
+        with self.assertRaises(reservations.InsufficientStock) as raised:
+            reservations.hold(self.second, {self.product.pk: 1})
+        self.assertEqual(raised.exception.available, 0)
+        with self.assertRaises(reservations.InsufficientStock):
+            reservations.commit(self.second, {self.product.pk: 1})
+
+        self.assertEqual(reservations.commit(self.first, {self.product.pk: 1}), {self.product.pk: 0})
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock_quantity, 0)
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_expired_hold_stops_counting(self):
+        reservations.hold(self.first, {self.product.pk: 1})
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        reservations.hold(self.second, {self.product.pk: 1})
+        with self.assertRaises(reservations.InsufficientStock):
+            reservations.commit(self.first, {self.product.pk: 1})
+        self.assertEqual(reservations.release_expired(), 1)
+        self.assertEqual(StockReservation.objects.get().order, self.second)
+
+    def test_commit_never_oversells_when_stock_moves_under_it(self):
+        # A concurrent checkout took the unit after our read (e.g. a backend without row locks)
+        Product.objects.filter(pk=self.product.pk).update(stock_quantity=0)
+        stale_read = {self.product.pk: 1}
+
+        with mock.patch.object(reservations, '_lock_products', return_value=stale_read):
+            with self.assertRaises(reservations.InsufficientStock) as raised:
+                reservations.commit(self.first, {self.product.pk: 1})
+        self.assertEqual(raised.exception.available, 0)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock_quantity, 0)
+
+
+class OrderSnapshotTests(CheckoutMixin, TestCase):
+    def test_totals_keep_the_price_paid_after_a_price_change(self):
+        Product.objects.filter(pk=self.product.pk).update(discount_price=Decimal('20.00'))
+        with self.paystack(amount=4000):
+            self.assertEqual(self.checkout(total='40.00').status_code, 200)
+        Product.objects.filter(pk=self.product.pk).update(price=Decimal('99.00'), discount_price=None)
+
+        order = Order.objects.get(pk=self.order.pk)
+        self.assertEqual((order.total, order.item_count, order.currency), (Decimal('40.00'), 2, 'GHS'))
+        self.assertEqual(order.orderitem_set.get().unit_price, Decimal('20.00'))
+        self.assertEqual(Order.objects.with_totals().get(pk=order.pk).cart_total, Decimal('40.00'))
+        totals = Order.objects.filter(complete=True).totals()
+        self.assertEqual((totals['revenue'], totals['items'], totals['average']), (Decimal('40.00'), 2, Decimal('40.00')))
+
+    def test_open_cart_still_uses_live_prices(self):
+        Product.objects.filter(pk=self.product.pk).update(price=Decimal('30.00'))
+
+        self.assertEqual(Order.objects.with_totals().get(pk=self.order.pk).cart_total, Decimal('60.00'))
+
+
+class OrderCursorTests(TestCase):
+    def test_keyset_pages_cover_every_order_once(self):
+        moment = timezone.now()
+        orders = [Order.objects.create(complete=True) for _ in range(5)]
+        # Ties on date_ordered are broken by id
+        Order.objects.filter(pk__in=[o.pk for o in orders[:3]]).update(date_ordered=moment)
+        Order.objects.filter(pk__in=[o.pk for o in orders[3:]]).update(date_ordered=moment - timedelta(hours=1))
+
+        seen, cursor = [], None
+        while True:
+            page, cursor = Order.objects.all().newest_first_page(after=cursor, limit=2)
+            seen += [order.pk for order in page]
+            if cursor is None:
+                break
+        self.assertEqual(seen, [orders[2].pk, orders[1].pk, orders[0].pk, orders[4].pk, orders[3].pk])
+
+    def test_malformed_cursor_starts_from_the_top(self):
+        Order.objects.create(complete=True)
+
+        self.assertIsNone(decode_order_cursor('9' * 40 + '_1'))
+        page, cursor = Order.objects.newest_first_page(after='garbage', limit=5)
+        self.assertEqual(len(page), 1)
+        self.assertIsNone(cursor)
+
+
+@override_settings(SHARED_CACHE=True)
+class StorefrontCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='Kitchen')
+        self.product = Product.objects.create(name='Kettle', price=Decimal('25.00'), stock_quantity=5)
+        self.product.categories.add(self.category)
+        storefront_cache.get_storefront_sections()
+        self.keys = [
+            storefront_cache.card_key(self.product.pk),
+            storefront_cache.section_key(self.category.pk),
+            storefront_cache.INDEX_KEY,
+        ]
+
+    def assertDroppedOnCommit(self, change, keys=None):
+        keys = self.keys if keys is None else keys
+        with self.captureOnCommitCallbacks() as callbacks:
+            change()
+        # Nothing is dropped before the commit, or a concurrent request could re-cache the old rows
+        self.assertEqual(len(cache.get_many(self.keys)), 3)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(cache.get_many(keys), {})
+
+    def test_sections_and_cards_are_cached(self):
+        self.assertEqual(len(cache.get_many(self.keys)), 3)
+        with self.assertNumQueries(0):
+            sections = storefront_cache.get_storefront_sections()
+        self.assertIn('Kettle', sections[0])
+
+    def test_product_save_invalidates_after_commit(self):
+        self.product.name = 'Electric Kettle'
+        self.assertDroppedOnCommit(self.product.save)
+        self.assertIn('Electric Kettle', storefront_cache.get_storefront_sections()[0])
+
+    def test_category_save_invalidates_after_commit(self):
+        self.category.name = 'Cookware'
+        # Cards don't show the category, so only the section and the index go
+        self.assertDroppedOnCommit(self.category.save, keys=self.keys[1:])
+        self.assertIn('Cookware', storefront_cache.get_storefront_sections()[0])
+
+    def test_image_change_invalidates_after_commit(self):
+        with mock.patch('store.signals._enqueue_image_derivatives'):
+            self.assertDroppedOnCommit(
+                lambda: ProductImage.objects.create(product=self.product, image='product_photos/kettle.jpg')
+            )
+
+    @override_settings(SHARED_CACHE=False)
+    def test_per_process_cache_is_not_used(self):
+        cache.clear()
+        storefront_cache.get_storefront_sections()
+        self.assertEqual(cache.get_many(self.keys), {})
+
+    @override_settings(USE_S3=True, AWS_QUERYSTRING_AUTH=True, AWS_QUERYSTRING_EXPIRE=3600, STOREFRONT_CACHE_TIMEOUT=6 * 60 * 60)
+    def test_timeout_stays_below_signed_url_lifetime(self):
+        self.assertEqual(storefront_cache._timeout(), 1800)
+
+
+class FacetCountTests(TestCase):
+    def counts(self):
+        return dict(((facet, value), count) for facet, value, count in FacetCount.objects.values_list('facet', 'value', 'count'))
+
+    def test_stale_read_does_not_drift_the_counters(self):
+        product = Product.objects.create(name='Lamp', price=Decimal('150.00'), stock_quantity=3)
+        expected = self.counts()
+        rows = facets._current_values(product.pk)
+
+        # Another save already wrote these rows after we read the product's state
+        with mock.patch.object(facets, '_current_values', return_value=set()):
+            facets.sync_product(product.pk)
+        self.assertEqual(self.counts(), expected)
+
+        # ...or already deleted them
+        ProductFacetValue.objects.filter(product=product).delete()
+        with mock.patch.object(facets, '_current_values', return_value=rows):
+            facets.sync_product(product.pk, wanted=set())
+        self.assertEqual(self.counts(), expected)
+
+    def test_incremental_counts_match_rebuild(self):
+        lamp = Product.objects.create(name='Lamp', price=Decimal('150.00'), stock_quantity=3)
+        Product.objects.create(name='Rug', price=Decimal('600.00'), discount_price=Decimal('450.00'), stock_quantity=1)
+        lamp.stock_quantity = 0
+        lamp.save()
+        lamp.stock_quantity = 2
+        lamp.price = Decimal('90.00')
+        lamp.save()
+
+        incremental = {key: count for key, count in self.counts().items() if count}
+        facets.rebuild()
+        self.assertEqual(incremental, self.counts())
+
+
+class UpdateItemTests(CheckoutMixin, TestCase):
+    def update(self, product, action='add'):
+        return self.client.post(
+            reverse('store:update_item'), json.dumps({'productId': product.pk, 'action': action}),
+            content_type='application/json',
+        )
+
+    def test_sold_out_add_leaves_no_line_and_no_hold(self):
+        console = Product.objects.create(name='Console', price=Decimal('400.00'), stock_quantity=1)
+        reservations.hold(Order.objects.create(), {console.pk: 1})
+
+        response = self.update(console)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'insufficient_stock')
+        self.assertFalse(OrderItem.objects.filter(order=self.order, product=console).exists())
+        self.assertFalse(StockReservation.objects.filter(order=self.order, product=console).exists())
+
+    def test_failed_line_save_rolls_back_the_hold(self):
+        with mock.patch.object(OrderItem, 'save', side_effect=OperationalError('database is locked')):
+            with self.assertRaises(OperationalError):
+                self.update(self.product)
+
+        self.assertFalse(StockReservation.objects.filter(order=self.order).exists())
+        self.assertEqual(OrderItem.objects.get(order=self.order).quantity, 2)
+
+    def test_add_and_remove_keep_the_hold_in_step(self):
+        self.update(self.product)
+        self.assertEqual(StockReservation.objects.get(order=self.order).quantity, 3)
+        self.update(self.product, action='delete')
+        self.assertFalse(OrderItem.objects.filter(order=self.order).exists())
+        self.assertFalse(StockReservation.objects.filter(order=self.order).exists())
+
+
+class GuestCartTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('shopper', password='correct-horse-9')
+        self.kettle = Product.objects.create(name='Kettle', price=Decimal('25.00'), stock_quantity=5)
+        self.mug = Product.objects.create(name='Mug', price=Decimal('10.00'), stock_quantity=3)
+
+    def add(self, product, action='add'):
+        return self.client.post(
+            reverse('store:update_item'), json.dumps({'productId': product.pk, 'action': action}),
+            content_type='application/json',
+        )
+
+    def log_in(self):
+        return self.client.post(reverse('account_login'), {'username': 'shopper', 'password': 'correct-horse-9'})
+
+    def lines(self):
+        return dict(OrderItem.objects.filter(order__customer=self.user.customer, order__complete=False)
+                    .values_list('product_id', 'quantity'))
+
+    def test_guest_cart_lives_in_a_signed_cookie(self):
+        self.add(self.kettle)
+        self.add(self.kettle)
+        response = self.add(self.mug)
+
+        self.assertEqual(response.json()['cartItems'], 3)
+        self.assertFalse(Order.objects.exists())
+        request = RequestFactory().get('/')
+        request.COOKIES[guest_cart.COOKIE_NAME] = self.client.cookies[guest_cart.COOKIE_NAME].value
+        self.assertEqual(guest_cart.read(request), {self.kettle.pk: 2, self.mug.pk: 1})
+
+    def test_tampered_cookie_is_an_empty_cart(self):
+        self.add(self.kettle)
+        signed = self.client.cookies[guest_cart.COOKIE_NAME].value
+        tampered = signed.replace(f'"{self.kettle.pk}":1', f'"{self.kettle.pk}":99')
+        self.assertNotEqual(tampered, signed)
+        self.client.cookies[guest_cart.COOKIE_NAME] = tampered
+
+        response = self.add(self.mug)
+        self.assertEqual(response.json()['cartItems'], 1)
+        self.log_in()
+        self.assertEqual(self.lines(), {self.mug.pk: 1})
+
+    def test_add_beyond_stock_is_refused(self):
+        for _ in range(3):
+            self.add(self.mug)
+        response = self.add(self.mug)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'insufficient_stock')
+
+    def test_login_merges_once_capped_at_stock_and_drops_the_cookie(self):
+        order = Order.objects.create(customer=self.user.customer)
+        OrderItem.objects.create(order=order, product=self.kettle, quantity=3)
+        for _ in range(3):
+            self.add(self.kettle)
+        self.add(self.mug)
+
+        response = self.log_in()
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.cookies[guest_cart.COOKIE_NAME].value, '')
+        # 3 already in the cart + 3 from the cookie, but only 5 in stock
+        self.assertEqual(self.lines(), {self.kettle.pk: 5, self.mug.pk: 1})
+
+        self.client.logout()
+        self.log_in()
+        self.assertEqual(self.lines(), {self.kettle.pk: 5, self.mug.pk: 1})
+        self.assertEqual(Order.objects.filter(customer=self.user.customer, complete=False).count(), 1)
+
+
+class UpdateCartTests(CheckoutMixin, TestCase):
+    def batch(self, *operations, body=None):
+        return self.client.post(
+            reverse('store:update_cart'), json.dumps(body if body is not None else {'operations': list(operations)}),
+            content_type='application/json',
+        )
+
+    def lines(self):
+        return dict(OrderItem.objects.filter(order=self.order).values_list('product_id', 'quantity'))
+
+    def test_batch_applies_in_order_and_returns_the_summary(self):
+        mug = Product.objects.create(name='Mug', price=Decimal('10.00'), stock_quantity=4, digital=False)
+
+        response = self.batch(
+            {'productId': mug.pk, 'action': 'add', 'quantity': 3},
+            {'productId': self.product.pk, 'action': 'set', 'quantity': 1},
+            {'productId': mug.pk, 'action': 'remove'},
+        )
+
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json()['cart'], {'count': 3, 'total': '45.00', 'shipping': True})
+        self.assertEqual(response.json()['cartItems'], 3)
+        self.assertEqual(self.lines(), {self.product.pk: 1, mug.pk: 2})
+        self.assertEqual(dict(StockReservation.objects.values_list('product_id', 'quantity')), {self.product.pk: 1, mug.pk: 2})
+
+    def test_one_operation_over_stock_rolls_back_the_whole_batch(self):
+        response = self.batch(
+            {'productId': self.product.pk, 'action': 'delete'},
+            {'action': 'clear'},
+            {'productId': self.product.pk, 'action': 'set', 'quantity': 6},
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'insufficient_stock')
+        self.assertEqual(response.json()['operation'], 2)
+        self.assertEqual(self.lines(), {self.product.pk: 2})
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_invalid_operations_point_at_the_failing_index(self):
+        cases = [
+            ([{'productId': self.product.pk, 'action': 'add'}, {'productId': self.product.pk, 'action': 'explode'}], 1, 400),
+            ([{'productId': 'twelve', 'action': 'add'}], 0, 400),
+            ([{'action': 'clear'}, {'productId': self.product.pk, 'action': 'add', 'quantity': 0}], 1, 400),
+            ([{'productId': self.product.pk, 'action': 'add'}, {'productId': 999999, 'action': 'add'}], 1, 404),
+        ]
+        for operations, index, status in cases:
+            with self.subTest(operations=operations):
+                response = self.batch(*operations)
+                self.assertEqual(response.status_code, status)
+                self.assertEqual(response.json()['operation'], index)
+        self.assertEqual(self.batch(body={'operations': []}).status_code, 400)
+        self.assertEqual(self.lines(), {self.product.pk: 2})
+
+    def test_guest_batch_updates_the_cookie_only(self):
+        self.client.logout()
+        mug = Product.objects.create(name='Mug', price=Decimal('10.00'), stock_quantity=4)
+
+        response = self.batch(
+            {'productId': mug.pk, 'action': 'add', 'quantity': 2},
+            {'productId': self.product.pk, 'action': 'add'},
+        )
+
+        self.assertEqual(response.status_code, 200, response.content)
+        # Guests get the count from the cookie; pricing it would need a product lookup
+        self.assertEqual(response.json()['cart'], {'count': 3, 'total': None, 'shipping': None})
+        request = RequestFactory().get('/')
+        request.COOKIES[guest_cart.COOKIE_NAME] = response.cookies[guest_cart.COOKIE_NAME].value
+        self.assertEqual(guest_cart.read(request), {mug.pk: 2, self.product.pk: 1})
+        self.assertEqual(OrderItem.objects.count(), 1)
+        self.assertFalse(StockReservation.objects.exists())
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.kitchen = Category.objects.create(name='Kitchen')
+        self.kettle = Product.objects.create(name='Electric Kettle', price=Decimal('25.00'), stock_quantity=5)
+        self.toaster = Product.objects.create(name='Toaster', price=Decimal('40.00'), stock_quantity=5)
+        self.toaster.categories.add(self.kitchen)
+        self.backend = search.SQLiteFTSBackend()
+
+    def names(self, query, backend=None, sort=''):
+        results = (backend or self.backend).search(query, sort)
+        return [product.name for product in results[:results.count()]]
+
+    def test_sqlite_uses_fts5(self):
+        self.assertIsInstance(search.get_backend(), search.SQLiteFTSBackend)
+
+    def test_prefix_terms_match_name_and_categories(self):
+        self.assertEqual(self.names('kett'), ['Electric Kettle'])
+        self.assertEqual(self.names('elec ket'), ['Electric Kettle'])
+        self.assertEqual(self.names('kitch'), ['Toaster'])
+        self.assertEqual(self.names('kettle toaster'), [])
+
+    def test_quotes_and_query_syntax_are_plain_text(self):
+        for query in ['"kettle', 'kettle" OR "toaster', 'NEAR(kettle toaster)', '*', 'kettle AND -', "o'brien"]:
+            with self.subTest(query=query):
+                self.names(query)
+        self.assertEqual(self.names('"kettle"'), ['Electric Kettle'])
+        self.assertEqual(self.names('*'), [])
+
+    def test_name_matches_rank_ahead_of_category_matches(self):
+        Product.objects.create(name='Kitchen Scale', price=Decimal('15.00'), stock_quantity=2)
+
+        self.assertEqual(self.names('kitchen'), ['Kitchen Scale', 'Toaster'])
+        self.assertEqual(self.names('kitchen', sort='price_desc'), ['Toaster', 'Kitchen Scale'])
+
+    def test_signals_keep_the_index_current(self):
+        self.kettle.name = 'Steel Kettle'
+        self.kettle.save()
+        self.assertEqual(self.names('steel'), ['Steel Kettle'])
+        self.assertEqual(self.names('electric'), [])
+
+        self.kitchen.name = 'Cookware'
+        self.kitchen.save()
+        self.assertEqual(self.names('cookw'), ['Toaster'])
+        self.toaster.categories.clear()
+        self.assertEqual(self.names('cookw'), [])
+
+        Product.objects.filter(pk=self.kettle.pk).update(stock_quantity=0)
+        self.assertEqual(self.names('kettle'), [])
+        self.toaster.delete()
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT rowid FROM store_product_fts ORDER BY rowid')
+            self.assertEqual([row[0] for row in cursor.fetchall()], [self.kettle.pk])
+
+    def test_rebuild_drops_orphaned_entries(self):
+        # A delete whose signal never ran (e.g. a raw SQL delete)
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO store_product_fts (rowid, name, categories) VALUES (999999, 'Ghost Kettle', '')")
+
+        self.assertEqual(self.backend.rebuild(), 2)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT rowid FROM store_product_fts ORDER BY rowid')
+            self.assertEqual([row[0] for row in cursor.fetchall()], [self.kettle.pk, self.toaster.pk])
+
+    def test_basic_backend_fallback(self):
+        basic = search.BasicSearchBackend()
+
+        self.assertEqual(self.names('kett', backend=basic), ['Electric Kettle'])
+        self.assertEqual(self.names('t', backend=basic, sort='price_asc'), ['Electric Kettle', 'Toaster'])
+        self.assertEqual(basic.search('').count(), 0)
+
+
+class FinalizeOrderQueryTests(TestCase):
+    def cart(self, lines):
+        user = User.objects.create_user(f'buyer{lines}')
+        order = Order.objects.create(customer=user.customer)
+        for n in range(lines):
+            product = Product.objects.create(name=f'Item {lines}-{n}', price=Decimal('10.00'), stock_quantity=50)
+            OrderItem.objects.create(order=order, product=product, quantity=2)
+        reservations.hold(order, {item.product_id: item.quantity for item in order.orderitem_set.all()})
+        items = list(OrderItem.objects.filter(order=order).select_related('product'))
+        return order, items, user
+
+    def test_query_count_does_not_grow_with_the_cart(self):
+        single, single_items, single_user = self.cart(1)
+        large, large_items, large_user = self.cart(12)
+
+        with CaptureQueriesContext(connection) as one_line:
+            payments.finalize_order(single, 'REF-1', user=single_user, items=single_items)
+        with self.assertNumQueries(len(one_line.captured_queries)):
+            payments.finalize_order(large, 'REF-12', user=large_user, items=large_items)
+
+        self.assertEqual(Product.objects.filter(stock_quantity=48).count(), 13)
+        self.assertFalse(StockReservation.objects.exists())
+
+
+class RequestCartQueryTests(CheckoutMixin, TestCase):
+    def select_count(self, queries, table):
+        return sum(1 for query in queries if query['sql'].startswith('SELECT') and f'FROM "{table}"' in query['sql'])
+
+    def test_cart_page_resolves_customer_and_order_once(self):
+        with CaptureQueriesContext(connection) as one_line:
+            self.assertEqual(self.client.get(reverse('store:cart')).status_code, 200)
+        for n in range(4):
+            product = Product.objects.create(name=f'Extra {n}', price=Decimal('5.00'), stock_quantity=5)
+            OrderItem.objects.create(order=self.order, product=product, quantity=1)
+
+        # View, cart_count context processor and the template all share request.cart
+        with self.assertNumQueries(len(one_line.captured_queries)) as five_lines:
+            response = self.client.get(reverse('store:cart'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.select_count(five_lines.captured_queries, 'store_customer'), 1)
+        self.assertEqual(self.select_count(five_lines.captured_queries, 'store_order'), 1)
+        self.assertEqual(self.select_count(five_lines.captured_queries, 'store_orderitem'), 1)
+
+
+class CartSummaryCacheTests(CheckoutMixin, TestCase):
+    def cart_for(self):
+        request = RequestFactory().get('/')
+        request.user = self.user
+        return cart_module.RequestCart(request)
+
+    def test_cached_badge_costs_no_queries(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.cart_for().summary['count'], 2)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.cart_for().summary, {'count': 2, 'total': '50.00', 'shipping': True})
+
+    def test_summary_is_republished_once_the_change_commits(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.cart_for().summary
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.client.post(
+                reverse('store:update_item'), json.dumps({'productId': self.product.pk, 'action': 'add'}),
+                content_type='application/json',
+            )
+        # Until the transaction commits the navbar keeps the old, committed summary
+        self.assertEqual(cache.get(cart_module.summary_key(self.user.pk))['count'], 2)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(cache.get(cart_module.summary_key(self.user.pk)), {'count': 3, 'total': '75.00', 'shipping': True})
+
+
+class PortalOrdersListTests(TestCase):
+    def setUp(self):
+        staff = User.objects.create_user('clerk', password='pw', is_staff=True)
+        self.client.force_login(staff)
+        self.kettle = Product.objects.create(name='Kettle', price=Decimal('25.00'), stock_quantity=50)
+        self.mug = Product.objects.create(name='Mug', price=Decimal('4.00'), stock_quantity=50)
+
+    def place(self, status, lines, snapshot=False):
+        customer = Customer.objects.create(name=f'Customer {Order.objects.count()}')
+        order = Order.objects.create(customer=customer, complete=True, status=status)
+        for product, quantity in lines:
+            OrderItem.objects.create(order=order, product=product, quantity=quantity, unit_price=product.price)
+        if snapshot:
+            order.total = sum(product.price * quantity for product, quantity in lines)
+            order.item_count = sum(quantity for _, quantity in lines)
+            order.save(update_fields=['total', 'item_count'])
+        return order
+
+    def test_stats_are_correct_and_queries_do_not_grow_with_orders(self):
+        self.place(Order.STATUS_PENDING, [(self.kettle, 1), (self.mug, 2)])  # 33.00, 3 items
+        self.place(Order.STATUS_SHIPPED, [(self.kettle, 2), (self.mug, 1)], snapshot=True)  # 54.00, 3 items
+        with CaptureQueriesContext(connection) as two_orders:
+            self.client.get(reverse('portal:orders_list'))
+
+        self.place(Order.STATUS_SHIPPED, [(self.mug, 5), (self.kettle, 1), (self.mug, 1)])  # 49.00, 7 items
+        self.place(Order.STATUS_COMPLETED, [(self.kettle, 4), (self.mug, 3)], snapshot=True)  # 112.00, 7 items
+        # An open cart is not an order and stays out of the figures
+        Order.objects.create(complete=False).orderitem_set.create(product=self.kettle, quantity=9)
+
+        with self.assertNumQueries(len(two_orders.captured_queries)):
+            response = self.client.get(reverse('portal:orders_list'))
+
+        context = response.context
+        self.assertEqual(context['total_orders'], 4)
+        self.assertEqual(context['pending_orders'], 1)
+        self.assertEqual(context['shipped_orders'], 2)
+        self.assertEqual(context['completed_orders'], 1)
+        self.assertEqual(context['processing_orders'], 0)
+        self.assertEqual(context['total_products'], 20)
+        self.assertEqual(context['total_revenue'], Decimal('248.00'))
+        self.assertEqual(context['avg_order_value'], Decimal('62.00'))
+        rows = {order.customer.name: (order.get_cart_items, order.get_cart_total) for order in context['orders']}
+        self.assertEqual(rows, {
+            'Customer 0': (3, Decimal('33.00')),
+            'Customer 1': (3, Decimal('54.00')),
+            'Customer 2': (7, Decimal('49.00')),
+            'Customer 3': (7, Decimal('112.00')),
+        })
+
+    def test_totals_match_summary(self):
+        self.place(Order.STATUS_PENDING, [(self.kettle, 1), (self.mug, 2)])
+        self.place(Order.STATUS_COMPLETED, [(self.kettle, 2)], snapshot=True)
+
+        with self.assertNumQueries(1):
+            totals = Order.objects.filter(complete=True).totals()
+        self.assertEqual(totals, {'revenue': Decimal('83.00'), 'items': 5, 'average': Decimal('41.50')})
+
+
+@override_settings(STOREFRONT_SECTION_SIZE=2)
+class SectionProductsTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Kitchen')
+        self.products = []
+        for position in range(5):
+            product = Product.objects.create(
+                name=f'Pan {position}', price=Decimal('10.00'), stock_quantity=3, display_order=position,
+            )
+            product.categories.add(self.category)
+            self.products.append(product)
+
+    def page(self, after=None):
+        params = {'after': after} if after is not None else {}
+        return self.client.get(reverse('store:section_products', args=[self.category.pk]), params)
+
+    def test_pages_follow_next_until_null(self):
+        seen, after = [], None
+        for _ in range(len(self.products)):
+            payload = self.page(after).json()
+            seen.append(payload['count'])
+            after = payload['next']
+            if after is None:
+                break
+        self.assertEqual(seen, [2, 2, 1])
+        self.assertIsNone(after)
+
+    def test_malformed_cursor_is_a_client_error(self):
+        for after in ('garbage', '1_x', 'nan_1', 'inf_1', '_', '1e999_1', '9' * 40 + '_1', '1_' + '9' * 40):
+            with self.subTest(after=after):
+                self.assertEqual(self.page(after).status_code, 400)
+        self.assertIsNone(storefront_cache.decode_cursor('garbage'))
+
+    def test_unknown_section_is_not_found(self):
+        response = self.client.get(reverse('store:section_products', args=['nope']))
+        self.assertEqual(response.status_code, 404)
+
+
+class ProductImageSummaryTests(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(name='Kettle', price=Decimal('25.00'), stock_quantity=5)
+
+    def add(self, name, position=0):
+        return ProductImage.objects.create(product=self.product, image=f'product_photos/{name}', position=position)
+
+    def assertSummary(self, cover, count):
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.cover_image.name or None, self.product.image_count), (cover, count))
+
+    def test_add_reorder_and_remove_keep_the_cover_in_step(self):
+        front = self.add('front.jpg')
+        self.assertSummary('product_photos/front.jpg', 1)
+        side = self.add('side.jpg', position=1)
+        self.assertSummary('product_photos/front.jpg', 2)
+
+        side.position = -1
+        side.save()
+        self.assertSummary('product_photos/side.jpg', 2)
+
+        side.delete()
+        self.assertSummary('product_photos/front.jpg', 1)
+        front.delete()
+        self.assertSummary(None, 0)
+
+    def test_cover_derivatives_follow_the_cover(self):
+        front = self.add('front.jpg')
+        front.derivatives = {'card': {'width': 480, 'webp': 'product_photos/derivatives/front_480.webp'}}
+        front.save()
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.cover_derivatives, front.derivatives)
+        front.delete()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.cover_derivatives, {})
+
+
+class ImageDerivativeTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root, MEDIA_URL='/media/')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        cache.clear()
+        media_urls._local.clear()
+        self.product = Product.objects.create(name='Kettle', price=Decimal('25.00'), stock_quantity=5)
+
+    def upload(self, size=(800, 400)):
+        # Half-transparent PNG, so the JPEG derivatives have to be flattened
+        buffer = BytesIO()
+        PILImage.new('RGBA', size, (200, 30, 30, 128)).save(buffer, 'PNG')
+        with mock.patch('store.signals._enqueue_image_derivatives') as enqueue:
+            with self.captureOnCommitCallbacks(execute=True):
+                image = ProductImage.objects.create(product=self.product, image=ContentFile(buffer.getvalue(), 'kettle.png'))
+        enqueue.assert_called_once_with(image.pk)
+        tasks.generate_image_derivatives(image.pk)
+        image.refresh_from_db()
+        return image
+
+    def test_builds_every_size_and_format_without_upscaling(self):
+        image = self.upload()
+
+        self.assertEqual({size: entry['width'] for size, entry in image.derivatives.items()}, {'thumb': 160, 'card': 480, 'detail': 800})
+        for entry in image.derivatives.values():
+            for fmt, pil_format in (('webp', 'WEBP'), ('jpeg', 'JPEG')):
+                with default_storage.open(entry[fmt]) as stored, PILImage.open(stored) as derivative:
+                    self.assertEqual((derivative.format, derivative.width), (pil_format, entry['width']))
+        self.assertEqual(image.derivatives_source, image.image.name)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.cover_derivatives, image.derivatives)
+
+        # Already built for this upload: a second run changes nothing
+        with mock.patch.object(image_derivatives, 'generate_derivatives') as generate:
+            tasks.generate_image_derivatives(image.pk)
+        generate.assert_not_called()
+
+    def test_responsive_img_emits_srcsets(self):
+        image = self.upload()
+        self.product.refresh_from_db()
+        html = Template(
+            '{% load cloudinary_helpers %}'
+            '{% responsive_img product.cover_image product.cover_derivatives sizes="280px" alt="Kettle" %}'
+        ).render(Context({'product': self.product}))
+
+        def srcset(fmt):
+            return ', '.join(
+                f"/media/{image.derivatives[size][fmt]} {image.derivatives[size]['width']}w"
+                for size in ('thumb', 'card', 'detail')
+            )
+
+        self.assertInHTML(
+            f'<picture><source type="image/webp" srcset="{srcset("webp")}" sizes="280px">'
+            f'<img src="/media/{image.derivatives["card"]["jpeg"]}" srcset="{srcset("jpeg")}" sizes="280px" '
+            f'alt="Kettle" class="" loading="lazy"></picture>',
+            html,
+        )
+
+    def test_responsive_img_without_derivatives_is_a_plain_img(self):
+        html = Template('{% load cloudinary_helpers %}{% responsive_img name %}').render(Context({'name': 'product_photos/a.jpg'}))
+        self.assertInHTML('<img src="/media/product_photos/a.jpg" alt="" class="" loading="lazy">', html)
+
+    def test_delete_removes_the_derivative_files(self):
+        image = self.upload()
+        names = [entry[fmt] for entry in image.derivatives.values() for fmt in image_derivatives.FORMATS]
+        self.assertTrue(all(default_storage.exists(name) for name in names))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            image.delete()
+
+        self.assertFalse(any(default_storage.exists(name) for name in names))
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.cover_derivatives, self.product.image_count), ({}, 0))
+
+
+class MediaUrlCacheTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        media_urls._local.clear()
+
+    def test_lru_evicts_the_least_recently_used(self):
+        lru = media_urls._LRUCache(2)
+        lru.set('a', 1, 60)
+        lru.set('b', 2, 60)
+        lru.get('a')
+        lru.set('c', 3, 60)
+
+        self.assertEqual((lru.get('a'), lru.get('b'), lru.get('c')), (1, None, 3))
+
+    def test_lru_entries_expire(self):
+        lru = media_urls._LRUCache(2)
+        with mock.patch('store.media_urls.time.monotonic', return_value=1000.0) as clock:
+            lru.set('a', 1, 60)
+            clock.return_value = 1059.0
+            self.assertEqual(lru.get('a'), 1)
+            clock.return_value = 1061.0
+            self.assertIsNone(lru.get('a'))
+
+    @override_settings(MEDIA_URL_CACHE_TIMEOUT=3600, AWS_QUERYSTRING_EXPIRE=600)
+    def test_timeout_is_capped_for_signed_s3_urls(self):
+        with self.settings(USE_S3=False):
+            self.assertEqual(media_urls._timeout(), 3600)
+        with self.settings(USE_S3=True, AWS_QUERYSTRING_AUTH=False):
+            self.assertEqual(media_urls._timeout(), 3600)
+        with self.settings(USE_S3=True, AWS_QUERYSTRING_AUTH=True):
+            self.assertEqual(media_urls._timeout(), 300)
+            self.assertEqual(media_urls.cap_for_signed_urls(60), 60)
+
+    @override_settings(USE_S3=True, AWS_QUERYSTRING_AUTH=True, AWS_QUERYSTRING_EXPIRE=600, MEDIA_URL_CACHE_TIMEOUT=3600)
+    def test_resolved_url_is_memoized_for_the_capped_timeout(self):
+        field = mock.Mock(storage=default_storage, url='https://bucket.example/a.jpg?signature=1')
+
+        with mock.patch('store.media_urls.time.monotonic', return_value=1000.0) as clock:
+            with mock.patch.object(media_urls.cache, 'set', wraps=media_urls.cache.set) as shared_set:
+                self.assertEqual(media_urls.resolve(field, 'a.jpg'), field.url)
+            shared_set.assert_called_once_with(mock.ANY, field.url, 300)
+
+            field.url = 'https://bucket.example/a.jpg?signature=2'
+            clock.return_value = 1299.0
+            self.assertEqual(media_urls.resolve(field, 'a.jpg'), 'https://bucket.example/a.jpg?signature=1')
+            # Past the capped lifetime the local tier lets go (the shared tier expires alongside)
+            clock.return_value = 1301.0
+            cache.clear()
+            self.assertEqual(media_urls.resolve(field, 'a.jpg'), 'https://bucket.example/a.jpg?signature=2')
+
+
+class RecommendationTests(TestCase):
+    def setUp(self):
+        self.kettle, self.mug, self.tea, self.toaster = (
+            Product.objects.create(name=name, price=Decimal('10.00'), stock_quantity=5)
+            for name in ('Kettle', 'Mug', 'Tea', 'Toaster')
+        )
+        self.spoon = Product.objects.create(name='Spoon', price=Decimal('2.00'), stock_quantity=0)
+
+    def order(self, *products, complete=True):
+        order = Order.objects.create(complete=complete)
+        for product in products:
+            OrderItem.objects.create(order=order, product=product, quantity=1)
+
+    def test_co_purchased_products_are_recommended(self):
+        self.order(self.kettle, self.mug, self.tea)
+        self.order(self.kettle, self.mug)
+        self.order(self.kettle, self.tea)
+        self.order(self.kettle, self.spoon)
+        # Open carts are not purchases, however often they pair two products
+        for _ in range(3):
+            self.order(self.kettle, self.toaster, complete=False)
+
+        self.assertEqual(recommendations.build(), 8)
+
+        with self.assertNumQueries(1):
+            # Equal support and score: the older product first; out-of-stock partners are skipped
+            self.assertEqual(recommendations.for_product(self.kettle.pk), [self.mug, self.tea])
+        self.assertEqual(recommendations.for_product(self.mug.pk), [self.kettle, self.tea])
+        self.assertEqual(recommendations.for_product(self.toaster.pk), [])
+        self.assertEqual(recommendations.for_cart([self.kettle.pk, self.mug.pk]), [self.tea])
+        self.assertEqual(ProductRecommendation.objects.get(product=self.kettle, related=self.mug).support, 2)
+        self.assertFalse(ProductRecommendation.objects.filter(related=self.toaster).exists())
+
+    def test_rebuild_replaces_the_previous_table(self):
+        self.order(self.kettle, self.mug)
+        recommendations.build()
+        Order.objects.update(complete=False)
+
+        self.assertEqual(recommendations.build(), 0)
+        self.assertEqual(recommendations.for_product(self.kettle.pk), [])
@@ -0,0 +1,161 @@
+# store/typeahead.py
+"""In-process prefix index behind the search box autocomplete (`store:product_suggest`).
+
+Each worker keeps a sorted array of ``(key, position, product_id, name, rank)``
+entries for the in-stock catalog, one entry per word of the product name, and
+answers a prefix with two bisects - no database work per keystroke. The array
+is rebuilt lazily: product saves and deletes bump a catalog version counter in
+the shared cache (`bump_catalog_version`, called from store.signals, and from
+reservations.commit when checkout sells a product out), and the next lookup in
+each worker notices the new version and reloads the names with a single query.
+
+The version counter only reaches other processes through a shared cache
+(SHARED_CACHE). On a per-process cache no index is kept: each lookup ranks a
+bounded set of candidate names fetched from the database instead.
+
+Prefixes of up to SHORT_PREFIX characters match a large part of the catalog,
+so their top MAX_SUGGESTIONS are computed once when the index is built.
+"""
+import bisect
+import heapq
+import itertools
+import logging
+import re
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, IntegerField, Value, When
+
+from .models import Product
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = 'catalog:version'
+MAX_SUGGESTIONS = 8
+# Prefixes this short get their suggestions precomputed at build time
+SHORT_PREFIX = 2
+# Candidate names ranked per lookup when there is no shared cache (and so no index)
+CANDIDATE_LIMIT = 200
+
+
+def normalize(text):
+    return ' '.join(re.findall(r'\w+', (text or '').lower()))
+
+
+def catalog_version():
+    try:
+        version = cache.get(VERSION_KEY)
+        if version is None:
+            cache.add(VERSION_KEY, 1, None)
+            version = cache.get(VERSION_KEY, 1)
+        return version
+    except Exception:
+        # Without the shared cache there is nothing to compare against; keep serving
+        logger.warning("Catalog version unavailable; typeahead index may be stale", exc_info=True)
+        return None
+
+
+def bump_catalog_version():
+    """Invalidate every worker's typeahead index once the current transaction commits."""
+    def _bump():
+        try:
+            cache.incr(VERSION_KEY)
+        except ValueError:
+            # Key missing (expired or cache flushed): any new value forces a rebuild
+            cache.set(VERSION_KEY, 1, None)
+        except Exception:
+            logger.exception("Failed to bump the catalog version")
+
+    transaction.on_commit(_bump)
+
+
+class PrefixIndex:
+    """Sorted array of word-start keys over product names."""
+
+    def __init__(self, products=()):
+        entries = []
+        for product_id, name in products:
+            words = normalize(name).split()
+            # One key per word start so "phone" also finds "Smart Phone X"
+            # Names that start with the prefix rank ahead of mid-name word matches, then alphabetically
+            rank = name.lower()
+            for position in range(len(words)):
+                entries.append((' '.join(words[position:]), position, product_id, name, (position > 0, rank)))
+        entries.sort()
+        self.keys = [entry[0] for entry in entries]
+        self.entries = entries
+
+        # Top suggestions for every 1..SHORT_PREFIX character prefix; keys sharing a
+        # prefix are contiguous in the sorted array, so this is one pass per length
+        self.short = {}
+        for length in range(1, SHORT_PREFIX + 1):
+            for prefix, group in itertools.groupby(entries, key=lambda entry: entry[0][:length]):
+                if len(prefix) == length:
+                    self.short[prefix] = self._top(group, MAX_SUGGESTIONS)
+
+    @staticmethod
+    def _top(entries, limit):
+        # Keep each product's best entry and take the top few with a bounded heap
+        best = {}
+        for _, _, product_id, name, rank in entries:
+            current = best.get(product_id)
+            if current is None or rank < current[0]:
+                best[product_id] = (rank, name)
+        top = heapq.nsmallest(limit, best.items(), key=lambda item: item[1][0])
+        return [{'id': product_id, 'name': name} for product_id, (_, name) in top]
+
+    def lookup(self, prefix, limit=MAX_SUGGESTIONS):
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        if len(prefix) <= SHORT_PREFIX and limit <= MAX_SUGGESTIONS:
+            return [dict(hit) for hit in self.short.get(prefix, [])[:limit]]
+        start = bisect.bisect_left(self.keys, prefix)
+        stop = bisect.bisect_left(self.keys, prefix + '\uffff', lo=start)
+        return self._top(self.entries[start:stop], limit)
+
+
+_lock = threading.Lock()
+_state = {'version': None, 'index': None}
+
+
+def _load_index():
+    return PrefixIndex(
+        Product.objects.filter(stock_quantity__gt=0).exclude(name__isnull=True).values_list('id', 'name')
+    )
+
+
+def get_index():
+    version = catalog_version()
+    index = _state['index']
+    if index is not None and (version is None or version == _state['version']):
+        return index
+    with _lock:
+        # Another thread may have rebuilt while we waited
+        if _state['index'] is None or _state['version'] != version:
+            _state['index'] = _load_index()
+            _state['version'] = version
+        return _state['index']
+
+
+def _candidates(prefix):
+    """In-stock products whose name contains the prefix's first word, name starts first."""
+    words = normalize(prefix).split()
+    if not words:
+        return []
+    return (
+        Product.objects.filter(stock_quantity__gt=0, name__icontains=words[0])
+        .annotate(starts=Case(
+            When(name__istartswith=words[0], then=Value(0)), default=Value(1), output_field=IntegerField(),
+        ))
+        .order_by('starts', 'name')
+        .values_list('id', 'name')[:CANDIDATE_LIMIT]
+    )
+
+
+def suggest(prefix, limit=MAX_SUGGESTIONS):
+    if not getattr(settings, 'SHARED_CACHE', False):
+        return PrefixIndex(_candidates(prefix)).lookup(prefix, limit)
+    return get_index().lookup(prefix, limit)
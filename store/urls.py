@@ -11,6 +11,12 @@ urlpatterns = [
     # Defines the URL name 'store:store'
     path('', views.store_view, name='store'), 
     
+    # Next page of a storefront category section (AJAX, keyset-paginated)
+    path('sections/<str:section_id>/products/', views.section_products_view, name='section_products'),
+    
+    # Search box autocomplete (AJAX, served from the in-memory typeahead index)
+    path('suggest/', views.product_suggest_view, name='product_suggest'),
+    
     # Defines the URL name 'store:product_detail'
     path('product/<int:pk>/', views.product_detail_view, name='product_detail'), 
     
@@ -26,9 +32,15 @@ urlpatterns = [
     # Defines the URL name 'store:update_item' (for AJAX)
     path('update_item/', views.update_item, name='update_item'), 
     
+    # Several cart changes in one round-trip (AJAX): steppers, "Buy again"
+    path('update_cart/', views.update_cart, name='update_cart'), 
+    
     # Defines the URL name 'store:process_order' (for AJAX)
     path('process_order/', views.process_order, name='process_order'), 
     
+    # Paystack server-to-server event callback (charge.success)
+    path('payments/paystack/webhook/', views.paystack_webhook, name='paystack_webhook'),
+    
     # Policy Pages
     path('privacy-policy/', views.privacy_policy_view, name='privacy_policy'),
     path('terms-conditions/', views.terms_conditions_view, name='terms_conditions'),
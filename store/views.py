@@ -1,5 +1,6 @@
 # store/views.py (FINAL UPDATED - MANUAL AUTHENTICATION LOGIC WITH NEXT/ACTIVE CHECKS)
 from django.shortcuts import render, redirect, get_object_or_404
+from django.db import transaction
 from django.db.models import Sum 
 from django.db.models import Q 
 from django.http import JsonResponse, HttpResponse
@@ -20,6 +21,9 @@ from .models import PageView
 # --- CRITICAL IMPORTS ---
 from store.models import Product, Order, OrderItem, ProductImage, Customer, ShippingAddress, ActivityLog 
 from store.utils import cartData 
+from store.cart import get_request_cart
+from store.idempotency import idempotent
+from store import page_views, reservations, rollups
 from store.forms import ProductForm, ProductEditForm 
 from services.models import ServiceRequest, QuoteMessage, ServiceAttachment 
 from services.forms import ServiceRequestForm, AttachmentFormSet 
@@ -29,6 +33,8 @@ from django.contrib.auth.forms import AuthenticationForm
 from allauth.account.models import EmailAddress
 # -------------------------------------------------------------------------------------
 
+logger = logging.getLogger(__name__)
+
 # Define the Image Formset (E-commerce related)
 ImageFormSet = inlineformset_factory(
     Product, 
@@ -40,18 +46,11 @@ ImageFormSet = inlineformset_factory(
 
 # --- UTILITY FUNCTIONS ---
 def get_customer_or_create(request):
-    """Utility function to safely get or create a Customer profile for an authenticated user."""
-    customer = None
-    if request.user.is_authenticated:
-        try:
-            customer = request.user.customer
-        except Customer.DoesNotExist:
-            customer = Customer.objects.create(
-                user=request.user,
-                name=request.user.username,
-                email=request.user.email
-            )
-    return customer
+    """Utility function to safely get or create a Customer profile for an authenticated user.
+
+    Resolved once per request and shared with cartData (see store/cart.py).
+    """
+    return get_request_cart(request).customer
 
 
 def is_staff_user(user):
@@ -221,42 +220,106 @@ def home_view(request):
     return render(request, 'store/home.html', context)
 
 
+SEARCH_RESULTS_PER_PAGE = 24
+
+
 def store_view(request):
     """The main user-facing shop page - grouped by categories."""
-    from .models import Category
-    from django.db.models import Count, Q
+    from django.core.paginator import Paginator
+    from store import facets, search, storefront_cache
     data = cartData(request) 
     
     # Get search query from URL parameters
     search_query = request.GET.get('search', '').strip()
+    active_filters = facets.parse_filters(request.GET)
+    # Price sorting uses the indexed Product.effective_price column
+    sort = request.GET.get('sort', '')
+    if sort not in storefront_cache.SORTS:
+        sort = ''
     
     if search_query:
-        # If searching, show all matching products (not grouped by category) with stock > 0
-        products = Product.objects.filter(name__icontains=search_query, stock_quantity__gt=0)
+        # If searching, show ranked in-stock matches (not grouped by category), one page at a time
+        results = search.search_products(search_query, sort)
+        page_obj = Paginator(results, SEARCH_RESULTS_PER_PAGE).get_page(request.GET.get('page'))
         context = {
-            'products': products,
+            'products': page_obj.object_list,
+            'page_obj': page_obj,
             'search_query': search_query,
+            'sort': sort,
+            'cartItems': data['cartItems']
+        }
+    elif active_filters or sort:
+        # Filtered/sorted view: one keyset page of matching products, no per-category grouping
+        after = request.GET.get('after')
+        cursor = storefront_cache.decode_cursor(after) if after else None
+        page, next_cursor = storefront_cache.product_page(
+            facets.filter_products(active_filters), after=cursor, limit=SEARCH_RESULTS_PER_PAGE, sort=sort
+        )
+        next_params = request.GET.copy()
+        next_params['after'] = next_cursor or ''
+        context = {
+            'filtered_cards': storefront_cache.render_product_cards(page),
+            'next_page_query': next_params.urlencode() if next_cursor else '',
+            'is_listing': True,
             'cartItems': data['cartItems']
         }
     else:
-        # Normal view: Get only categories that have at least one product with stock > 0
-        categories = Category.objects.annotate(
-            product_count=Count('products', filter=Q(products__stock_quantity__gt=0))
-        ).filter(product_count__gt=0).order_by('display_order', 'name').prefetch_related('products')
-        
-        # Get products without any category, but only if stock > 0
-        uncategorized_products = Product.objects.filter(categories__isnull=True, stock_quantity__gt=0)
-        
+        # Normal view: category sections (and the product cards inside them) are
+        # rendered once and served from the cache until the catalog changes.
         context = {
-            'categories': categories,
-            'uncategorized_products': uncategorized_products,
+            'storefront_sections': storefront_cache.get_storefront_sections(),
             'cartItems': data['cartItems']
         }
+
+    if not search_query:
+        context['facet_panel'] = facets.facet_panel()
+        context['active_filters'] = active_filters
+        context['sort'] = sort
     
     return render(request, 'store/store_front.html', context) 
 
+def section_products_view(request, section_id):
+    """AJAX: the next page of product cards for one storefront section.
+
+    Pages are addressed by the keyset cursor in ``?after=`` (see storefront_cache.product_page),
+    so fetching page 50 costs the same as fetching page 2.
+    """
+    from store import storefront_cache
+
+    products = storefront_cache.section_products(section_id)
+    if products is None:
+        return JsonResponse({'message': 'Unknown section.'}, status=404)
+
+    after = request.GET.get('after')
+    cursor = storefront_cache.decode_cursor(after) if after else None
+    if after and cursor is None:
+        return JsonResponse({'message': 'Invalid cursor.'}, status=400)
+
+    page, next_cursor = storefront_cache.product_page(products, after=cursor)
+    return JsonResponse({
+        'html': ''.join(storefront_cache.render_product_cards(page)),
+        'count': len(page),
+        'next': next_cursor,
+    })
+
+def product_suggest_view(request):
+    """AJAX: product-name suggestions for the search box.
+
+    Answered from the per-process prefix index in store/typeahead.py, so no query hits the database
+    (one bounded query per keystroke when the cache isn't shared; see SHARED_CACHE).
+    """
+    from django.urls import reverse
+    from store import typeahead
+
+    prefix = request.GET.get('q', '').strip()[:100]
+    results = typeahead.suggest(prefix) if prefix else []
+    for result in results:
+        result['url'] = reverse('store:product_detail', kwargs={'pk': result['id']})
+    return JsonResponse({'results': results})
+
 def product_detail_view(request, pk):
     """Displays the details of a single product."""
+    from store import recommendations
     data = cartData(request) 
     product = get_object_or_404(Product, pk=pk)
     images = product.images.all() 
@@ -265,28 +328,34 @@ def product_detail_view(request, pk):
         'product': product,
         'images': images,
         'cartItems': data['cartItems'],
+        # Precomputed offline (manage.py build_recommendations)
+        'recommended_products': recommendations.for_product(product.pk),
     }
     return render(request, 'store/product_detail.html', context)
 
 
 def cart_view(request):
     """Displays the user's shopping cart."""
+    from store import recommendations
     data = cartData(request) 
     
-    if request.user.is_authenticated:
-        customer = get_customer_or_create(request)
-        if customer:
-            order, created = Order.objects.get_or_create(customer=customer, complete=False)
-            items = order.orderitem_set.all()
-        else:
-            items = []
-            order = {'get_cart_total': 0, 'get_cart_items': 0, 'shipping': False}
+    # Logged-in customers get their open Order; guests a GuestOrder over the cart cookie
+    cart = get_request_cart(request)
+    if cart.order is not None:
+        order = cart.order
+        items = cart.items
     else:
-        # Handle anonymous user data through cookies/session (handled in utils.py)
-        items = data['items']
-        order = data['order']
+        # No cart yet (carts are only created by update_item)
+        items = []
+        order = {'get_cart_total': 0, 'get_cart_items': 0, 'shipping': False}
         
-    context = {'items': items, 'order': order, 'cartItems': data['cartItems']} 
+    product_ids = [item.product_id for item in items if getattr(item, 'product_id', None)]
+    context = {
+        'items': items,
+        'order': order,
+        'cartItems': data['cartItems'],
+        'recommended_products': recommendations.for_cart(product_ids),
+    }
     return render(request, 'store/cart.html', context)
 
 
@@ -303,7 +372,7 @@ def orders_view(request):
     orders = Order.objects.filter(
         customer=customer, 
         complete=True
-    ).order_by('-date_ordered').prefetch_related('orderitem_set__product__images')
+    ).with_totals().order_by('-date_ordered').prefetch_related('orderitem_set__product')
     
     data = cartData(request)
     
@@ -317,20 +386,21 @@ def orders_view(request):
 def checkout_view(request):
     """Displays the user's checkout page."""
     from django.conf import settings
+    from django.contrib.auth.views import redirect_to_login
+    if not request.user.is_authenticated:
+        # Payment needs an account; the guest cart is merged into it on login
+        return redirect_to_login(request.get_full_path())
     data = cartData(request) 
     
-    if request.user.is_authenticated:
-        customer = get_customer_or_create(request)
-        if customer:
-            order, created = Order.objects.get_or_create(customer=customer, complete=False)
-            items = order.orderitem_set.all()
-        else:
-            items = []
-            order = {'get_cart_total': 0, 'get_cart_items': 0, 'shipping': False}
+    # Logged-in customers get their open Order; guests a GuestOrder over the cart cookie
+    cart = get_request_cart(request)
+    if cart.order is not None:
+        order = cart.order
+        items = cart.items
     else:
-        # Handle anonymous user data through cookies/session (handled in utils.py)
-        items = data['items']
-        order = data['order']
+        # No cart yet (carts are only created by update_item)
+        items = []
+        order = {'get_cart_total': 0, 'get_cart_items': 0, 'shipping': False}
         
     context = {
         'items': items, 
@@ -341,6 +411,7 @@ def checkout_view(request):
     return render(request, 'store/checkout.html', context) 
 
 
+@idempotent
 def update_item(request):
     """Handles AJAX requests to add, remove, change quantity, or clear the entire cart."""
     
@@ -356,16 +427,18 @@ def update_item(request):
          return JsonResponse({'message': 'Missing action.'}, safe=False, status=400)
     
     if request.user.is_authenticated:
-        customer = get_customer_or_create(request) 
+        cart = get_request_cart(request)
+        customer = cart.customer
         
         if not customer:
             return JsonResponse({'message': 'Error retrieving customer profile.'}, safe=False, status=500)
             
-        order, created = Order.objects.get_or_create(customer=customer, complete=False)
-
         # --- LOGIC FOR CLEAR CART ---
         if action == 'clear':
-            order.orderitem_set.all().delete()
+            if cart.order is not None:
+                cart.order.orderitem_set.all().delete()
+                reservations.release(cart.order)
+            cart.refresh_summary()
             
             updated_data = cartData(request) 
             new_cart_items = updated_data['cartItems']
@@ -379,46 +452,176 @@ def update_item(request):
             product = Product.objects.get(id=productId)
         except Product.DoesNotExist:
             return JsonResponse({'message': 'Product not found.'}, safe=False, status=404)
-            
-        orderItem, created = OrderItem.objects.get_or_create(order=order, product=product)
-
-        if action == 'add':
-            # Check if adding one more would exceed available stock
-            if orderItem.quantity + 1 > product.stock_quantity:
-                return JsonResponse({
-                    'message': f'Cannot add more. Only {product.stock_quantity} units available in stock.',
-                    'cartItems': cartData(request)['cartItems'],
-                    'error': 'insufficient_stock'
-                }, safe=False, status=400)
-            orderItem.quantity += 1
-        elif action == 'remove':
-            orderItem.quantity -= 1
-        elif action == 'delete': 
-            orderItem.quantity = 0
-
-        orderItem.save()
-
-        if orderItem.quantity <= 0:
-            orderItem.delete()
 
+        # The cart (open order) is created lazily, on the first item added
+        order = cart.get_or_create_order() if action == 'add' else cart.order
+        if order is None:
+            return JsonResponse({'message': 'Item is not in the cart.', 'cartItems': 0}, safe=False, status=400)
+            
+        # The line and its stock hold change together: a failure part-way leaves neither
+        # a zero-quantity line nor a hold that doesn't match the cart (as in apply_batch)
+        try:
+            with transaction.atomic():
+                orderItem, _ = OrderItem.objects.get_or_create(order=order, product=product)
+
+                if action == 'add':
+                    # Hold the extra unit for this cart; fails if other carts already hold the rest of the stock
+                    reservations.hold(order, {product.pk: orderItem.quantity + 1})
+                    orderItem.quantity += 1
+                elif action == 'remove':
+                    orderItem.quantity -= 1
+                elif action == 'delete': 
+                    orderItem.quantity = 0
+
+                if action != 'add':
+                    reservations.hold(order, {product.pk: max(orderItem.quantity, 0)})
+                orderItem.save()
+
+                if orderItem.quantity <= 0:
+                    orderItem.delete()
+        except reservations.InsufficientStock as exc:
+            return JsonResponse({
+                'message': f'Cannot add more. Only {exc.available} units available in stock.',
+                'cartItems': cartData(request)['cartItems'],
+                'error': 'insufficient_stock'
+            }, safe=False, status=400)
+
+        cart.refresh_summary()
         updated_data = cartData(request) 
         new_cart_items = updated_data['cartItems']
         
         return JsonResponse({'message': 'Item was updated', 'cartItems': new_cart_items}, safe=False)
     
-    return JsonResponse({'message': 'User is not authenticated (requires cookie handling logic).'}, safe=False, status=403)
+    return _update_guest_cart(request, productId, action)
+
+
+def _update_guest_cart(request, productId, action):
+    """update_item for anonymous visitors: the cart lives in a signed cookie, so nothing is written to the DB."""
+    from store import guest_cart
 
+    cart = get_request_cart(request)
+    lines = dict(cart.guest_lines)
 
+    if action == 'clear':
+        lines = {}
+        message = 'Cart successfully cleared.'
+    else:
+        if not productId:
+            return JsonResponse({'message': 'Missing productId for add/remove/delete action.'}, safe=False, status=400)
+        try:
+            product = Product.objects.get(id=productId)
+        except (Product.DoesNotExist, ValueError):
+            return JsonResponse({'message': 'Product not found.'}, safe=False, status=404)
+        try:
+            guest_cart.apply(lines, product, action)
+        except guest_cart.CartError as exc:
+            return JsonResponse({
+                'message': exc.message,
+                'cartItems': cart.item_count,
+                'error': exc.code,
+            }, safe=False, status=400)
+        message = 'Item was updated'
+
+    cart.set_guest_lines(lines)
+    response = JsonResponse({'message': message, 'cartItems': cart.item_count}, safe=False)
+    guest_cart.write(response, lines)
+    return response
+
+
+@idempotent
+def update_cart(request):
+    """Batch version of update_item: applies a list of cart operations in one request (AJAX).
+
+    Body: {"operations": [{"productId": 12, "action": "add|remove|set|delete|clear", "quantity": 2}, ...]}.
+    Operations run in order inside one transaction; if any of them fails nothing is applied.
+    """
+    from store import guest_cart
+    from store.cart import apply_batch, parse_operations
+
+    if request.method != 'POST':
+        return JsonResponse({'message': 'POST required.'}, safe=False, status=405)
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'message': 'Invalid JSON body.'}, safe=False, status=400)
+
+    cart = get_request_cart(request)
+    if request.user.is_authenticated and not cart.customer:
+        return JsonResponse({'message': 'Error retrieving customer profile.'}, safe=False, status=500)
+
+    try:
+        operations = parse_operations(data)
+        lines = apply_batch(cart, operations)
+    except guest_cart.CartError as exc:
+        return JsonResponse({
+            'message': exc.message,
+            'error': exc.code,
+            'operation': exc.index,
+            'cartItems': cart.item_count,
+        }, safe=False, status=404 if exc.code == 'not_found' else 400)
+
+    response = JsonResponse({
+        'message': 'Cart updated',
+        'cartItems': cart.summary['count'],
+        'cart': cart.summary,
+    }, safe=False)
+    if not request.user.is_authenticated:
+        guest_cart.write(response, lines)
+    return response
+
+
+def _build_shipping_address(customer, order, data):
+    """Unsaved ShippingAddress from the checkout form; KeyError / TypeError if it's missing."""
+    return ShippingAddress(
+        customer=customer,
+        order=order,
+        address=data['shipping']['address'],
+        city=data['shipping']['city'],
+        state=data['shipping']['state'],
+        zipcode=data['shipping']['zipcode'],
+        country=data['shipping']['country'],
+    )
+
+
+@idempotent
 def process_order(request):
     """Handles the final submission of an order from the checkout page with Paystack payment verification."""
-    import requests
     from django.conf import settings
+    from store import payments
+    from store.models import PaymentConfirmation
     
     data = json.loads(request.body)
     
     if request.user.is_authenticated:
-        customer = get_customer_or_create(request)
-        order, created = Order.objects.get_or_create(customer=customer, complete=False)
+        cart = get_request_cart(request)
+        customer = cart.customer
+        payment_reference = data.get('payment_reference')
+        
+        if payment_reference:
+            paid = Order.objects.filter(
+                customer=customer, payments__reference=payment_reference,
+                payments__status=PaymentConfirmation.STATUS_CONFIRMED,
+            ).first()
+            if paid is not None:
+                # A client retry, or the webhook completed the order first: only the address is missing
+                if paid.shipping and not ShippingAddress.objects.filter(order=paid).exists():
+                    try:
+                        _build_shipping_address(customer, paid, data).save()
+                    except (KeyError, TypeError):
+                        pass
+                cart.reset()
+                cart.refresh_summary()
+                return JsonResponse({
+                    'message': 'Payment confirmed and order completed',
+                    'order_id': paid.id,
+                    'transaction_id': payment_reference
+                })
+        
+        order = cart.order
+        if order is None:
+            return JsonResponse({'error': 'Cart is empty'}, status=400)
+        # Load the items (and their products) once for the total check, stock deduction and shipping
+        cart.items
         
         # --- 1. Security Check: Verify Total ---
         total = float(data['form']['total'])
@@ -426,69 +629,57 @@ def process_order(request):
              print(f"SECURITY ALERT: Total mismatch! Client: {total}, Server: {order.get_cart_total}")
              return JsonResponse({'error': 'Total mismatch'}, status=400)
         
-        # --- 2. Verify Paystack Payment ---
-        payment_reference = data.get('payment_reference')
-        if payment_reference:
-            # Verify payment with Paystack API
-            headers = {
-                'Authorization': f'Bearer {settings.PAYSTACK_SECRET_KEY}',
-                'Content-Type': 'application/json'
-            }
-            verify_url = f'https://api.paystack.co/transaction/verify/{payment_reference}'
-            
+        # Hold every line for the length of the payment check (tops up carts without a reservation)
+        quantities = {item.product_id: item.quantity for item in cart.items if item.product_id and item.quantity > 0}
+        try:
+            reservations.hold(order, quantities)
+        except reservations.InsufficientStock as exc:
+            if not payment_reference:
+                return JsonResponse({'error': 'insufficient_stock', 'product_id': exc.product_id, 'available': exc.available}, status=409)
+            # Already charged: confirm_payment verifies it and records the refund if stock really is short
+        
+        # --- 2. Shipping address (validated now, saved with the order) ---
+        shipping_address = None
+        if order.shipping:
             try:
-                response = requests.get(verify_url, headers=headers)
-                payment_data = response.json()
-                
-                if not payment_data.get('status') or payment_data['data']['status'] != 'success':
-                    return JsonResponse({'error': 'Payment verification failed'}, status=400)
-                
-                # Check if amount matches (Paystack returns in kobo/pesewas)
-                paid_amount = payment_data['data']['amount'] / 100
-                if round(paid_amount, 2) != round(total, 2):
-                    return JsonResponse({'error': 'Payment amount mismatch'}, status=400)
-                    
-                # Store payment reference as transaction ID
-                transaction_id = payment_reference
-                
-            except Exception as e:
-                print(f"Paystack verification error: {e}")
-                return JsonResponse({'error': 'Payment verification failed'}, status=400)
-        else:
-            # Fallback to timestamp if no payment reference (for testing)
-            transaction_id = str(timezone.now().timestamp())
-             
-        # --- 3. Finalize Order ---
-        order.transaction_id = transaction_id
-        order.complete = True
-        # Clear any existing expected_delivery - admin will set it later if needed
-        order.expected_delivery = None
-        order.save()
+                shipping_address = _build_shipping_address(customer, order, data)
+            except (KeyError, TypeError):
+                return JsonResponse({'error': 'Missing shipping address'}, status=400)
         
-        # --- 4. Deduct Stock and Log Sales ---
-        for item in order.orderitem_set.all():
-            item.product.stock_quantity -= item.quantity
-            item.product.save()
-            
-            ActivityLog.objects.create(
-                user=request.user,
-                action_type='SALE',
-                description=f"Order {order.id} sold {item.quantity} units of '{item.product.name}'. Stock reduced to {item.product.stock_quantity}.",
-                object_id=item.product.pk,
-                object_repr=item.product.name
-            )
+        # --- 3. Verify the Paystack payment and finalize the order (once per reference) ---
+        # The charge.success webhook may get there first; see store/payments.py
+        try:
+            if payment_reference:
+                confirmation = payments.confirm_payment(
+                    payment_reference, order, PaymentConfirmation.SOURCE_CHECKOUT,
+                    user=request.user, items=cart.items, shipping_address=shipping_address,
+                )
+                if confirmation.status == PaymentConfirmation.STATUS_NEEDS_REFUND:
+                    # A retry of a checkout that was paid for but couldn't be filled
+                    return _paid_but_unfilled(order, payment_reference)
+                if confirmation.status != PaymentConfirmation.STATUS_CONFIRMED:
+                    # Another request (usually the webhook) is finalizing this payment right now
+                    return JsonResponse({'message': 'Payment received; the order is being confirmed', 'order_id': order.id}, status=202)
+                transaction_id = payment_reference
+            elif settings.DEBUG and getattr(settings, 'ALLOW_UNPAID_CHECKOUT', False):
+                # Local testing without Paystack; never honoured outside DEBUG
+                transaction_id = str(timezone.now().timestamp())
+                payments.finalize_order(order, transaction_id, user=request.user, items=cart.items, shipping_address=shipping_address)
+            else:
+                return JsonResponse({'error': 'Missing payment reference'}, status=400)
+        except payments.PaymentError as exc:
+            logger.warning("Paystack verification failed for order %s (%s): %s", order.id, exc.code, exc.message)
+            # Paystack being unreachable says nothing about the payment: answer 503 so the
+            # response is not kept for the Idempotency-Key and the client's retry verifies again
+            status = 503 if exc.code == 'upstream_error' else 400
+            return JsonResponse({'error': 'Payment verification failed', 'reason': exc.code}, status=status)
+        except reservations.InsufficientStock:
+            # Logged and recorded as NEEDS_REFUND by payments.confirm_payment
+            return _paid_but_unfilled(order, payment_reference)
         
-        # --- 5. Save Shipping Address ---
-        if order.shipping:
-            ShippingAddress.objects.create(
-                customer=customer,
-                order=order,
-                address=data['shipping']['address'],
-                city=data['shipping']['city'],
-                state=data['shipping']['state'],
-                zipcode=data['shipping']['zipcode'],
-                country=data['shipping']['country'],
-            )
+        # The completed order is no longer this request's cart; the next one starts empty
+        cart.reset()
+        cart.refresh_summary(empty=True)
         
         return JsonResponse({
             'message': 'Payment confirmed and order completed',
@@ -500,6 +691,34 @@ def process_order(request):
         return JsonResponse({'error': 'User not logged in'}, status=403)
 
 
+
+def _paid_but_unfilled(order, payment_reference):
+    return JsonResponse({
+        'error': 'insufficient_stock',
+        'message': 'Your payment was received, but an item sold out before the order could be completed. '
+                   'No order was placed and our team will refund you.',
+        'payment_taken': True,
+        'order_id': order.id,
+        'transaction_id': payment_reference,
+    }, status=409)
+
+
+@csrf_exempt
+def paystack_webhook(request):
+    """Paystack event callback. Signed with the secret key; duplicates are harmless (see store/payments.py)."""
+    from store import payments
+
+    if request.method != 'POST':
+        return HttpResponse(status=405)
+    if not payments.valid_signature(request.body, request.headers.get('X-Paystack-Signature', '')):
+        return HttpResponse(status=401)
+    try:
+        event = json.loads(request.body)
+    except json.JSONDecodeError:
+        return HttpResponse(status=400)
+    payments.handle_event(event)
+    return HttpResponse(status=200)
+
 # -------------------------------------------------------------------------------------
 # --- PORTAL/ADMIN VIEWS (SECURED WITH @user_passes_test) ---
 # -------------------------------------------------------------------------------------
@@ -726,10 +945,8 @@ def inventory_dashboard(request):
     # Get search query from URL parameters
     product_search = request.GET.get('product_search', '').strip()
     
-    # Calculate total sold from COMPLETED orders only
-    product_sales = Product.objects.annotate(
-        total_sold=Sum('orderitem__quantity', filter=Q(orderitem__order__complete=True))
-    )
+    # Units sold in COMPLETED orders, summed from the daily rollup (store/rollups.py)
+    product_sales = Product.objects.annotate(total_sold=rollups.units_sold())
     
     # Apply search filter if query exists
     if product_search:
@@ -740,7 +957,16 @@ def inventory_dashboard(request):
     from django.db.models import Value
     product_sales = product_sales.annotate(
         sold_count=Coalesce('total_sold', Value(0))
-    ).order_by('-sold_count', '-id')
+    )
+    # Optional price ordering (indexed Product.effective_price column)
+    product_sort = request.GET.get('sort', '')
+    if product_sort == 'price':
+        product_sales = product_sales.order_by('effective_price', 'id')
+    elif product_sort == '-price':
+        product_sales = product_sales.order_by('-effective_price', '-id')
+    else:
+        product_sort = ''
+        product_sales = product_sales.order_by('-sold_count', '-id')
     
     # --- ACTIVITY LOG ---
     latest_activities = ActivityLog.objects.all().order_by('-action_time')[:10] 
@@ -752,6 +978,7 @@ def inventory_dashboard(request):
     context = {
         'product_sales': product_sales,
         'product_search': product_search,
+        'product_sort': product_sort,
         'page_title': 'Inventory Dashboard',
         'latest_activities': latest_activities,
         'total_products': total_products, 
@@ -772,21 +999,16 @@ def portal_analytics(request):
     # Basic counts
     total_products = Product.objects.count()
     low_stock_count = Product.objects.filter(stock_quantity__lte=5).count()
-    total_orders = Order.objects.filter(complete=True).count()
     pending_orders = Order.objects.filter(status=Order.STATUS_PENDING).count()
 
-    # Revenue and average order value (completed orders)
-    completed_orders_qs = Order.objects.filter(complete=True)
-    total_revenue = sum(o.get_cart_total for o in completed_orders_qs)
-    avg_order_value = total_revenue / completed_orders_qs.count() if completed_orders_qs.count() > 0 else 0
+    # Completed orders, revenue and average order value from the daily rollup
+    sales = rollups.summary()
+    total_orders = sales['orders']
+    total_revenue = sales['revenue']
+    avg_order_value = sales['average']
 
     # Top selling products (by quantity sold in completed orders)
-    from django.db.models.functions import Coalesce
-    from django.db.models import Value
-
-    product_sales = Product.objects.annotate(
-        total_sold=Sum('orderitem__quantity', filter=Q(orderitem__order__complete=True))
-    ).annotate(sold_count=Coalesce('total_sold', Value(0))).order_by('-sold_count')[:10]
+    product_sales = Product.objects.annotate(sold_count=rollups.units_sold()).order_by('-sold_count', '-id')[:10]
 
     # Recent activity
     latest_activities = ActivityLog.objects.all().order_by('-action_time')[:10]
@@ -972,15 +1194,17 @@ def record_page_view(request):
         duration = data.get('duration')
         referrer = data.get('referrer') or request.META.get('HTTP_REFERER')
 
-        pv = PageView.objects.create(
-            path=path or '/',
-            title=title,
-            user=request.user if request.user.is_authenticated else None,
+        # Queued and written in batches (store/page_views.py); the beacon never waits on the database
+        page_views.record(PageView(
+            # JSON beacons can carry any type; a non-string that slipped through would fail the whole batch
+            path=str(path or '/')[:1024],
+            title=str(title)[:255] if title else None,
+            user_id=request.user.pk if request.user.is_authenticated else None,
             session_key=request.session.session_key or None,
-            referrer=referrer,
-            ip_address=request.META.get('REMOTE_ADDR') or request.META.get('HTTP_X_FORWARDED_FOR'),
+            referrer=str(referrer)[:1024] if referrer else None,
+            ip_address=(request.META.get('REMOTE_ADDR') or request.META.get('HTTP_X_FORWARDED_FOR') or '')[:45] or None,
             duration=float(duration) if duration not in (None, '') else None,
-        )
+        ))
 
         return JsonResponse({'status': 'ok'})
     except Exception as e:
@@ -989,59 +1213,85 @@ def record_page_view(request):
         return JsonResponse({'status': 'error', 'detail': str(e)}, status=500)
 
 
-@login_required(login_url=PORTAL_LOGIN_URL)
-@user_passes_test(is_staff_user, login_url=PORTAL_LOGIN_URL)
-def orders_list(request):
-    """Portal view: list orders for staff."""
-    # Filtering: keyword search (q) and optional date range (start_date, end_date)
+def _date_range(queryset, field, start_date, end_date):
+    """Filter ``field`` to [start_date, end_date] (YYYY-MM-DD, inclusive) as a half-open datetime range.
+
+    Comparing the column itself (rather than ``__date``) lets an index on it be used.
+    Unparseable or out-of-range dates (e.g. an end date of 9999-12-31) are ignored.
+    """
+    from datetime import datetime, time, timedelta
+
+    try:
+        if start_date:
+            sd = datetime.strptime(start_date, '%Y-%m-%d').date()
+            queryset = queryset.filter(**{f'{field}__gte': timezone.make_aware(datetime.combine(sd, time.min))})
+        if end_date:
+            ed = datetime.strptime(end_date, '%Y-%m-%d').date() + timedelta(days=1)
+            queryset = queryset.filter(**{f'{field}__lt': timezone.make_aware(datetime.combine(ed, time.min))})
+    except (ValueError, OverflowError):
+        pass
+    return queryset
+
+
+def _filter_portal_orders(request):
+    """Completed orders matching the portal filters (q, start_date, end_date); shared by the list and its export."""
+    from django.db.models import Exists, OuterRef
+
     # Only show complete orders (exclude incomplete carts)
-    orders = Order.objects.filter(complete=True).select_related('customer').order_by('-date_ordered')
+    # Per-row totals/item counts are annotated in SQL (OrderQuerySet.with_totals)
+    orders = Order.objects.filter(complete=True).select_related('customer').with_totals()
 
     q = request.GET.get('q', '').strip()
     start_date = request.GET.get('start_date', '').strip()
     end_date = request.GET.get('end_date', '').strip()
 
     if q:
-        from django.db.models import Q
-        filters = Q(customer__name__icontains=q) | Q(transaction_id__icontains=q) | Q(pk__iexact=q) | Q(orderitem__product__name__icontains=q)
-        orders = orders.filter(filters).distinct()
+        # EXISTS instead of joining order items, so matches don't fan out (and need no DISTINCT)
+        filters = Q(customer__name__icontains=q) | Q(transaction_id__icontains=q) | Q(
+            Exists(OrderItem.objects.filter(order=OuterRef('pk'), product__name__icontains=q))
+        )
+        if q.isdigit():
+            filters |= Q(pk=int(q))
+        orders = orders.filter(filters)
 
-    # Date filters expect YYYY-MM-DD
-    try:
-        if start_date:
-            sd = timezone.datetime.strptime(start_date, '%Y-%m-%d').date()
-            orders = orders.filter(date_ordered__date__gte=sd)
-        if end_date:
-            ed = timezone.datetime.strptime(end_date, '%Y-%m-%d').date()
-            orders = orders.filter(date_ordered__date__lte=ed)
-    except Exception:
-        # Ignore parse errors and continue with unfiltered dates
-        pass
+    orders = _date_range(orders, 'date_ordered', start_date, end_date)
+    return orders, q, start_date, end_date
 
-    # Calculate statistics for the filtered orders
-    from django.db.models import Sum, Count, Q
-    from django.views.decorators.csrf import csrf_exempt
-    from django.http import JsonResponse
-    import json
 
-    from .models import PageView
-    
-    total_orders = orders.count()
-    completed_orders = orders.filter(status='COMPLETED').count()
-    processing_orders = orders.filter(status='PROCESSING').count()
-    shipped_orders = orders.filter(status='SHIPPED').count()
-    pending_orders = orders.filter(status='PENDING').count()
-    
-    # Total products ordered (sum of all quantities)
-    total_products = orders.aggregate(
-        total=Sum('orderitem__quantity')
-    )['total'] or 0
-    
-    # Total revenue from filtered orders
-    total_revenue = sum(order.get_cart_total for order in orders)
-    
-    # Average order value
-    avg_order_value = total_revenue / total_orders if total_orders > 0 else 0
+@login_required(login_url=PORTAL_LOGIN_URL)
+@user_passes_test(is_staff_user, login_url=PORTAL_LOGIN_URL)
+def orders_list(request):
+    """Portal view: list orders for staff."""
+    from django.conf import settings
+    from django.utils.http import urlencode
+
+    # Filtering: keyword search (q) and optional date range (start_date, end_date)
+    orders, q, start_date, end_date = _filter_portal_orders(request)
+
+    # Statistics for the filtered orders: status counts, items, revenue and average in one query
+    stats = orders.summary()
+    total_orders = stats['count']
+    completed_orders = stats['completed']
+    processing_orders = stats['processing']
+    shipped_orders = stats['shipped']
+    pending_orders = stats['pending']
+    total_products = stats['items']
+    total_revenue = stats['revenue']
+    avg_order_value = stats['average']
+
+    # One keyset page of rows (newest first); ?after=<cursor> continues from the previous page
+    page_size = getattr(settings, 'PORTAL_ORDERS_PAGE_SIZE', 50)
+    orders, next_cursor = orders.newest_first_page(request.GET.get('after', ''), page_size)
+    next_page_query = None
+    if next_cursor:
+        params = request.GET.copy()
+        params['after'] = next_cursor
+        next_page_query = params.urlencode()
+    first_page_query = None
+    if request.GET.get('after'):
+        params = request.GET.copy()
+        params.pop('after', None)
+        first_page_query = params.urlencode()
 
     context = {
         'orders': orders,
@@ -1058,6 +1308,11 @@ def orders_list(request):
         'total_products': total_products,
         'total_revenue': total_revenue,
         'avg_order_value': avg_order_value,
+        # Current filters as a query string, for the export links
+        'filter_query': urlencode({'q': q, 'start_date': start_date, 'end_date': end_date}),
+        # Pagination
+        'next_page_query': next_page_query,
+        'first_page_query': first_page_query,
     }
     return render(request, 'store/orders_list.html', context)
 
@@ -1066,7 +1321,7 @@ def orders_list(request):
 @user_passes_test(is_staff_user, login_url=PORTAL_LOGIN_URL)
 def order_detail(request, pk):
     """Portal view: show a single order and its items."""
-    order = get_object_or_404(Order, pk=pk)
+    order = get_object_or_404(Order.objects.with_totals(), pk=pk)
 
     # Handle staff updates: change status and expected_delivery
     if request.method == 'POST':
@@ -1314,38 +1569,90 @@ def edit_product(request, pk):
     return render(request, 'store/edit_product.html', context)
 
 
-@login_required(login_url=PORTAL_LOGIN_URL)
-@user_passes_test(is_staff_user, login_url=PORTAL_LOGIN_URL)
-def all_activity_log_view(request):
-    logs = ActivityLog.objects.all().order_by('-action_time')
-    
+def _filter_activity_logs(request):
+    logs = ActivityLog.objects.select_related('user').order_by('-action_time')
+
     # 1. Date Range Filtering
     start_date = request.GET.get('start_date')
     end_date = request.GET.get('end_date')
-    
-    if start_date:
-        logs = logs.filter(action_time__date__gte=start_date)
-    if end_date:
-        logs = logs.filter(action_time__date__lte=end_date)
-        
-    # 2. Keyword Search Filtering
+    logs = _date_range(logs, 'action_time', start_date, end_date)
+
+    # 2. Keyword Search Filtering (user is a foreign key, so the join can't duplicate rows)
     keyword = request.GET.get('keyword')
     if keyword:
         logs = logs.filter(
             Q(description__icontains=keyword) |
             Q(user__username__icontains=keyword)
-        ).distinct()
-        
+        )
+    return logs, start_date, end_date, keyword
+
+
+@login_required(login_url=PORTAL_LOGIN_URL)
+@user_passes_test(is_staff_user, login_url=PORTAL_LOGIN_URL)
+def all_activity_log_view(request):
+    from django.utils.http import urlencode
+
+    logs, start_date, end_date, keyword = _filter_activity_logs(request)
+
     context = {
         'page_title': 'All Activity Logs',
         'activity_logs': logs,
         'start_date': start_date,
         'end_date': end_date,
         'keyword': keyword,
+        'filter_query': urlencode({'start_date': start_date or '', 'end_date': end_date or '', 'keyword': keyword or ''}),
     }
     return render(request, 'store/all_activity_log.html', context)
 
 
+# -------------------------------------------------------------------------------------
+# --- PORTAL EXPORTS (streamed; see store/exports.py) ---
+# -------------------------------------------------------------------------------------
+# ?format=csv (default) or ndjson, ?gzip=1 to compress on the fly; the list filters apply.
+
+def _export_options(request):
+    return request.GET.get('format', 'csv'), request.GET.get('gzip') in ('1', 'true', 'yes')
+
+
+@login_required(login_url=PORTAL_LOGIN_URL)
+@user_passes_test(is_staff_user, login_url=PORTAL_LOGIN_URL)
+def export_orders(request):
+    from . import exports
+
+    fmt, compress = _export_options(request)
+    orders = _filter_portal_orders(request)[0].order_by('-date_ordered', '-id')
+    return exports.stream(
+        'orders', exports.ORDER_FIELDS + exports.LINE_FIELDS, exports.order_rows(orders, fmt), fmt, compress,
+    )
+
+
+@login_required(login_url=PORTAL_LOGIN_URL)
+@user_passes_test(is_staff_user, login_url=PORTAL_LOGIN_URL)
+def export_activity_log(request):
+    from . import exports
+
+    fmt, compress = _export_options(request)
+    logs = _filter_activity_logs(request)[0]
+    return exports.stream('activity-log', exports.ACTIVITY_FIELDS, exports.activity_rows(logs), fmt, compress)
+
+
+@login_required(login_url=PORTAL_LOGIN_URL)
+@user_passes_test(is_staff_user, login_url=PORTAL_LOGIN_URL)
+def export_page_views(request):
+    """Raw page views, filtered by start_date / end_date and a path keyword (q)."""
+    from . import exports
+
+    fmt, compress = _export_options(request)
+    page_views = _date_range(
+        PageView.objects.order_by('-timestamp'), 'timestamp',
+        request.GET.get('start_date', '').strip(), request.GET.get('end_date', '').strip(),
+    )
+    q = request.GET.get('q', '').strip()
+    if q:
+        page_views = page_views.filter(path__icontains=q)
+    return exports.stream('page-views', exports.PAGE_VIEW_FIELDS, exports.page_view_rows(page_views), fmt, compress)
+
+
 # -------------------------------------------------------------------------------------
 # --- USER-FACING SERVICE VIEWS ---
 # -------------------------------------------------------------------------------------